@@ -1,10 +1,14 @@
 import os
-from flask import Flask, session, redirect, url_for, send_from_directory
+import time
+from flask import Flask, session, redirect, url_for, send_from_directory, request
 from authlib.integrations.flask_client import OAuth
 from dotenv import load_dotenv
 from config import Config
-from models import db, User
+from models import db, migrate_schema, User
 from routes import main
+from utils.jobs import job_queue
+from utils.metrics import metrics
+import tasks  # noqa: F401  registers the background job handlers
 
 # Load environment variables from .env file for configuration values
 load_dotenv()
@@ -28,18 +32,30 @@ def create_app():
         client_id=app.config['AUTH0_CLIENT_ID'],
         client_secret=app.config['AUTH0_CLIENT_SECRET'],
         client_kwargs={'scope': 'openid profile email'},
-        server_metadata_url=f"https://{app.config['AUTH0_DOMAIN']}/.well-known/openid-configuration"
+        server_metadata_url=f"{app.config['AUTH0_BASE_URL']}/.well-known/openid-configuration"
     )
     # Attach auth0 client to app for use in routes
     app.auth0 = auth0
 
+    # Background job queue for analysis and report generation
+    job_queue.init_app(app)
+    # Request timings, pipeline stage metrics and optional cProfile dumps
+    metrics.init_app(app)
+
     # Register blueprint(s) for main application routes
     app.register_blueprint(main)
 
+    @app.cli.command('init-db')
+    def init_db():
+        """Create missing database tables and add columns and indexes missing from existing ones."""
+        migrate_schema()
+        print("Database schema is up to date.")
+
     # Within application context, ensure database tables and folders exist
     with app.app_context():
-        # Create any missing database tables
-        db.create_all()
+        # Create or migrate the database tables, unless the process manager already did
+        if app.config['CREATE_TABLES_ON_START']:
+            migrate_schema()
         # Ensure upload and report directories exist
         os.makedirs(app.config.get('UPLOAD_FOLDER', 'uploads'), exist_ok=True)
         os.makedirs(app.config.get('REPORT_FOLDER', 'reports'), exist_ok=True)
@@ -75,15 +91,22 @@ def ensure_user_still_exists():
     """
     Before every request, confirm the user in session still exists in the DB.
     If the user record was removed, clear session and redirect to login.
+    A successful check is remembered in the session for USER_CHECK_TTL_SECONDS,
+    and static files are never checked.
     """
     user_info = session.get("user")
-    if user_info:
-        user_in_db = db.session.execute(
-            db.select(User).filter_by(email=user_info.get("email"))
-        ).scalar_one_or_none()
-        if not user_in_db:
-            session.clear()
-            return redirect(url_for("main.login"))
+    if not user_info or request.endpoint == 'static':
+        return
+    now = time.time()
+    if now - session.get("user_checked_at", 0) < app.config['USER_CHECK_TTL_SECONDS']:
+        return
+    user_in_db = db.session.execute(
+        db.select(User.id).filter_by(email=user_info.get("email"))
+    ).scalar_one_or_none()
+    if not user_in_db:
+        session.clear()
+        return redirect(url_for("main.login"))
+    session["user_checked_at"] = now
 
 @app.route('/logout')
 def logout():
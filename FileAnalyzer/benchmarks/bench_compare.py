@@ -0,0 +1,97 @@
+"""
+Dataset comparison benchmark.
+
+Run from the FileAnalyzer directory:
+    python -m benchmarks.bench_compare [--rows 1e6 1e7] [--changed 0.01]
+    python -m benchmarks.bench_compare --save bench_compare.json
+    python -m benchmarks.bench_compare --compare bench_compare.json --tolerance 1.25
+
+For each size, builds the row hashes of a file and of a next version with --changed
+of its rows replaced and as many appended, then times what a comparison costs
+instead of reading both files again:
+    store   splitting a file's hashes into buckets and writing its row set
+    diff    opening both row sets and counting removed, added and kept rows
+    shift   KS and PSI of one column from two stored 256-bin histograms
+and reports the size of a row set. With --compare the run exits non-zero when any
+case is slower than the saved result by more than the tolerance factor.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from utils.dedup import bucket_hashes, write_row_set, diff_row_sets
+from utils.compare import numeric_shift
+from utils.plotting import FINE_BINS
+
+
+def versions(rows, changed, seed=0):
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 2 ** 64, rows, dtype=np.uint64)
+    b = a.copy()
+    replaced = int(rows * changed)
+    b[rng.choice(rows, replaced, replace=False)] = rng.integers(0, 2 ** 64, replaced, dtype=np.uint64)
+    return a, np.concatenate([b, rng.integers(0, 2 ** 64, replaced, dtype=np.uint64)])
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def diff_files(path_a, path_b):
+    with np.load(path_a) as a, np.load(path_b) as b:
+        return diff_row_sets(a, b)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=float, nargs='+', default=[1e6, 1e7])
+    parser.add_argument('--changed', type=float, default=0.01, help='share of rows replaced, and appended')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare against a JSON file written with --save')
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    edges = np.linspace(-5, 5, FINE_BINS + 1)
+    bins_a = (edges, np.histogram(rng.normal(size=100_000), edges)[0])
+    bins_b = (edges, np.histogram(rng.normal(0.1, 1.1, size=100_000), edges)[0])
+
+    results = {}
+    print(f"{'rows':>12} {'row set MB':>11} {'store s':>8} {'diff s':>8} {'shift ms':>9} {'removed':>9} {'added':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in map(int, args.rows):
+            a, b = versions(rows, args.changed)
+            path_a, path_b = os.path.join(tmp, 'a.npz'), os.path.join(tmp, 'b.npz')
+            store, _ = timed(lambda: write_row_set(path_a, bucket_hashes(a)))
+            write_row_set(path_b, bucket_hashes(b))
+            diff, (removed, added, _) = timed(diff_files, path_a, path_b)
+            shift, _ = timed(numeric_shift, bins_a, bins_b)
+            results.update({f"{rows}-store": store, f"{rows}-diff": diff})
+            print(f"{rows:>12} {os.path.getsize(path_a) / 2 ** 20:>11.1f} {store:>8.3f} {diff:>8.3f}"
+                  f" {shift * 1000:>9.2f} {removed:>9} {added:>9}")
+            del a, b
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        regressions = [
+            f"{case}: {results[case]:.3f}s vs {saved[case]:.3f}s"
+            for case in results if case in saved and results[case] > saved[case] * args.tolerance
+        ]
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == '__main__':
+    main()
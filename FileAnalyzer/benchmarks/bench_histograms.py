@@ -0,0 +1,60 @@
+"""
+Histogram rendering benchmark.
+
+Run from the FileAnalyzer directory:
+    python -m benchmarks.bench_histograms [--rows 10000] [--workers 4]
+
+Reports the time per column for binning, serial rendering, pooled rendering
+and a fully cached re-render at 10, 100 and 1000 numeric columns.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from utils.plotting import compute_bins, render_histograms
+
+
+def synthetic_frame(rows, cols, seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.normal(size=(rows, cols)) * rng.uniform(1, 100, cols) + rng.uniform(-50, 50, cols)
+    data[rng.random((rows, cols)) < 0.05] = np.nan
+    return pd.DataFrame(data, columns=[f"col_{i}" for i in range(cols)])
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--columns', type=int, nargs='+', default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    print(f"{'columns':>8} {'bin ms/col':>11} {'serial ms/col':>14} {'pool ms/col':>12} {'cached ms/col':>14}")
+    for cols in args.columns:
+        df = synthetic_frame(args.rows, cols)
+        binned, t_bins = timed(compute_bins, df, list(df.columns))
+
+        out_dir = tempfile.mkdtemp()
+        try:
+            _, t_serial = timed(render_histograms, binned, out_dir, workers=1)
+            shutil.rmtree(out_dir)
+            _, t_pool = timed(render_histograms, binned, out_dir, workers=args.workers)
+            _, t_cached = timed(render_histograms, binned, out_dir, workers=args.workers)
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+        per_col = lambda t: 1000 * t / cols
+        print(f"{cols:>8} {per_col(t_bins):>11.3f} {per_col(t_serial):>14.2f} "
+              f"{per_col(t_pool):>12.2f} {per_col(t_cached):>14.3f}")
+
+
+if __name__ == '__main__':
+    main()
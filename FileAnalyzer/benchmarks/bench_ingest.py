@@ -0,0 +1,138 @@
+"""
+CSV ingestion benchmark.
+
+Run from the FileAnalyzer directory:
+    python -m benchmarks.bench_ingest [--rows 1e5 1e6]
+    python -m benchmarks.bench_ingest --save bench_ingest.json
+    python -m benchmarks.bench_ingest --compare bench_ingest.json --tolerance 1.25
+
+Writes a synthetic mixed CSV (floats, ints, low-cardinality text, dates, unique
+ids) and parses it with the old default call, pd.read_csv(path), and with the
+ingestion path: the schema sniffed once by utils.ingest, then read_frame with
+explicit types on pyarrow's multithreaded parser. Every parse runs in a fresh
+process so its peak resident memory can be reported next to its time and the
+size of the resulting frame. With --compare the run exits non-zero when the
+ingestion path got slower than the saved result by more than the tolerance.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+
+def write_csv(path, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'id': np.arange(rows).astype(str),
+        'amount': rng.normal(100, 15, rows).round(2),
+        'quantity': rng.integers(0, 50, rows),
+        'city': rng.choice(['Berlin', 'Paris', 'Madrid', 'Rome', 'Vienna', 'Prague'], rows),
+        'status': rng.choice(['open', 'closed', 'pending'], rows),
+        'created': (pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 10 ** 8, rows), unit='s'))
+        .strftime('%Y-%m-%d %H:%M:%S'),
+    })
+    df.loc[rng.random(rows) < 0.02, 'amount'] = np.nan
+    df.to_csv(path, index=False)
+
+
+def _status_kb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def _reset_peak():
+    """
+    Reset the peak resident size (Linux); returns False where that is not possible.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _parse(path, mode, schema, results):
+    # runs in a fresh process with the peak reset, so the peak belongs to this parse alone
+    from utils.storage import read_frame
+    if _reset_peak():
+        baseline, peak_of = _status_kb('VmRSS'), lambda: _status_kb('VmHWM')
+    else:
+        #ru_maxrss survives exec, so without a reset it may include the parent's peak
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_of = lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    df = pd.read_csv(path) if mode == 'default' else read_frame(path, schema=schema)
+    seconds = time.perf_counter() - start
+    peak = peak_of()
+    results.put({
+        'seconds': seconds,
+        'peak_mb': (peak - baseline) / 1024,
+        'frame_mb': df.memory_usage(deep=True).sum() / 2 ** 20,
+    })
+
+
+def measure(path, mode, schema=None):
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    process = ctx.Process(target=_parse, args=(path, mode, schema, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=float, nargs='+', default=[1e5, 1e6])
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare against a JSON file written with --save')
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    args = parser.parse_args()
+
+    from utils.ingest import infer_csv_schema
+    results = {}
+    print(f"{'rows':>10} {'path':>8} {'seconds':>8} {'peak MB':>8} {'frame MB':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in map(int, args.rows):
+            path = os.path.join(tmp, f"bench_{rows}.csv")
+            write_csv(path, rows)
+            start = time.perf_counter()
+            schema = infer_csv_schema(path)
+            sniff = time.perf_counter() - start
+            for mode in ('default', 'ingest'):
+                result = measure(path, mode, schema)
+                print(f"{rows:>10} {mode:>8} {result['seconds']:>8.3f} {result['peak_mb']:>8.1f} "
+                      f"{result['frame_mb']:>9.1f}")
+                results[f"{rows}-{mode}"] = result['seconds']
+            print(f"{rows:>10} {'sniff':>8} {sniff:>8.3f}   (once per upload)")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        regressions = [
+            f"{case}: {results[case]:.3f}s vs {saved[case]:.3f}s"
+            for case in results if case.endswith('-ingest') and case in saved
+            and results[case] > saved[case] * args.tolerance
+        ]
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Listing page latency benchmark.
+
+Run from the FileAnalyzer directory:
+    python -m benchmarks.bench_listings [--entries 10000] [--requests 50]
+    python -m benchmarks.bench_listings --save bench_listings.json
+    python -m benchmarks.bench_listings --compare bench_listings.json --tolerance 1.25
+
+Fills a throwaway SQLite database with one user owning --entries CSV records and
+as many PDF reports, then requests the CSV history (first and a deep page), the
+report history and the dashboard through the test client. Each page is timed
+with the current settings and with the previous behaviour: every entry on one
+page and the user looked up in the database on every request. p50 and p99 are
+printed per page. With --compare the run exits non-zero when a p99 with the
+current settings got slower than the saved result by more than the tolerance.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+PAGES = ('/mycsvs', '/mycsvs?before={middle}', '/reports', '/dashboard')
+
+
+def build_app(tmp, entries):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    from app import app
+    from models import db, User, CSVFile, PDFReport
+    with app.app_context():
+        db.session.add(User(sub='bench', name='Bench', email='bench@example.com'))
+        db.session.execute(db.insert(CSVFile), [
+            {'user_sub': 'bench', 'filename': f"data_{i}.csv", 'filepath': f"/data/data_{i}.csv"}
+            for i in range(entries)
+        ])
+        db.session.execute(db.insert(PDFReport), [
+            {'user_sub': 'bench', 'filename': f"data_{i}_analysis_report.pdf",
+             'filepath': f"/reports/data_{i}_analysis_report.pdf"}
+            for i in range(entries)
+        ])
+        db.session.commit()
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s['user'] = {'sub': 'bench', 'name': 'Bench', 'email': 'bench@example.com', 'picture': None}
+    return app, client
+
+
+def time_page(client, url, requests):
+    client.get(url)
+    seconds = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get(url)
+        seconds.append(time.perf_counter() - start)
+        assert response.status_code == 200, f"{url} answered {response.status_code}"
+    return float(np.percentile(seconds, 50)), float(np.percentile(seconds, 99))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=10_000)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare against a JSON file written with --save')
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        app, client = build_app(tmp, args.entries)
+        settings = {
+            'legacy': {'LISTING_PAGE_SIZE': args.entries + 1, 'USER_CHECK_TTL_SECONDS': 0},
+            'current': {key: app.config[key] for key in ('LISTING_PAGE_SIZE', 'USER_CHECK_TTL_SECONDS')},
+        }
+        print(f"{'page':>28} {'mode':>8} {'p50 ms':>8} {'p99 ms':>8}")
+        for url in PAGES:
+            url = url.format(middle=args.entries // 2)
+            for mode, overrides in settings.items():
+                app.config.update(overrides)
+                p50, p99 = time_page(client, url, args.requests)
+                print(f"{url:>28} {mode:>8} {p50 * 1000:>8.2f} {p99 * 1000:>8.2f}")
+                results[f"{url}-{mode}"] = p99
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        regressions = [
+            f"{case}: p99 {results[case] * 1000:.2f}ms vs {saved[case] * 1000:.2f}ms"
+            for case in results if case.endswith('-current') and case in saved
+            and results[case] > saved[case] * args.tolerance
+        ]
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""
+Worker startup time and memory benchmark.
+
+Run from the FileAnalyzer directory:
+    python -m benchmarks.bench_startup [--repeat 3] [--workers 2]
+    python -m benchmarks.bench_startup --save bench_startup.json
+    python -m benchmarks.bench_startup --compare bench_startup.json --tolerance 1.25
+
+Imports, in fresh interpreters:
+    lazy    `import app` and a first response from the login page, as a worker boots now
+    eager   the same plus the plotting, PDF and AI libraries the app used to import
+            at boot, for comparison
+reporting the median seconds and the peak RSS over --repeat runs.
+
+Then starts gunicorn (with gunicorn.conf.py) on a fresh SQLite database, once per
+mode: default, where every worker imports the app itself, and preload
+(GUNICORN_PRELOAD=1), where the master imports it and the heavy libraries before
+forking. For each it reports the time to the first answered request, the CPU
+seconds all processes spent booting, and RSS and PSS per worker and in total from
+/proc/<pid>/smaps_rollup. PSS divides shared pages among the processes sharing
+them, so its total is what the server really costs. Workers are measured idle:
+in default mode they have not imported the heavy libraries yet.
+
+With --compare the run exits non-zero when a figure got larger than the saved one
+by more than the tolerance.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import requests
+from benchmarks.loadtest import free_port, worker_pids
+
+# the libraries gunicorn.conf.py preloads
+HEAVY_MODULES = (
+    'matplotlib.figure', 'matplotlib.backends.backend_agg', 'seaborn',
+    'scipy.cluster.hierarchy', 'scipy.spatial.distance', 'fpdf', 'openai',
+)
+BOOT_TIMEOUT_SECONDS = 120
+
+IMPORT_SCRIPT = """
+import importlib, json, resource, sys, time
+start = time.perf_counter()
+from app import app
+imported = time.perf_counter() - start
+assert app.test_client().get('/').status_code == 200
+first = time.perf_counter() - start
+if sys.argv[1] == 'eager':
+    for name in sys.argv[2:]:
+        importlib.import_module(name)
+print(json.dumps({'import_s': imported, 'first_response_s': first,
+                  'total_s': time.perf_counter() - start,
+                  'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+
+def app_env(tmp):
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+        'SECRET_KEY': 'bench',
+        'AUTH0_DOMAIN': 'stub.invalid',
+        'AI_CLIENT': 'stub',
+        'UPLOAD_FOLDER': os.path.join(tmp, 'uploads'),
+        'METRICS_DIR': os.path.join(tmp, 'metrics'),
+    })
+    return env
+
+
+def time_imports(env, mode, repeat):
+    runs = [
+        json.loads(subprocess.run([sys.executable, '-c', IMPORT_SCRIPT, mode, *HEAVY_MODULES], env=env,
+                                  check=True, capture_output=True, text=True).stdout.splitlines()[-1])
+        for _ in range(repeat)
+    ]
+    return {key: float(np.median([run[key] for run in runs])) for key in runs[0]}
+
+
+def proc_memory_mb(pid):
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in ('Rss', 'Pss'):
+                    memory[name.lower()] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return memory
+
+
+def cpu_seconds(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+def run_gunicorn(env, preload, workers):
+    port = free_port()
+    env = dict(env, GUNICORN_PRELOAD='1' if preload else '0', GUNICORN_WORKERS=str(workers),
+               GUNICORN_BIND=f"127.0.0.1:{port}")
+    start = time.perf_counter()
+    server = subprocess.Popen(['gunicorn', '--log-level', 'warning', 'app:app'], env=env)
+    try:
+        while True:
+            if time.perf_counter() - start > BOOT_TIMEOUT_SECONDS or server.poll() is not None:
+                raise RuntimeError("gunicorn did not start")
+            try:
+                if requests.get(f"http://127.0.0.1:{port}/", timeout=5).status_code == 200:
+                    break
+            except (requests.ConnectionError, requests.Timeout):
+                time.sleep(0.05)
+        first = time.perf_counter() - start
+        #booting is over once every worker is up and no process uses CPU any more
+        previous = -1.0
+        while time.perf_counter() - start < BOOT_TIMEOUT_SECONDS:
+            pids = [server.pid, *worker_pids(server.pid)]
+            used = sum(cpu_seconds(pid) for pid in pids)
+            if len(pids) == workers + 1 and used - previous < 0.02:
+                break
+            previous = used
+            time.sleep(0.5)
+        workers_memory = [proc_memory_mb(pid) for pid in worker_pids(server.pid)]
+        master = proc_memory_mb(server.pid)
+        return {
+            'first_response_s': first,
+            'boot_cpu_s': used,
+            'worker_rss_mb': max(m.get('rss', 0) for m in workers_memory),
+            'worker_pss_mb': max(m.get('pss', 0) for m in workers_memory),
+            'total_pss_mb': master.get('pss', 0) + sum(m.get('pss', 0) for m in workers_memory),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare against a JSON file written with --save')
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        env = app_env(tmp)
+        os.environ.update(env)
+        from config import Config
+        from models import create_tables
+        create_tables(Config)
+
+        print(f"{'import':>8} {'import s':>9} {'first s':>8} {'total s':>8} {'RSS MB':>7}")
+        for mode in ('lazy', 'eager'):
+            timings = time_imports(env, mode, args.repeat)
+            print(f"{mode:>8} {timings['import_s']:>9.2f} {timings['first_response_s']:>8.2f}"
+                  f" {timings['total_s']:>8.2f} {timings['rss_mb']:>7.0f}")
+            results.update({f"import-{mode}-{key}": value for key, value in timings.items()})
+
+        print(f"\n{'gunicorn':>8} {'first s':>8} {'boot CPU s':>11} {'worker RSS':>11} {'worker PSS':>11}"
+              f" {'total PSS':>10}")
+        for mode in ('default', 'preload'):
+            boot = run_gunicorn(env, mode == 'preload', args.workers)
+            print(f"{mode:>8} {boot['first_response_s']:>8.2f} {boot['boot_cpu_s']:>11.2f}"
+                  f" {boot['worker_rss_mb']:>11.0f} {boot['worker_pss_mb']:>11.0f} {boot['total_pss_mb']:>10.0f}")
+            results.update({f"gunicorn-{mode}-{key}": value for key, value in boot.items()})
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        regressions = [
+            f"{key}: {results[key]:.2f} vs {saved[key]:.2f}"
+            for key in results if key in saved and results[key] > saved[key] * args.tolerance
+        ]
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Basic statistics benchmark.
+
+Run from the FileAnalyzer directory:
+    python -m benchmarks.bench_stats [--rows 1e5 1e6] [--columns 10 100 1000]
+    python -m benchmarks.bench_stats --save bench_stats.json
+    python -m benchmarks.bench_stats --compare bench_stats.json --tolerance 1.25
+
+Times compute_basic_stats on synthetic mixed-dtype frames (float, int, low and
+high cardinality strings, with missing values) next to the previous per-column
+implementation. With --compare the run exits non-zero when any case is slower
+than the saved result by more than the tolerance factor, so regressions are caught.
+"""
+import argparse
+import json
+import sys
+import time
+import numpy as np
+import pandas as pd
+from utils.stats import compute_basic_stats
+
+
+def legacy_basic_stats(df):
+    # the per-column implementation this benchmark guards against regressing to
+    stats = []
+    for col in df.columns:
+        col_data = df[col]
+        modes = col_data.mode()
+        numeric = pd.api.types.is_numeric_dtype(col_data)
+        stats.append({
+            'column': col,
+            'mean': float(col_data.mean()) if numeric else 'N/A',
+            'median': float(col_data.median()) if numeric else 'N/A',
+            'mode': (float(modes.iloc[0]) if numeric else modes.iloc[0]) if not modes.empty else 'N/A',
+            'missing': int(col_data.isna().sum())
+        })
+    return stats
+
+
+def synthetic_frame(rows, cols, seed=0):
+    """
+    Mixed frame: 40% float, 30% int, 20% low cardinality and 10% unique strings.
+    """
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i in range(cols):
+        kind = i % 10
+        if kind < 4:
+            values = rng.normal(size=rows)
+            values[rng.random(rows) < 0.05] = np.nan
+            data[f"float_{i}"] = values
+        elif kind < 7:
+            data[f"int_{i}"] = rng.integers(0, 1000, rows)
+        elif kind < 9:
+            data[f"cat_{i}"] = pd.Categorical.from_codes(rng.integers(0, 20, rows),
+                                                         [f"v{j}" for j in range(20)]).astype(object)
+        else:
+            data[f"id_{i}"] = pd.Series(np.arange(rows)).astype(str).to_numpy(dtype=object)
+    return pd.DataFrame(data)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=float, nargs='+', default=[1e5, 1e6])
+    parser.add_argument('--columns', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--max-cells', type=float, default=1e8,
+                        help='skip cases with more rows x columns than this (1e8 rows needs a large machine)')
+    parser.add_argument('--skip-legacy', action='store_true', help='only time the current implementation')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare against a JSON file written with --save')
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'rows':>12} {'columns':>8} {'current s':>10} {'legacy s':>10} {'speedup':>8}")
+    for rows in map(int, args.rows):
+        for cols in args.columns:
+            if rows * cols > args.max_cells:
+                print(f"{rows:>12} {cols:>8}   skipped (over --max-cells)")
+                continue
+            df = synthetic_frame(rows, cols)
+            current = timed(compute_basic_stats, df)
+            legacy = None if args.skip_legacy else timed(legacy_basic_stats, df)
+            results[f"{rows}x{cols}"] = current
+            speedup = f"{legacy / current:>7.1f}x" if legacy else f"{'-':>8}"
+            print(f"{rows:>12} {cols:>8} {current:>10.3f} {legacy or float('nan'):>10.3f} {speedup}")
+            del df
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        regressions = [
+            f"{case}: {results[case]:.3f}s vs {saved[case]:.3f}s"
+            for case in results if case in saved and results[case] > saved[case] * args.tolerance
+        ]
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Synthetic CSV datasets for benchmarks and load tests.
+
+Run from the FileAnalyzer directory to write one:
+    python -m benchmarks.datasets narrow-small-clean out.csv
+    python -m benchmarks.datasets wide-huge-dirty out.csv --rows 200000
+
+A dataset is named shape-size-quality:
+    narrow  ids, floats, integers, low-cardinality text and timestamps (8 columns)
+    wide    the same mix repeated to WIDE_COLUMNS columns
+    small / medium / huge   SIZES rows, or --rows
+    clean   every value well formed
+    dirty   missing values, numbers with stray text, padded and mixed-case text,
+            quoted fields holding delimiters and newlines, and duplicated rows
+Files are written in blocks so even huge ones never sit in memory whole.
+"""
+import argparse
+import csv
+import numpy as np
+import pandas as pd
+
+SIZES = {'small': 10_000, 'medium': 200_000, 'huge': 5_000_000}
+SHAPES = ('narrow', 'wide')
+QUALITIES = ('clean', 'dirty')
+WIDE_COLUMNS = 200
+BLOCK_ROWS = 50_000
+CITIES = ['Berlin', 'Paris', 'Madrid', 'Rome', 'Vienna', 'Prague', 'Lisbon', 'Dublin']
+STATUSES = ['open', 'closed', 'pending']
+
+
+def parse_spec(spec):
+    """
+    Split shape-size-quality into its parts, checking each.
+    """
+    try:
+        shape, size, quality = spec.split('-')
+    except ValueError:
+        raise ValueError(f"Dataset names look like narrow-small-clean, not {spec!r}")
+    if shape not in SHAPES or size not in SIZES or quality not in QUALITIES:
+        raise ValueError(f"Unknown dataset {spec!r}: shapes {SHAPES}, sizes {tuple(SIZES)}, qualities {QUALITIES}")
+    return shape, size, quality
+
+
+def _narrow_block(rng, start, rows):
+    return pd.DataFrame({
+        'id': np.arange(start, start + rows),
+        'amount': rng.normal(100, 15, rows).round(2),
+        'quantity': rng.integers(0, 50, rows),
+        'ratio': rng.random(rows).round(4),
+        'city': rng.choice(CITIES, rows),
+        'status': rng.choice(STATUSES, rows),
+        'score': rng.integers(0, 1000, rows),
+        'created': (pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 10 ** 8, rows), unit='s'))
+        .strftime('%Y-%m-%d %H:%M:%S'),
+    })
+
+
+def _wide_block(rng, start, rows):
+    base = _narrow_block(rng, start, rows)
+    columns = {'id': base['id']}
+    for i in range(WIDE_COLUMNS - 1):
+        kind = i % 4
+        if kind == 0:
+            columns[f"metric_{i}"] = rng.normal(i, 1 + i % 7, rows).round(3)
+        elif kind == 1:
+            columns[f"count_{i}"] = rng.integers(0, 100 + i, rows)
+        elif kind == 2:
+            columns[f"label_{i}"] = rng.choice(STATUSES + CITIES[:i % 5 + 1], rows)
+        else:
+            columns[f"flag_{i}"] = rng.random(rows) < 0.3
+    return pd.DataFrame(columns)
+
+
+def _make_dirty(df, rng):
+    rows = len(df)
+    for col in df.columns[1:]:
+        df[col] = df[col].where(rng.random(rows) >= 0.05)
+    numeric = [col for col in df.columns[1:] if pd.api.types.is_numeric_dtype(df[col])]
+    text = [col for col in df.columns[1:] if pd.api.types.is_string_dtype(df[col])]
+    if numeric:
+        col = numeric[0]
+        df[col] = df[col].astype(object)
+        df.loc[rng.random(rows) < 0.01, col] = '#REF!'
+    for col in text[:2]:
+        padded = rng.random(rows) < 0.1
+        df.loc[padded, col] = ' ' + df.loc[padded, col].astype(str).str.upper() + ' '
+    if text:
+        quoted = rng.random(rows) < 0.01
+        df.loc[quoted, text[-1]] = 'said "hi", then\nleft'
+    #about 2% of the rows repeat an earlier row of the block exactly
+    order = np.arange(rows)
+    repeats = np.flatnonzero(rng.random(rows) < 0.02)
+    repeats = repeats[repeats > 0]
+    order[repeats] = rng.integers(0, repeats)
+    return df.iloc[order].reset_index(drop=True)
+
+
+def iter_blocks(shape, rows, dirty=False, seed=0):
+    """
+    Yield the dataset as DataFrame blocks of at most BLOCK_ROWS rows.
+    """
+    rng = np.random.default_rng(seed)
+    make = _narrow_block if shape == 'narrow' else _wide_block
+    for start in range(0, rows, BLOCK_ROWS):
+        df = make(rng, start, min(BLOCK_ROWS, rows - start))
+        yield _make_dirty(df, rng) if dirty else df
+
+
+def write_dataset(path, spec, rows=None, seed=0):
+    """
+    Write the dataset named by spec to path and return the number of rows.
+    """
+    shape, size, quality = parse_spec(spec)
+    rows = rows or SIZES[size]
+    with open(path, 'w', newline='') as f:
+        for i, block in enumerate(iter_blocks(shape, rows, quality == 'dirty', seed)):
+            block.to_csv(f, index=False, header=i == 0, quoting=csv.QUOTE_MINIMAL)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('spec')
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(write_dataset(args.path, args.spec, args.rows, args.seed), "rows written to", args.path)
+
+
+if __name__ == '__main__':
+    main()
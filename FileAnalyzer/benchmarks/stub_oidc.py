@@ -0,0 +1,138 @@
+"""
+Local OpenID Connect provider standing in for Auth0 in load tests.
+
+Run from the FileAnalyzer directory:
+    python -m benchmarks.stub_oidc [--port 9100]
+
+and start the app with AUTH0_BASE_URL=http://127.0.0.1:9100 and AUTH0_DOMAIN,
+AUTH0_CLIENT_ID, AUTH0_CLIENT_SECRET set to anything. Every authorization is
+approved at once, for the user named by the login_hint parameter or a new
+user loadtest|<n> otherwise. ID tokens are signed with an RSA key generated at
+start, published on the JWKS endpoint, so the app verifies them as it would
+Auth0's. Nothing is persisted.
+"""
+import argparse
+import itertools
+import secrets
+import threading
+import time
+from urllib.parse import urlencode
+from flask import Flask, jsonify, redirect, request, abort
+from joserfc import jwt
+from joserfc.jwk import RSAKey
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+TOKEN_SECONDS = 3600
+
+
+class QuietHandler(WSGIRequestHandler):
+    #a line per request would drown the load test's own output
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def create_stub(base_url):
+    """
+    The provider's Flask app, answering as the issuer at base_url.
+    """
+    stub = Flask(__name__)
+    key = RSAKey.generate_key(2048, parameters={'kid': 'stub'}, private=True)
+    codes, tokens = {}, {}
+    lock = threading.Lock()
+    numbers = itertools.count(1)
+
+    def user(sub):
+        name = sub.split('|')[-1]
+        return {'sub': sub, 'name': f"Load test {name}", 'email': f"{name}@loadtest.invalid", 'picture': None}
+
+    @stub.route('/.well-known/openid-configuration')
+    def configuration():
+        return jsonify({
+            'issuer': f"{base_url}/",
+            'authorization_endpoint': f"{base_url}/authorize",
+            'token_endpoint': f"{base_url}/oauth/token",
+            'userinfo_endpoint': f"{base_url}/userinfo",
+            'jwks_uri': f"{base_url}/.well-known/jwks.json",
+            'response_types_supported': ['code'],
+            'subject_types_supported': ['public'],
+            'id_token_signing_alg_values_supported': ['RS256'],
+        })
+
+    @stub.route('/.well-known/jwks.json')
+    def jwks():
+        return jsonify({'keys': [key.as_dict(private=False)]})
+
+    @stub.route('/authorize')
+    def authorize():
+        redirect_uri = request.args.get('redirect_uri')
+        if not redirect_uri:
+            abort(400)
+        sub = request.args.get('login_hint') or f"loadtest|{next(numbers)}"
+        code = secrets.token_urlsafe(16)
+        with lock:
+            codes[code] = (sub, request.args.get('client_id'), request.args.get('nonce'))
+        params = {'code': code}
+        if 'state' in request.args:
+            params['state'] = request.args['state']
+        return redirect(f"{redirect_uri}?{urlencode(params)}")
+
+    @stub.route('/oauth/token', methods=['POST'])
+    def token():
+        with lock:
+            entry = codes.pop(request.form.get('code'), None)
+        if entry is None:
+            return jsonify({'error': 'invalid_grant'}), 400
+        sub, client_id, nonce = entry
+        #client_secret_basic puts the client id in the Authorization header instead
+        client_id = client_id or request.form.get('client_id') or (request.authorization or {}).get('username')
+        now = int(time.time())
+        claims = {'iss': f"{base_url}/", 'sub': sub, 'aud': client_id, 'iat': now, 'exp': now + TOKEN_SECONDS,
+                  **user(sub)}
+        if nonce:
+            claims['nonce'] = nonce
+        access_token = secrets.token_urlsafe(24)
+        with lock:
+            tokens[access_token] = sub
+        return jsonify({
+            'access_token': access_token,
+            'id_token': jwt.encode({'alg': 'RS256', 'kid': 'stub'}, claims, key),
+            'token_type': 'Bearer',
+            'expires_in': TOKEN_SECONDS,
+        })
+
+    @stub.route('/userinfo')
+    def userinfo():
+        _, _, access_token = request.headers.get('Authorization', '').partition(' ')
+        with lock:
+            sub = tokens.get(access_token)
+        if sub is None:
+            abort(401)
+        return jsonify(user(sub))
+
+    @stub.route('/v2/logout')
+    def logout():
+        return redirect(request.args.get('returnTo') or '/')
+
+    return stub
+
+
+def serve_in_thread(host='127.0.0.1', port=9100):
+    """
+    Start the provider on a daemon thread and return its server, for shutdown().
+    """
+    server = make_server(host, port, create_stub(f"http://{host}:{port}"), threaded=True,
+                         request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name="stub-oidc", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    args = parser.parse_args()
+    make_server(args.host, args.port, create_stub(f"http://{args.host}:{args.port}"), threaded=True).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
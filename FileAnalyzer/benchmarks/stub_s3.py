@@ -0,0 +1,106 @@
+"""
+Local S3-compatible object store standing in for S3 in tests and load tests.
+
+Run from the FileAnalyzer directory:
+    python -m benchmarks.stub_s3 [--port 9200]
+
+and start the app with ARTIFACT_STORE=s3, ARTIFACT_S3_ENDPOINT_URL=http://127.0.0.1:9200,
+ARTIFACT_S3_BUCKET set to any name and AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY and
+ARTIFACT_S3_REGION set to anything. It answers the path-style requests the artifact
+store makes: PUT, GET, HEAD and DELETE of an object, ListObjectsV2 and
+DeleteObjects. Buckets spring into existence on first use, signatures are not
+checked and objects are held in memory.
+"""
+import argparse
+import hashlib
+import threading
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+from flask import Flask, request, Response
+from werkzeug.serving import make_server
+from benchmarks.stub_oidc import QuietHandler
+
+S3_XMLNS = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+
+def _error(code, status):
+    return Response(f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code></Error>',
+                    status=status, mimetype='application/xml')
+
+
+def create_stub():
+    """
+    The object store's Flask app.
+    """
+    stub = Flask(__name__)
+    objects = {}
+    lock = threading.Lock()
+
+    @stub.route('/<bucket>', methods=['GET'])
+    def list_objects(bucket):
+        prefix = request.args.get('prefix', '')
+        with lock:
+            keys = sorted(key for b, key in objects if b == bucket and key.startswith(prefix))
+            contents = ''.join(
+                f"<Contents><Key>{escape(key)}</Key><Size>{len(objects[bucket, key])}</Size></Contents>"
+                for key in keys)
+        return Response(
+            f'<?xml version="1.0" encoding="UTF-8"?><ListBucketResult xmlns="{S3_XMLNS}"><Name>{escape(bucket)}</Name>'
+            f"<Prefix>{escape(prefix)}</Prefix><KeyCount>{len(keys)}</KeyCount><IsTruncated>false</IsTruncated>"
+            f"{contents}</ListBucketResult>", mimetype='application/xml')
+
+    @stub.route('/<bucket>', methods=['POST'])
+    def delete_objects(bucket):
+        if 'delete' not in request.args:
+            return _error('NotImplemented', 501)
+        keys = [node.text for node in ElementTree.fromstring(request.get_data()).iter() if node.tag.endswith('Key')]
+        with lock:
+            for key in keys:
+                objects.pop((bucket, key), None)
+        return Response(f'<?xml version="1.0" encoding="UTF-8"?><DeleteResult xmlns="{S3_XMLNS}"></DeleteResult>',
+                        mimetype='application/xml')
+
+    @stub.route('/<bucket>/<path:key>', methods=['PUT'])
+    def put_object(bucket, key):
+        data = request.get_data()
+        with lock:
+            objects[bucket, key] = data
+        return Response(headers={'ETag': f'"{hashlib.md5(data).hexdigest()}"'})
+
+    @stub.route('/<bucket>/<path:key>', methods=['GET', 'HEAD'])
+    def get_object(bucket, key):
+        with lock:
+            data = objects.get((bucket, key))
+        if data is None:
+            return _error('NoSuchKey', 404)
+        return Response(data, mimetype='application/octet-stream',
+                        headers={'ETag': f'"{hashlib.md5(data).hexdigest()}"'})
+
+    @stub.route('/<bucket>/<path:key>', methods=['DELETE'])
+    def delete_object(bucket, key):
+        with lock:
+            objects.pop((bucket, key), None)
+        return Response(status=204)
+
+    return stub
+
+
+def serve_in_thread(host='127.0.0.1', port=9200):
+    """
+    Start the store on a daemon thread and return its server, for shutdown().
+    """
+    server = make_server(host, port, create_stub(), threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name="stub-s3", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9200)
+    args = parser.parse_args()
+    make_server(args.host, args.port, create_stub(), threaded=True).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
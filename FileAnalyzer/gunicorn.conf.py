@@ -0,0 +1,68 @@
+"""
+Gunicorn settings, read automatically when gunicorn starts in this directory:
+    gunicorn app:app
+
+GUNICORN_WORKERS, GUNICORN_THREADS and GUNICORN_BIND size and place the server.
+GUNICORN_WORKER_CLASS picks the worker:
+    gthread  threads per worker process (default)
+    gevent   greenlets, for many slow clients; needs the gevent package. Job threads
+             become greenlets too, so run the web tier with JOB_WORKERS=0 and a
+             gthread tier for the jobs
+GUNICORN_PRELOAD=1 loads the app and the plotting, PDF and AI libraries once in the
+master, so workers start at once and share those pages copy-on-write. Without it
+every worker imports the app itself and the heavy libraries on first use, which
+keeps workers that never draw a chart or build a report smaller.
+Tables are created, and new columns added to existing ones, once by the master before any worker starts.
+"""
+import gc
+import os
+import importlib
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:4000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+preload_app = os.environ.get('GUNICORN_PRELOAD', '').lower() in ('1', 'true', 'yes')
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+# imported lazily by the app, imported up front when preloading so workers share them
+HEAVY_MODULES = (
+    'matplotlib.figure', 'matplotlib.backends.backend_agg', 'seaborn',
+    'scipy.cluster.hierarchy', 'scipy.spatial.distance', 'fpdf', 'openai',
+)
+
+if worker_class == 'gevent':
+    #must happen before the app imports anything that touches sockets or threads
+    from gevent import monkey
+    monkey.patch_all()
+
+#the master creates and migrates the tables, so workers skip it while booting
+os.environ.setdefault('CREATE_TABLES_ON_START', '0')
+
+
+def on_starting(server):
+    from config import Config
+    from models import create_tables
+    create_tables(Config)
+    if preload_app:
+        for name in HEAVY_MODULES:
+            try:
+                importlib.import_module(name)
+            except ImportError:
+                pass
+
+
+def pre_fork(server, worker):
+    #objects alive now are never freed by the workers, so keep the collector from
+    #touching them: a collection writes to every object it visits and unshares its page
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        #connections opened in the master must not be shared with the children
+        from app import app
+        from models import db
+        with app.app_context():
+            db.engine.dispose(close=False)
@@ -1,8 +1,54 @@
+from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.schema import CreateColumn
 from datetime import datetime
 
 db = SQLAlchemy()
 
+
+def migrate_schema():
+    """
+    Bring the database up to the models: create missing tables, then add the columns
+    and indexes that were added to the models of existing tables, which create_all
+    leaves alone. Everything it adds is checked for first, so it is safe to run on
+    every start.
+    """
+    db.create_all()
+    inspector = db.inspect(db.engine)
+    with db.engine.begin() as conn:
+        preparer = conn.dialect.identifier_preparer
+        for table in db.metadata.sorted_tables:
+            existing = {col['name'] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable and column.server_default is None:
+                    raise RuntimeError(f"Cannot add required column {table.name}.{column.name} to existing rows")
+                definition = CreateColumn(column).compile(dialect=conn.dialect)
+                ddl = f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {definition}"
+                for fk in column.foreign_keys:
+                    ddl += f" REFERENCES {preparer.format_table(fk.column.table)} ({preparer.quote(fk.column.name)})"
+                conn.execute(db.text(ddl))
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+
+
+def create_tables(config):
+    """
+    Create or migrate the tables (see migrate_schema) from a bare app holding only
+    config, so neither the routes nor their imports are loaded. Used by the gunicorn
+    master before it forks.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config)
+    db.init_app(app)
+    with app.app_context():
+        migrate_schema()
+        db.engine.dispose()
+
+
 class User(db.Model):
     __tablename__ = 'users'
     id       = db.Column(db.Integer, primary_key=True)
@@ -15,21 +61,78 @@ class User(db.Model):
 
 class CSVFile(db.Model):
     __tablename__ = 'csv_files'
+    __table_args__ = (
+        # per-user listings page through (user_sub, id), downloads look files up by (user_sub, filename)
+        db.Index('ix_csv_files_user_id', 'user_sub', 'id'),
+        db.Index('ix_csv_files_user_filename', 'user_sub', 'filename'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_sub = db.Column(db.String(64), db.ForeignKey('users.sub'), nullable=False)
     filename = db.Column(db.String(256), nullable=False)
-    filepath = db.Column(db.String(512), nullable=False)
+    filepath = db.Column(db.String(512), nullable=False, index=True)  # shared by identical uploads
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # sha256 of the file
+    columnar_path = db.Column(db.String(512), nullable=True)  # typed Parquet copy, read instead of the CSV
+    csv_schema = db.Column(db.JSON, nullable=True)  # dialect and column types sniffed at upload, see utils.ingest
     upload_time = db.Column(db.DateTime, server_default=db.func.now())
 
     user = db.relationship('User', back_populates='csv_files')
 
 class PDFReport(db.Model):
     __tablename__ = 'pdf_reports'
+    __table_args__ = (
+        db.Index('ix_pdf_reports_user_id', 'user_sub', 'id'),
+        db.Index('ix_pdf_reports_user_filename', 'user_sub', 'filename'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_sub = db.Column(db.String(64), db.ForeignKey('users.sub'), nullable=False)
+    csv_id = db.Column(db.Integer, db.ForeignKey('csv_files.id'), nullable=True, index=True)  # the CSV it reports on
     filename = db.Column(db.String(256), nullable=False)
     filepath = db.Column(db.String(512), nullable=False)
     generated_at = db.Column(db.DateTime, server_default=db.func.now())
 
     def __repr__(self):
         return f"<User {self.email}>"
+
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    # pending jobs of a CSV are looked up before enqueueing another
+    __table_args__ = (db.Index('ix_jobs_csv_kind_status', 'csv_id', 'kind', 'status'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_sub = db.Column(db.String(64), db.ForeignKey('users.sub'), nullable=False)
+    kind = db.Column(db.String(32), nullable=False)  # name of the registered task
+    csv_id = db.Column(db.Integer, db.ForeignKey('csv_files.id'), nullable=True)
+    params = db.Column(db.JSON, nullable=True)
+    priority = db.Column(db.Integer, nullable=False, default=100)  # lower runs first
+    status = db.Column(db.String(16), nullable=False, default='queued', index=True)  # queued/running/done/failed
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.String(256), nullable=True)
+    result = db.Column(db.String(512), nullable=True)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+    heartbeat_at = db.Column(db.DateTime, nullable=True)  # refreshed while running, used to detect dead workers
+    finished_at = db.Column(db.DateTime, nullable=True)
+    peak_rss_mb = db.Column(db.Float, nullable=True)  # process RSS high-water mark while the job ran
+    stages = db.Column(db.JSON, nullable=True)  # timed pipeline stages of the run
+
+
+class Upload(db.Model):
+    __tablename__ = 'uploads'
+    id = db.Column(db.String(32), primary_key=True)  # random token naming the upload in the chunk API
+    user_sub = db.Column(db.String(64), db.ForeignKey('users.sub'), nullable=False)
+    filename = db.Column(db.String(256), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)  # declared total size in bytes
+    received = db.Column(db.BigInteger, nullable=False, default=0)  # bytes stored so far, the next chunk's offset
+    path = db.Column(db.String(512), nullable=False)  # part file while receiving, then the stored object
+    csv_schema = db.Column(db.JSON, nullable=True)  # sniffed from the first chunks
+    status = db.Column(db.String(16), nullable=False, default='receiving')  # receiving/complete
+    csv_id = db.Column(db.Integer, db.ForeignKey('csv_files.id'), nullable=True, index=True)  # dataset created on completion
+    job_id = db.Column(db.Integer, db.ForeignKey('jobs.id'), nullable=True)  # job analysing it, possibly mid-upload
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)  # last chunk, for expiring abandoned uploads
+
+
+class Lock(db.Model):
+    __tablename__ = 'locks'
+    name = db.Column(db.String(255), primary_key=True)  # what is locked, like profile:<content hash>
+    owner = db.Column(db.String(32), nullable=False)  # random token of the holder
+    expires_at = db.Column(db.DateTime, nullable=False)  # renewed while held, an expired lock is free to take
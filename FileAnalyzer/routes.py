@@ -1,21 +1,36 @@
 import os
-import io
-from flask import Blueprint, render_template, session, redirect, url_for, current_app, request, flash, send_file
+import uuid
+from flask import Blueprint, render_template, session, redirect, url_for, current_app, request, flash, \
+    jsonify, abort, Response
 from authlib.integrations.flask_client import OAuthError
 from werkzeug.utils import secure_filename
-import pandas as pd
-import numpy as np
-from fpdf import FPDF
-from models import db, User, CSVFile, PDFReport
-from utils.text import allowed_file, clean_text
-from utils.stats import compute_basic_stats, make_corr_html
-from utils.plotting import save_histograms, create_numeric_plot, create_category_plot, create_correlation_heatmap
-from utils.ai_insights import generate_ai_insight
+from models import db, User, CSVFile, PDFReport, Job, Upload
+from utils.text import allowed_file
+from utils.stats import corr_to_html
+from utils.cache import file_hash, get_profile_cache, get_export_cache
+from utils.profile import cached_profile, quick_profile, check_append_schema, remove_state, is_export_kind, \
+    export_filename, TOP_VALUES
+from utils.storage import remove_columnar, data_path
+from utils.exports import EXPORT_KINDS, iter_export, gzip_chunks
+from utils.downloads import send_stored_file, send_artifact, accepts_gzip, content_disposition
+from utils.plotting import rebin
+from utils.correlation import CORRELATION_METHODS, top_pairs, correlation_page
+from utils.compare import compare_files
+from utils.jobs import job_queue
+from utils.locks import lease_lock
+from utils.artifacts import get_artifact_store
+from utils.report import remove_report
+from utils.metrics import metrics
+from utils.uploads import ChunkError, start_upload, receive_chunk, incoming_path, save_hashed, add_dataset, \
+    shares_files
 from functools import wraps
 
 # Initialize Blueprint
 main = Blueprint('main', __name__)
 
+# strongest column pairs listed on the analysis and correlation pages
+TOP_PAIRS = 10
+
 
 # ----------------------
 # Authentication Routes
@@ -49,7 +64,7 @@ def callback():
 
     # get information from Auth0 about the user
     userinfo = current_app.auth0.get(
-        f"https://{current_app.config['AUTH0_DOMAIN']}/userinfo",
+        f"{current_app.config['AUTH0_BASE_URL']}/userinfo",
         token=token
     ).json()
 
@@ -80,7 +95,7 @@ def logout():
     #delete session to clear it of the user
     session.clear()
     return redirect(
-        f"https://{current_app.config['AUTH0_DOMAIN']}/v2/logout"
+        f"{current_app.config['AUTH0_BASE_URL']}/v2/logout"
         f"?returnTo={url_for('main.home', _external=True)}"
         f"&client_id={current_app.config['AUTH0_CLIENT_ID']}"
     )
@@ -105,19 +120,34 @@ def dashboard():
     return render_template('dashboard.html', user=session['user'])
 
 
+def keyset_page(model):
+    """
+    One page of the session user's rows of model, newest first. The before query
+    parameter continues below that id, so deep pages cost the same as the first.
+    Returns the rows and the before value of the next page, or None on the last.
+    """
+    size = current_app.config['LISTING_PAGE_SIZE']
+    query = model.query.filter(model.user_sub == session['user']['sub'])
+    before = request.args.get('before', type=int)
+    if before is not None:
+        query = query.filter(model.id < before)
+    rows = query.order_by(model.id.desc()).limit(size + 1).all()
+    return rows[:size], rows[size - 1].id if len(rows) > size else None
+
+
 @main.route('/reports')
 @login_required
 def reports():
-    pdfs = PDFReport.query.filter_by(user_sub=session['user']['sub']).all()
-    return render_template('reports.html', reports=pdfs)
+    pdfs, older = keyset_page(PDFReport)
+    return render_template('reports.html', reports=pdfs, older=older, paged='before' in request.args)
 
 
 @main.route('/mycsvs')
 @login_required
 def mycsvs():
-    #get all csv files linked to the user
-    csvs = CSVFile.query.filter_by(user_sub=session['user']['sub']).all()
-    return render_template('csvs.html', csvs=csvs)
+    #csv files linked to the user, a page at a time
+    csvs, older = keyset_page(CSVFile)
+    return render_template('csvs.html', csvs=csvs, older=older, paged='before' in request.args)
 
 
 # ----------------------
@@ -136,53 +166,121 @@ def upload():
             flash('Invalid file type.', 'danger')
             return redirect(request.url)
 
-        #save file in a secure way.
-        filename = secure_filename(file.filename)
         upload_folder = current_app.config['UPLOAD_FOLDER']
         os.makedirs(upload_folder, exist_ok=True)
-        file_path = os.path.join(upload_folder, filename)
-        file.save(file_path)
-
-        #save file to the db via path and link to the session user
-        csv_record = CSVFile(user_sub=session['user']['sub'], filename=filename, filepath=file_path)
-        db.session.add(csv_record)
-        db.session.commit()
-
-        #Analyse data Basic statistics
-        df = pd.read_csv(file_path)
-        if df.empty:
-            flash('Uploaded CSV is empty.', 'danger')
-            return redirect(request.url)
 
-        dtypes = df.dtypes.astype(str).to_dict()
-        basic_stats = compute_basic_stats(df)
-        corr_html = make_corr_html(df)
-        total_rows, dup_count = len(df), df.duplicated().sum()
-
-        # Delete duplicates
-        cleaned_filename = f"cleaned_{filename}"
-        df.drop_duplicates().to_csv(os.path.join(upload_folder, cleaned_filename), index=False)
-
-        #save the missing data so that it can be exported  if necessary
-        missing_stats = df.isna().sum().to_dict()
-        missing_rows = df[df.isna().any(axis=1)]
-        missing_filename = f"missing_{filename}"
-        missing_rows.to_csv(os.path.join(upload_folder, missing_filename), index=False)
-
-        #make graphs
-        numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
-        hist_paths = save_histograms(df, csv_record.id, numeric_cols)
+        #append mode: only the new rows are folded into the existing dataset's profile
+        append_to = request.form.get('append_to', type=int)
+        if append_to:
+            record = db.session.get(CSVFile, append_to)
+            if record is None or record.user_sub != session['user']['sub']:
+                flash("Unauthorized access.", "danger")
+                return redirect(request.url)
+            delta_path = os.path.join(upload_folder, f"delta_{uuid.uuid4().hex}.csv")
+            file.save(delta_path)
+            error = check_append_schema(record, delta_path)
+            if error:
+                os.remove(delta_path)
+                flash(error, 'danger')
+                return redirect(request.url)
+            job = job_queue.enqueue('append', record.user_sub, csv_id=record.id, params={'delta_path': delta_path})
+            return redirect(url_for('main.job_page', job_id=job.id))
+
+        #hashed while it is written, then stored under that hash so identical uploads share one file
+        filename = secure_filename(file.filename)
+        part_path = incoming_path(f"{uuid.uuid4().hex}.part")
+        with metrics.span('upload.receive') as span:
+            content_hash = save_hashed(file.stream, part_path)
+            span.nbytes = os.path.getsize(part_path)
+
+        #link the stored file to the session user, with the dialect and types sniffed once
+        with metrics.span('upload.store'):
+            csv_record = add_dataset(session['user']['sub'], filename, part_path, content_hash)
+            db.session.commit()
+
+        #Analyse data in the background, the job page shows progress and opens the analysis when done
+        job = job_queue.enqueue('analysis', csv_record.user_sub, csv_id=csv_record.id)
+        #large files go straight to the analysis page, which shows sampled estimates meanwhile
+        if os.path.getsize(csv_record.filepath) >= current_app.config['QUICK_LOOK_MIN_BYTES']:
+            return redirect(url_for('main.analyse_csv', csv_id=csv_record.id))
+        return redirect(url_for('main.job_page', job_id=job.id))
+
+    datasets = CSVFile.query.filter_by(user_sub=session['user']['sub']).order_by(CSVFile.filename).all()
+    return render_template('upload.html', datasets=datasets)
+
+
+def get_user_upload(upload_id):
+    upload = db.session.get(Upload, upload_id)
+    if upload is None or upload.user_sub != session['user']['sub']:
+        abort(404)
+    return upload
+
+
+def upload_json(upload):
+    """
+    State of a chunked upload: the offset of the next chunk and, once complete,
+    the page to continue on.
+    """
+    next_url = None
+    if upload.status == 'complete':
+        #large files open the analysis page at once, it shows estimates while the job runs
+        if upload.job_id is None or upload.size >= current_app.config['QUICK_LOOK_MIN_BYTES']:
+            next_url = url_for('main.analyse_csv', csv_id=upload.csv_id)
+        else:
+            next_url = url_for('main.job_page', job_id=upload.job_id)
+    return {
+        'id': upload.id,
+        'status': upload.status,
+        'offset': upload.received,
+        'size': upload.size,
+        'chunk_size': current_app.config['UPLOAD_CHUNK_BYTES'],
+        'next_url': next_url,
+        'job_id': upload.job_id,
+        'csv_id': upload.csv_id,
+    }
+
+
+@main.route('/api/uploads', methods=['POST'])
+@login_required
+def create_upload():
+    """
+    Start a chunked upload of a new dataset. Takes JSON {filename, size} and
+    returns the upload's id and the chunk size to send it in.
+    """
+    body = request.get_json(silent=True) or {}
+    filename = secure_filename(str(body.get('filename', '')))
+    size = body.get('size')
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'Invalid file type.'}), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({'error': 'The file size must be a positive number of bytes.'}), 400
+    upload = start_upload(session['user']['sub'], filename, size)
+    return jsonify(upload_json(upload)), 201
+
+
+@main.route('/api/uploads/<upload_id>', methods=['GET'])
+@login_required
+def upload_status(upload_id):
+    #where to resume after an interrupted chunk
+    return jsonify(upload_json(get_user_upload(upload_id)))
 
-        return render_template(
-            'analysis.html', filename=filename, dtypes=dtypes,
-            basic_stats=basic_stats, corr=corr_html,
-            total_rows=total_rows, dup_count=dup_count,
-            cleaned_filename=cleaned_filename, missing_stats=missing_stats,
-            missing_rows_count=len(missing_rows), missing_filename=missing_filename,
-            numeric_cols=numeric_cols, hist_paths=hist_paths, csv_file=csv_record
-        )
 
-    return render_template('upload.html')
+@main.route('/api/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    """
+    Store the raw request body as the chunk of an upload starting at the offset
+    query parameter, verified against its X-Chunk-SHA256 header. The body is
+    streamed to disk rather than buffered as a form.
+    """
+    upload = get_user_upload(upload_id)
+    try:
+        with metrics.span('upload.chunk', nbytes=request.content_length):
+            receive_chunk(upload, request.stream, request.args.get('offset', type=int),
+                          request.headers.get('X-Chunk-SHA256'), request.content_length)
+    except ChunkError as e:
+        return jsonify({'error': str(e), **upload_json(upload)}), e.status
+    return jsonify(upload_json(upload))
 
 
 @main.route('/delete_csv/<int:csv_id>', methods=['POST'])
@@ -194,16 +292,29 @@ def delete_csv(csv_id):
         return redirect(url_for('main.mycsvs'))
 
     try:
-        # Delete physically from folder by using the filepath
-        if os.path.exists(record.filepath):
-            os.remove(record.filepath)
-        # delete pdf related to csv if it exists
-        pdf_report = PDFReport.query.filter_by(user_sub=record.user_sub,
-                                               filename=f"{os.path.splitext(record.filename)[0]}_analysis_report.pdf").first()
-        if pdf_report and os.path.exists(pdf_report.filepath):
-            os.remove(pdf_report.filepath)
+        # Delete physically from folder by using the filepath, unless identical uploads share the file
+        if not shares_files(record):
+            if os.path.exists(record.filepath):
+                os.remove(record.filepath)
+            remove_columnar(record.columnar_path)
+        remove_state(record)
+        # delete pdf related to csv if it exists, reports from before they were linked are found by name
+        pdf_report = PDFReport.query.filter_by(csv_id=record.id).first() or PDFReport.query.filter_by(
+            user_sub=record.user_sub, csv_id=None,
+            filename=f"{os.path.splitext(record.filename)[0]}_analysis_report.pdf").first()
+        if pdf_report:
+            remove_report(pdf_report)
             db.session.delete(pdf_report)
 
+        # drop the cached profile and its images unless another upload has the same content
+        if record.content_hash and not CSVFile.query.filter(
+                CSVFile.content_hash == record.content_hash, CSVFile.id != record.id).first():
+            get_profile_cache().invalidate(record.content_hash)
+            get_export_cache().invalidate(record.content_hash)
+            get_artifact_store().delete_prefix(f"analysis/{record.content_hash}/")
+
+        Upload.query.filter_by(csv_id=record.id).delete()
+        Job.query.filter_by(csv_id=record.id).delete()
         db.session.delete(record)
         db.session.commit()
         flash("CSV file deleted successfully.", "success")
@@ -223,9 +334,7 @@ def delete_pdf(pdf_id):
         return redirect(url_for('main.reports'))
 
     try:
-        if os.path.exists(report.filepath):
-            os.remove(report.filepath)
-
+        remove_report(report)
         db.session.delete(report)
         db.session.commit()
         flash("PDF report deleted successfully.", "success")
@@ -238,106 +347,300 @@ def delete_pdf(pdf_id):
 @main.route('/analyse/<int:csv_id>')
 @login_required
 def analyse_csv(csv_id):
-    #Re analyse uploaded csv that is linked to the user
+    #Re analyse uploaded csv that is linked to the user, served from the profile cache when unchanged
     record = CSVFile.query.get_or_404(csv_id)
-    df = pd.read_csv(record.filepath)
+    if record.user_sub != session['user']['sub']:
+        abort(404)
+    profile = cached_profile(record)
+    if profile is not None:
+        return render_analysis(record, profile)
+    job = enqueue_once('analysis', record)
+    #large files are shown from a sample at once, the page swaps in exact values when the job is done
+    quick = quick_profile(record)
+    if quick is not None:
+        return render_analysis(record, quick, job)
+    return redirect(url_for('main.job_page', job_id=job.id))
+
+
+def enqueue_once(kind, record, params=None):
+    """
+    Return the pending job of this kind for a CSV record, or enqueue a new one.
+    A chunked upload's ingest job counts as its analysis. The check and the
+    enqueue hold a lock, so requests arriving together on any worker share a job.
+    """
+    kinds = [kind, 'ingest'] if kind == 'analysis' else [kind]
+    with lease_lock(f"enqueue:{kind}:{record.id}"):
+        pending = Job.query.filter(Job.kind.in_(kinds), Job.csv_id == record.id,
+                                   Job.status.in_(['queued', 'running'])).first()
+        if pending is not None and (params is None or pending.params == params):
+            return pending
+        return job_queue.enqueue(kind, session['user']['sub'], csv_id=record.id, params=params)
+
+
+def render_analysis(record, profile, job=None):
+    """
+    Render the analysis page for a CSV record from its profile. A sampled profile
+    is rendered with its confidence intervals, and job is the analysis whose exact
+    values the page loads once it is done.
+    """
+    return render_template(
+        'analysis.html', filename=record.filename, dtypes=profile['dtypes'],
+        basic_stats=profile['basic_stats'], top_pairs=top_pairs(profile['corr'], TOP_PAIRS),
+        total_rows=profile['total_rows'], dup_count=profile['dup_count'],
+        missing_stats=profile['missing_stats'], missing_rows_count=profile['missing_rows_count'],
+        numeric_cols=profile['numeric_cols'], categorical_cols=list(profile['top_values']),
+        hist_paths=[url_for('main.analysis_image', content_hash=record.content_hash, name=key.rsplit('/', 1)[-1])
+                    for key in profile['hist_paths']],
+        accuracy=profile['accuracy'], sample=profile.get('sample'), job=job, csv_file=record
+    )
 
-    dtypes = df.dtypes.astype(str).to_dict()
-    basic_stats = compute_basic_stats(df)
-    corr_html = make_corr_html(df)
 
-    total_rows, dup_count = len(df), df.duplicated().sum()
-    cleaned_filename = f"cleaned_{record.filename}"
-    df.drop_duplicates().to_csv(os.path.join(current_app.config['UPLOAD_FOLDER'], cleaned_filename), index=False)
+@main.route('/analyse/<int:csv_id>/correlations')
+@login_required
+def correlations(csv_id):
+    """
+    Browse the correlation matrix of a CSV record one tile at a time, next to its
+    strongest pairs. Accepts method (pearson or spearman), row and col page numbers.
+    """
+    record = CSVFile.query.get_or_404(csv_id)
+    if record.user_sub != session['user']['sub']:
+        abort(404)
+    profile = cached_profile(record)
+    if profile is None:
+        return redirect(url_for('main.job_page', job_id=enqueue_once('analysis', record).id))
+
+    method = request.args.get('method', 'pearson')
+    if method not in CORRELATION_METHODS:
+        abort(404)
+    corr = profile['corr'] if method == 'pearson' else profile.get('corr_spearman')
+    if corr is None:
+        flash("Spearman correlations are not available for files profiled in a streaming pass.")
+        method, corr = 'pearson', profile['corr']
+    tile, row_page, col_page, pages = correlation_page(
+        corr, request.args.get('row', 0, type=int), request.args.get('col', 0, type=int))
+    return render_template(
+        'correlations.html', csv_file=record, method=method, methods=CORRELATION_METHODS,
+        top_pairs=top_pairs(corr, TOP_PAIRS), table=corr_to_html(tile.round(3)),
+        row_page=row_page, col_page=col_page, pages=pages, columns=len(corr)
+    )
 
-    missing_stats = df.isna().sum().to_dict()
-    missing_rows_count = int(df[df.isna().any(axis=1)].shape[0])
-    missing_filename = f"missing_{record.filename}"
-    df[df.isna().any(axis=1)].to_csv(os.path.join(current_app.config['UPLOAD_FOLDER'], missing_filename), index=False)
 
-    numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
-    hist_paths = save_histograms(df, record.id, numeric_cols)
+@main.route('/api/analyse/<int:csv_id>/charts')
+@login_required
+def chart_data(csv_id):
+    """
+    Histogram bins for numeric columns and top value counts for the other columns,
+    served from the cached profile. Accepts column, bins, min, max and top filters.
+    """
+    record = CSVFile.query.get_or_404(csv_id)
+    if record.user_sub != session['user']['sub']:
+        abort(404)
+    profile = cached_profile(record)
+    if profile is None:
+        job = enqueue_once('analysis', record)
+        return jsonify({'status': 'pending', 'job_url': url_for('main.job_status', job_id=job.id)}), 202
+
+    column = request.args.get('column')
+    if column is not None and column not in profile['fine_bins'] and column not in profile['top_values']:
+        abort(404)
+    columns = [column] if column is not None else [*profile['fine_bins'], *profile['top_values']]
+    bins = min(max(request.args.get('bins', 20, type=int), 1), 200)
+    top = min(max(request.args.get('top', 10, type=int), 1), TOP_VALUES)
+
+    charts = {}
+    for col in columns:
+        if col in profile['fine_bins']:
+            edges, counts = rebin(*profile['fine_bins'][col], bins,
+                                  lo=request.args.get('min', type=float), hi=request.args.get('max', type=float))
+            charts[col] = {'type': 'histogram', 'edges': edges.tolist(), 'counts': counts.tolist()}
+        else:
+            values = profile['top_values'][col][:top]
+            charts[col] = {'type': 'categories', 'labels': [v for v, _ in values], 'counts': [n for _, n in values]}
+    return jsonify({'status': 'ready', 'charts': charts})
+
+
+@main.route('/compare')
+@login_required
+def compare():
+    """
+    Compare two or more CSV records, each with the next in upload order, from their
+    stored profiles and row sets, so no file is read again. Takes the records as
+    repeated ids; those not profiled yet are analysed first while the page waits.
+    """
+    ids = sorted(set(request.args.getlist('ids', type=int)))
+    most = current_app.config['COMPARE_MAX_FILES']
+    if not 2 <= len(ids) <= most:
+        flash(f"Select between 2 and {most} files to compare.")
+        return redirect(url_for('main.mycsvs'))
+    records = CSVFile.query.filter(CSVFile.id.in_(ids), CSVFile.user_sub == session['user']['sub']) \
+        .order_by(CSVFile.id).all()
+    if len(records) != len(ids):
+        abort(404)
+
+    profiles = [cached_profile(record) for record in records]
+    jobs = [enqueue_once('analysis', record) for record, profile in zip(records, profiles) if profile is None]
+    if jobs:
+        return render_template('compare.html', records=records, jobs=jobs, pairs=[])
+    pairs = [
+        (a, b, compare_files(a.content_hash, profile_a, b.content_hash, profile_b))
+        for (a, profile_a), (b, profile_b) in zip(zip(records, profiles), zip(records[1:], profiles[1:]))
+    ]
+    return render_template('compare.html', records=records, jobs=[], pairs=pairs)
+
+
+def send_export(record, kind, filename):
+    """
+    Serve a derived export from the cache, or build it while streaming it to the
+    client (gzip-compressed when accepted) and cache it for the next download.
+    """
+    if not record.content_hash:
+        record.content_hash = file_hash(record.filepath)
+        db.session.commit()
+    cache = get_export_cache()
+    cached = cache.get(record.content_hash, kind)
+    metrics.cache_lookup('export', cached is not None)
+    if cached:
+        return send_stored_file(cached, filename, 'text/csv')
+    if kind not in EXPORT_KINDS:
+        #unique rows exports are built by their job, an evicted one has to be run again
+        abort(404)
+
+    config = current_app.config
+    chunks = cache.write_through(record.content_hash, kind, iter_export(
+        data_path(record), kind, config['STREAM_CHUNK_ROWS'], config['DEDUP_SPILL_DIR'], record.csv_schema))
+    headers = {'Content-Disposition': content_disposition(filename), 'Vary': 'Accept-Encoding'}
+    if accepts_gzip():
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(chunks, mimetype='text/csv', headers=headers)
+
+
+@main.route('/exports/<int:csv_id>/<kind>')
+@login_required
+def download_export(csv_id, kind):
+    record = CSVFile.query.get_or_404(csv_id)
+    if record.user_sub != session['user']['sub'] or not is_export_kind(kind):
+        abort(404)
+    return send_export(record, kind, export_filename(kind, record.filename))
 
-    return render_template(
-        'analysis.html', filename=record.filename, dtypes=dtypes,
-        basic_stats=basic_stats, corr=corr_html,
-        total_rows=total_rows, dup_count=dup_count,
-        cleaned_filename=cleaned_filename, missing_stats=missing_stats,
-        missing_rows_count=missing_rows_count, missing_filename=missing_filename,
-        numeric_cols=numeric_cols, hist_paths=hist_paths, csv_file=record
-    )
+
+@main.route('/download/csv/<int:csv_id>')
+@login_required
+def download_csv(csv_id):
+    #uploads are stored by content hash and may share a filename, so they are found by record
+    record = CSVFile.query.get_or_404(csv_id)
+    if record.user_sub != session['user']['sub'] or not os.path.isfile(record.filepath):
+        abort(404)
+    return send_stored_file(record.filepath, record.filename, 'text/csv')
 
 
 @main.route('/download/<path:filename>')
 @login_required
 def download_file(filename):
-    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-    mimetype = 'application/pdf' if filename.lower().endswith('.pdf') else 'text/csv'
-    file_bytes = open(file_path, 'rb').read()
-    return send_file(io.BytesIO(file_bytes), mimetype=mimetype, download_name=filename, as_attachment=True)
+    #a user has one report per name; they are artifacts, except those written to the upload folder before the store
+    report = PDFReport.query.filter_by(user_sub=session['user']['sub'], filename=filename).first()
+    if report is None:
+        abort(404)
+    if not os.path.isabs(report.filepath):
+        return send_artifact(report.filepath, filename, 'application/pdf')
+    if not os.path.isfile(report.filepath):
+        abort(404)
+    return send_stored_file(report.filepath, filename, 'application/pdf')
+
+
+@main.route('/artifacts/analysis/<content_hash>/<name>')
+@login_required
+def analysis_image(content_hash, name):
+    #histogram images are shared by identical uploads, so any of the user's copies gives access
+    if not CSVFile.query.filter_by(user_sub=session['user']['sub'], content_hash=content_hash).first():
+        abort(404)
+    return send_artifact(f"analysis/{content_hash}/{name}", name, 'image/png', as_attachment=False)
+
+
+@main.route('/dedup/<int:csv_id>', methods=['POST'])
+@login_required
+def dedup_csv(csv_id):
+    # export unique rows by chosen key columns and/or ignoring case and spacing, in the background
+    record = CSVFile.query.get_or_404(csv_id)
+    if record.user_sub != session['user']['sub']:
+        flash("Unauthorized access.", "danger")
+        return redirect(url_for('main.mycsvs'))
+    profile = cached_profile(record)
+    columns = list(profile['dtypes']) if profile else []
+    subset = [col for col in request.form.getlist('columns') if col in columns]
+    params = {'subset': subset, 'normalize': request.form.get('normalize') == 'on'}
+    job = enqueue_once('dedup', record, params=params)
+    return redirect(url_for('main.job_page', job_id=job.id))
 
 
 @main.route('/generate_pdf/<int:csv_id>')
 @login_required
 def generate_pdf(csv_id):
-    # generate pdf for the given csv file
+    # generate pdf for the given csv file in the background
     csv_record = CSVFile.query.get_or_404(csv_id)
-    df = pd.read_csv(csv_record.filepath)
-
+    if csv_record.user_sub != session['user']['sub']:
+        abort(404)
     # get optional prompt if it is given by the uaser
     user_prompt = request.args.get("prompt", "").strip()
-    ai_insight = generate_ai_insight(df, user_prompt)
-
-    # generate graphs via matplotlib
-    plot_funcs = [create_numeric_plot, create_category_plot, create_correlation_heatmap]
-    plot_infos = [(buf, fname, exp) for func in plot_funcs for buf, fname, exp in [func(df)] if buf]
-
-    #pdf design and structure
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", "B", 14)
-    pdf.cell(0, 10, clean_text(f"CSV Analysis Report for {csv_record.filename}"), ln=True)
-    pdf.set_font("Arial", "B", 12)
-    pdf.ln(5)
-    pdf.cell(0, 10, clean_text("AI Analysis:"), ln=True)
-    pdf.set_font("Arial", size=10)
-    for line in ai_insight.split("\n"):
-        pdf.multi_cell(0, 7, clean_text(line))
-    pdf.ln(5)
-
-    #add the graphs at the end of the pdf
-    for i, (buf, fname, explanation) in enumerate(plot_infos):
-        path = os.path.join(current_app.config['UPLOAD_FOLDER'], fname)
-        with open(path, 'wb') as f:
-            f.write(buf.getbuffer())
-        pdf.add_page()
-        pdf.set_font("Arial", "B", 12)
-        pdf.cell(0, 10, clean_text(f"Figure {i + 1}"), ln=True)
-        pdf.set_font("Arial", size=10)
-        if explanation:
-            pdf.multi_cell(0, 7, clean_text(explanation))
-            pdf.ln(3)
-        pdf.image(path, x=10, w=pdf.w - 20)
-        os.remove(path)
-
-    #save pdf physically
-    pdf_filename = f"{os.path.splitext(csv_record.filename)[0]}_analysis_report.pdf"
-    storage_path = os.path.join(current_app.config['UPLOAD_FOLDER'], pdf_filename)
-    pdf_bytes = pdf.output(dest='S').encode('latin-1')
-    with open(storage_path, 'wb') as f:
-        f.write(pdf_bytes)
-
-    #save pdf in db
-    if not PDFReport.query.filter_by(filename=pdf_filename, user_sub=csv_record.user_sub).first():
-        db.session.add(PDFReport(
-            filename=pdf_filename,
-            user_sub=csv_record.user_sub,
-            filepath=storage_path))
-        db.session.commit()
+    job = enqueue_once('report', csv_record, params={'prompt': user_prompt})
+    return redirect(url_for('main.job_page', job_id=job.id))
 
-    return send_file(
-        storage_path,
-        mimetype='application/pdf',
-        as_attachment=True,
-        download_name=pdf_filename
-    )
+
+# ----------------------
+# Background Jobs
+# ----------------------
+def get_user_job(job_id):
+    job = Job.query.get_or_404(job_id)
+    if job.user_sub != session['user']['sub']:
+        abort(404)
+    return job
+
+
+def job_result_url(job):
+    if job.status != 'done':
+        return None
+    if job.kind in ('analysis', 'ingest', 'append'):
+        return url_for('main.analyse_csv', csv_id=job.csv_id)
+    if job.kind == 'report':
+        return url_for('main.download_file', filename=job.result)
+    if job.kind == 'dedup':
+        return url_for('main.download_export', csv_id=job.csv_id, kind=job.result)
+    return None
+
+
+@main.route('/jobs/<int:job_id>')
+@login_required
+def job_page(job_id):
+    #progress view that polls the status endpoint below
+    return render_template('job.html', job=get_user_job(job_id))
+
+
+@main.route('/api/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    job = get_user_job(job_id)
+    return jsonify({
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'result_url': job_result_url(job),
+        'peak_rss_mb': job.peak_rss_mb,
+        'stages': job.stages,
+    })
+
+
+# ----------------------
+# Instrumentation
+# ----------------------
+@main.route('/metrics')
+def metrics_endpoint():
+    #Prometheus scrape target, summed over every worker process
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        abort(401)
+    jobs = db.session.execute(db.select(Job.kind, Job.status, db.func.count()).group_by(Job.kind, Job.status))
+    gauges = [('jobs', "Background jobs by kind and status.",
+               {(('kind', kind), ('status', status)): count for kind, status, count in jobs})]
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
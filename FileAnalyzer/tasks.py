@@ -0,0 +1,80 @@
+import os
+from models import db, CSVFile
+from utils.jobs import task, JobError
+from utils.profile import load_profile, append_to_dataset, export_unique_rows, profile_upload
+from utils.storage import ensure_columnar
+from utils.ingest import try_infer_csv_schema
+from utils.report import build_pdf_report
+from utils.metrics import metrics
+from utils.locks import lease_lock
+
+
+@task('analysis', priority=10)
+def run_analysis(job, progress):
+    """
+    Build (or fetch from cache) the analysis profile of an uploaded CSV.
+    """
+    record = db.session.get(CSVFile, job.csv_id)
+    if record is None:
+        raise JobError("The CSV file no longer exists.")
+    #uploads from before schema sniffing get theirs on first analysis
+    if record.csv_schema is None:
+        record.csv_schema = try_infer_csv_schema(record.filepath)
+    #parse the CSV once into a typed columnar copy that every later read uses;
+    #identical uploads share the file, so their jobs convert it one at a time
+    progress(5, "Converting to columnar format")
+    with lease_lock(f"columnar:{record.content_hash or record.id}"), \
+            metrics.span('parse.columnar', nbytes=os.path.getsize(record.filepath)):
+        ensure_columnar(record)
+    db.session.commit()
+    #empty files fail here with a JobError, before anything is cached
+    load_profile(record, progress)
+    return None
+
+
+@task('ingest', priority=10)
+def run_ingest(job, progress):
+    """
+    Profile a large chunked upload while it is still being received.
+    """
+    profile_upload(job.params['upload_id'], progress)
+    return None
+
+
+@task('append', priority=10)
+def run_append(job, progress):
+    """
+    Append an uploaded delta to an existing dataset and update its profile.
+    """
+    delta_path = job.params['delta_path']
+    try:
+        record = db.session.get(CSVFile, job.csv_id)
+        if record is None:
+            raise JobError("The CSV file no longer exists.")
+        append_to_dataset(record, delta_path, progress)
+    finally:
+        if os.path.exists(delta_path):
+            os.remove(delta_path)
+    return None
+
+
+@task('dedup', priority=30)
+def run_dedup(job, progress):
+    """
+    Export the rows of a CSV without duplicates by key columns or normalized text.
+    """
+    record = db.session.get(CSVFile, job.csv_id)
+    if record is None:
+        raise JobError("The CSV file no longer exists.")
+    return export_unique_rows(record, job.params.get('subset'), job.params.get('normalize', False), progress)
+
+
+@task('report', priority=50)
+def run_report(job, progress):
+    """
+    Generate the PDF report of a CSV and return its filename.
+    """
+    record = db.session.get(CSVFile, job.csv_id)
+    if record is None:
+        raise JobError("The CSV file no longer exists.")
+    return build_pdf_report(record, job.params.get('prompt', ''), progress)
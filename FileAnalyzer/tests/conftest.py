@@ -0,0 +1,71 @@
+import os
+import pytest
+from flask import Flask
+from config import Config
+from models import db, migrate_schema, User
+from routes import main
+from utils.jobs import job_queue
+import tasks  # noqa: F401  registers the job kinds routes enqueue
+from utils.metrics import metrics
+
+
+@pytest.fixture
+def app(tmp_path):
+    """
+    A bare app with the default settings, its caches and metrics under tmp_path
+    and AI insights answered by the stub client.
+    """
+    app = Flask(__name__, root_path=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    app.config.from_object(Config)
+    app.config.update(
+        AI_CLIENT='stub',
+        AI_STUB_WORD_SECONDS=0,
+        AI_CACHE_DIR=str(tmp_path / 'insights'),
+        AI_LIMITER_DIR=str(tmp_path / 'ai-slots'),
+        METRICS_DIR=str(tmp_path / 'metrics'),
+    )
+    metrics.init_app(app)
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def db_app(app, tmp_path):
+    """
+    The bare app with a SQLite database and every upload, cache and state
+    directory under tmp_path.
+    """
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'app.db'}",
+        SQLALCHEMY_ENGINE_OPTIONS={},
+        UPLOAD_FOLDER=str(tmp_path / 'uploads'),
+        REPORT_FOLDER=str(tmp_path / 'reports'),
+        PROFILE_CACHE_DIR=str(tmp_path / 'profiles'),
+        EXPORT_CACHE_DIR=str(tmp_path / 'exports'),
+        DATASET_STATE_DIR=str(tmp_path / 'state'),
+        DEDUP_SPILL_DIR=str(tmp_path / 'dedup'),
+        ARTIFACT_STORE='local',
+        ARTIFACT_DIR=str(tmp_path / 'artifacts'),
+    )
+    os.makedirs(app.config['UPLOAD_FOLDER'])
+    db.init_app(app)
+    migrate_schema()
+    db.session.add(User(sub='u1', name='U', email='u@example.com'))
+    db.session.commit()
+    yield app
+    db.session.remove()
+
+
+@pytest.fixture
+def client(db_app):
+    """
+    A test client of the app's routes, logged in as the db_app user. Jobs are
+    queued without workers to run them.
+    """
+    db_app.config['JOB_WORKERS'] = 0
+    job_queue.init_app(db_app)
+    db_app.register_blueprint(main)
+    client = db_app.test_client()
+    with client.session_transaction() as session:
+        session['user'] = {'sub': 'u1', 'name': 'U', 'email': 'u@example.com', 'picture': None}
+    return client
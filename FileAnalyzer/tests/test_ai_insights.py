@@ -0,0 +1,169 @@
+import os
+import fcntl
+import numpy as np
+import pandas as pd
+import pytest
+from utils.ai_client import ConcurrencyLimiter, InsightClient, StubInsightClient
+from utils.ai_insights import generate_ai_insight, iter_ai_insight, build_insight_prompt, UNAVAILABLE_MESSAGE
+from utils.correlation import correlation_matrix
+from utils.stats import compute_basic_stats, top_values
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(3)
+    n = 200
+    return pd.DataFrame({
+        'price': rng.normal(100, 10, n),
+        'qty': rng.integers(1, 20, n),
+        'discount': rng.uniform(0, 0.3, n),
+        'region': rng.choice(['north', 'south'], n),
+        'channel': rng.choice(['web', 'store', 'phone'], n),
+        'returns': rng.integers(0, 3, n),
+        'rating': rng.uniform(1, 5, n),
+    })
+
+
+def stub(app, **kwargs):
+    limiter = ConcurrencyLimiter(app.config['AI_LIMITER_DIR'], app.config['AI_MAX_CONCURRENCY'])
+    return StubInsightClient('stub-model', limiter, **kwargs)
+
+
+class FailingGroupClient(StubInsightClient):
+    """
+    Stub that fails the requests for the column groups whose scope mentions fail_on.
+    """
+
+    def __init__(self, *args, fail_on=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fail_on = fail_on
+
+    async def _stream(self, prompt, max_tokens):
+        if any(scope in prompt for scope in self.fail_on):
+            raise RuntimeError("group failed")
+        async for piece in super()._stream(prompt, max_tokens):
+            yield piece
+
+
+def test_clients_must_implement_stream(app):
+    limiter = ConcurrencyLimiter(app.config['AI_LIMITER_DIR'], 1)
+    with pytest.raises(TypeError, match='_stream'):
+        InsightClient('model', limiter)
+
+
+def test_insight_streams_the_stub_answer(app, frame):
+    client = stub(app)
+    pieces = list(iter_ai_insight(frame, client=client))
+    assert len(pieces) > 1
+    assert ''.join(pieces).startswith("Stub analysis from stub-model.")
+    assert len(client.prompts) == 1
+
+
+def test_cache_miss_then_hit(app, frame):
+    client = stub(app)
+    first = generate_ai_insight(frame, "focus on prices", content_hash='abc', client=client)
+    second = generate_ai_insight(frame, "focus on prices", content_hash='abc', client=client)
+    assert second == first
+    assert len(client.prompts) == 1
+
+
+def test_cache_is_keyed_on_the_prompt_and_the_file(app, frame):
+    client = stub(app)
+    generate_ai_insight(frame, "focus on prices", content_hash='abc', client=client)
+    generate_ai_insight(frame, "focus on regions", content_hash='abc', client=client)
+    generate_ai_insight(frame, "focus on prices", content_hash='def', client=client)
+    assert len(client.prompts) == 3
+
+
+def test_nothing_is_cached_without_a_content_hash(app, frame):
+    client = stub(app)
+    generate_ai_insight(frame, client=client)
+    generate_ai_insight(frame, client=client)
+    assert len(client.prompts) == 2
+    assert not os.listdir(app.config['AI_CACHE_DIR'])
+
+
+def test_deadline_before_any_text_gives_the_unavailable_message(app, frame):
+    #every word takes longer than the whole deadline
+    client = stub(app, word_seconds=1, request_timeout=0.05, deadline=0.1)
+    with pytest.warns(UserWarning, match="TimeoutError"):
+        assert generate_ai_insight(frame, content_hash='abc', client=client) == UNAVAILABLE_MESSAGE
+    assert not os.listdir(app.config['AI_CACHE_DIR'])
+
+
+def test_deadline_mid_answer_keeps_the_partial_text_uncached(app, frame):
+    client = stub(app, word_seconds=0.02, request_timeout=0.1, deadline=0.1)
+    with pytest.warns(UserWarning, match="TimeoutError"):
+        text = generate_ai_insight(frame, content_hash='abc', client=client)
+    assert text.startswith("Stub ")
+    assert text != UNAVAILABLE_MESSAGE
+    assert 'covered:' not in text
+    #text already handed out is never retried
+    assert len(client.prompts) == 1
+    assert not os.listdir(app.config['AI_CACHE_DIR'])
+
+
+def test_deadline_waiting_for_a_request_slot(app, frame):
+    app.config['AI_MAX_CONCURRENCY'] = 1
+    client = stub(app, deadline=0.2)
+    os.makedirs(app.config['AI_LIMITER_DIR'], exist_ok=True)
+    with open(os.path.join(app.config['AI_LIMITER_DIR'], 'slot-0.lock'), 'w') as slot:
+        #another process holds the only slot
+        fcntl.flock(slot, fcntl.LOCK_EX)
+        with pytest.warns(UserWarning, match="No AI request slot"):
+            assert generate_ai_insight(frame, client=client) == UNAVAILABLE_MESSAGE
+    assert not client.prompts
+
+
+def test_wide_frames_are_analysed_per_column_group(app, frame):
+    app.config['AI_COLUMN_GROUP_SIZE'] = 3
+    client = stub(app)
+    text = generate_ai_insight(frame, client=client)
+    #three groups of at most three columns, then the merge
+    assert len(client.prompts) == 4
+    assert "group 1 of 3" in client.prompts[0] and "group 3 of 3" in client.prompts[2]
+    assert "rating" in client.prompts[2] and "price" not in client.prompts[2]
+    merge = client.prompts[3]
+    assert "was analysed in 3 column groups" in merge
+    assert merge.count("Stub analysis from stub-model.") == 3
+    assert text.startswith("Stub analysis from stub-model.")
+
+
+def test_failed_column_groups_are_left_out_of_the_merge(app, frame):
+    app.config['AI_COLUMN_GROUP_SIZE'] = 3
+    limiter = ConcurrencyLimiter(app.config['AI_LIMITER_DIR'], app.config['AI_MAX_CONCURRENCY'])
+    client = FailingGroupClient('stub-model', limiter, fail_on=("group 2 of 3",))
+    with pytest.warns(UserWarning, match="group 2 of 3"):
+        text = generate_ai_insight(frame, client=client)
+    merge = client.prompts[-1]
+    assert "was analysed in 2 column groups" in merge
+    assert "group 2 of 3" not in merge
+    assert text.startswith("Stub analysis")
+
+
+def test_all_column_groups_failing_gives_the_unavailable_message(app, frame):
+    app.config['AI_COLUMN_GROUP_SIZE'] = 3
+    limiter = ConcurrencyLimiter(app.config['AI_LIMITER_DIR'], app.config['AI_MAX_CONCURRENCY'])
+    client = FailingGroupClient('stub-model', limiter, fail_on=("of 3",))
+    with pytest.warns(UserWarning):
+        text = generate_ai_insight(frame, content_hash='abc', client=client)
+    assert text == UNAVAILABLE_MESSAGE
+    assert not os.listdir(app.config['AI_CACHE_DIR'])
+
+
+def test_prompt_describes_the_whole_file_from_its_profile(frame):
+    numeric_cols = list(frame.select_dtypes(include='number').columns)
+    text_cols = [col for col in frame.columns if col not in numeric_cols]
+    profile = {
+        'total_rows': len(frame),
+        'dtypes': frame.dtypes.astype(str).to_dict(),
+        'numeric_cols': numeric_cols,
+        'basic_stats': compute_basic_stats(frame),
+        'corr': correlation_matrix(frame),
+        'top_values': top_values(frame, text_cols),
+    }
+    #only the first rows are in memory
+    prompt = build_insight_prompt(frame.head(5), profile=profile)
+    assert f"a dataset with {len(frame)} rows" in prompt.lower()
+    price = frame['price']
+    assert f"price (numeric): count={len(frame)}, mean={price.mean():.4g}, std={price.std():.4g}" in prompt
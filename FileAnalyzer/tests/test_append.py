@@ -0,0 +1,47 @@
+import pickle
+import pandas as pd
+from models import db, CSVFile
+from utils.ingest import infer_csv_schema
+from utils.profile import append_to_dataset, load_state, state_path
+
+
+def _dataset(tmp_path, frame):
+    path = tmp_path / 'sales.csv'
+    frame.to_csv(path, index=False)
+    record = CSVFile(user_sub='u1', filename='sales.csv', filepath=str(path),
+                     csv_schema=infer_csv_schema(str(path)))
+    db.session.add(record)
+    db.session.commit()
+    return record
+
+
+def test_append_with_missing_int_counts_duplicates(db_app, tmp_path):
+    db_app.config['STREAM_CHUNK_ROWS'] = 4
+    rows = pd.DataFrame({'store': ['a', 'b', 'c', 'd', 'e', 'f'], 'qty': [1, 2, 3, 4, 5, 6]})
+    record = _dataset(tmp_path, rows)
+    #the missing quantity makes the delta's qty float64, its other rows repeat the dataset's
+    delta = pd.DataFrame({'store': ['a', 'g', 'c', 'b'], 'qty': [1, None, 3, 2]})
+    delta_path = tmp_path / 'delta.csv'
+    delta.to_csv(delta_path, index=False)
+
+    profile = append_to_dataset(record, str(delta_path))
+
+    expected = pd.read_csv(record.filepath)
+    assert profile['total_rows'] == len(expected) == 10
+    assert profile['dup_count'] == expected.duplicated().sum() == 3
+    assert load_state(record).dup_count == 3
+
+
+def test_state_from_an_older_version_is_rebuilt(db_app, tmp_path):
+    record = _dataset(tmp_path, pd.DataFrame({'qty': [1, 2, 2]}))
+    delta_path = tmp_path / 'delta.csv'
+    pd.DataFrame({'qty': [2]}).to_csv(delta_path, index=False)
+    append_to_dataset(record, str(delta_path))
+    with open(state_path(record), 'rb') as f:
+        content_hash, _, profiler = pickle.load(f)
+    with open(state_path(record), 'wb') as f:
+        pickle.dump((content_hash, profiler), f)
+
+    assert load_state(record) is None
+    pd.DataFrame({'qty': [1]}).to_csv(delta_path, index=False)
+    assert append_to_dataset(record, str(delta_path))['dup_count'] == 3
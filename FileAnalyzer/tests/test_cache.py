@@ -0,0 +1,30 @@
+import pytest
+from utils.cache import ProfileCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ProfileCache(str(tmp_path), max_bytes=2 ** 20)
+    for content_hash in ('aaa', 'bbb', 'ccc'):
+        cache.set(content_hash, {'content_hash': content_hash})
+    cache.set_comparison('aaa', 'bbb', {'pair': 'ab'})
+    cache.set_comparison('bbb', 'ccc', {'pair': 'bc'})
+    return cache
+
+
+def test_comparisons_are_cached_per_ordered_pair(cache):
+    assert cache.get_comparison('aaa', 'bbb') == {'pair': 'ab'}
+    assert cache.get_comparison('bbb', 'aaa') is None
+
+
+@pytest.mark.parametrize('content_hash', ['aaa', 'bbb'])
+def test_invalidating_either_file_drops_their_comparison(cache, content_hash):
+    cache.invalidate(content_hash)
+    assert cache.get(content_hash) is None
+    assert cache.get_comparison('aaa', 'bbb') is None
+
+
+def test_invalidating_a_file_keeps_other_entries(cache):
+    cache.invalidate('aaa')
+    assert cache.get('bbb') == {'content_hash': 'bbb'}
+    assert cache.get_comparison('bbb', 'ccc') == {'pair': 'bc'}
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+from utils.dedup import HashStore, bucket_hashes, diff_row_sets, row_hashes, write_row_set
+
+
+@pytest.fixture
+def versions():
+    rng = np.random.default_rng(4)
+    v1 = pd.DataFrame({'id': np.arange(100), 'qty': rng.integers(0, 1_000, 100), 'name': [f"n{i}" for i in range(100)]})
+    #one more row with a missing quantity turns the column into float64
+    v2 = pd.concat([v1, pd.DataFrame({'id': [100], 'qty': [np.nan], 'name': ['new']})], ignore_index=True)
+    assert v1['qty'].dtype == np.int64 and v2['qty'].dtype == np.float64
+    return v1, v2
+
+
+def _diff(path_a, path_b):
+    with np.load(path_a) as a, np.load(path_b) as b:
+        return diff_row_sets(a, b)
+
+
+def test_row_diff_when_a_column_changes_dtype(versions, tmp_path):
+    v1, v2 = versions
+    path_a, path_b = tmp_path / 'a.npz', tmp_path / 'b.npz'
+    write_row_set(path_a, bucket_hashes(row_hashes(v1)))
+    write_row_set(path_b, bucket_hashes(row_hashes(v2)))
+    assert _diff(path_a, path_b) == (0, 1, 100)
+
+
+def test_streamed_row_set_matches_an_in_memory_one(versions, tmp_path):
+    #large files get their row set from the streaming profiler's HashStore
+    v1, v2 = versions
+    store = HashStore()
+    for start in range(0, len(v2), 30):
+        store.add(row_hashes(v2.iloc[start:start + 30]))
+    path_a, path_b = tmp_path / 'a.npz', tmp_path / 'b.npz'
+    write_row_set(path_a, bucket_hashes(row_hashes(v1)))
+    write_row_set(path_b, store.sorted_buckets())
+    assert _diff(path_a, path_b) == (0, 1, 100)
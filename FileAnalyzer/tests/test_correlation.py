@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+from utils.correlation import correlation_matrix
+
+# the moment products run in float32
+ATOL = 1e-5
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(1)
+    n = 20_000
+    x = rng.normal(1_000, 5, n)
+    df = pd.DataFrame({
+        'x': x,
+        'y': 0.5 * x + rng.normal(0, 5, n),
+        'z': rng.exponential(2, n),
+        'k': rng.integers(0, 10, n),
+        's': rng.choice(['a', 'b'], n),
+    })
+    df.loc[rng.choice(n, 2_000, replace=False), 'y'] = np.nan
+    df.loc[rng.choice(n, 500, replace=False), 'z'] = np.nan
+    return df
+
+
+def test_pearson_matches_pandas(frame):
+    #blocks smaller than the frame, so rows are added in several updates
+    corr = correlation_matrix(frame, block_rows=3_000)
+    expected = frame.corr(numeric_only=True)
+    pd.testing.assert_index_equal(corr.columns, expected.columns)
+    np.testing.assert_allclose(corr.to_numpy(), expected.to_numpy(), atol=ATOL)
+
+
+def test_spearman_matches_pandas(frame):
+    #ranks are taken over whole columns, which matches pandas without missing values
+    complete = frame.dropna()
+    corr = correlation_matrix(complete, method='spearman')
+    np.testing.assert_allclose(corr.to_numpy(), complete.corr(method='spearman', numeric_only=True).to_numpy(),
+                               atol=ATOL)
+
+
+def test_correlation_of_a_constant_column_is_missing():
+    df = pd.DataFrame({'a': [1.0, 2.0, 3.0], 'b': [4.0, 4.0, 4.0]})
+    corr = correlation_matrix(df)
+    assert np.isnan(corr.loc['a', 'b'])
+    assert corr.loc['a', 'a'] == pytest.approx(1.0)
+
+
+def test_unknown_method_raises(frame):
+    with pytest.raises(ValueError):
+        correlation_matrix(frame, method='kendall')
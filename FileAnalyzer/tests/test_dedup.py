@@ -0,0 +1,112 @@
+import io
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+from utils import ingest
+from utils.dedup import HashStore, row_hashes, dedup_frames
+from utils.ingest import infer_csv_schema
+from utils.stats import stream_profile
+from utils.storage import iter_frames
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(2)
+    n = 30_000
+    return pd.DataFrame({
+        'a': rng.integers(0, 40, n),
+        'b': rng.choice(['x', 'y', 'z', None], n),
+        'c': rng.choice([0.25, 0.5, np.nan], n),
+    })
+
+
+def _duplicates(store, frame, chunksize):
+    return np.concatenate([store.add(row_hashes(frame.iloc[start:start + chunksize]))
+                           for start in range(0, len(frame), chunksize)])
+
+
+def test_hash_store_matches_duplicated(frame):
+    store = HashStore()
+    dup = _duplicates(store, frame, 1_000)
+    np.testing.assert_array_equal(dup, frame.duplicated().to_numpy())
+    assert store.size == len(frame.drop_duplicates())
+
+
+def test_spilled_hash_store_matches_duplicated(frame, tmp_path):
+    #runs of more than 50 hashes go to disk, so lookups also search memory-mapped runs
+    store = HashStore(directory=str(tmp_path), buckets=4, spill_rows=50)
+    dup = _duplicates(store, frame, 777)
+    np.testing.assert_array_equal(dup, frame.duplicated().to_numpy())
+    assert list(tmp_path.iterdir())
+
+
+def test_hash_store_by_key_columns(frame):
+    store = HashStore()
+    dup = np.concatenate([store.add(row_hashes(frame.iloc[start:start + 5_000], subset=['a', 'b']))
+                          for start in range(0, len(frame), 5_000)])
+    np.testing.assert_array_equal(dup, frame.duplicated(subset=['a', 'b']).to_numpy())
+
+
+def test_spilled_runs_are_memory_mapped_and_survive_pickling(frame, tmp_path):
+    store = HashStore(directory=str(tmp_path), buckets=4, spill_rows=50)
+    _duplicates(store, frame.iloc[:20_000], 1_000)
+    spilled = [run for bucket in store.runs for run in bucket if isinstance(run, str)]
+    assert spilled and all(os.path.exists(run) for run in spilled)
+    assert isinstance(store._array(spilled[0]), np.memmap)
+
+    restored = pickle.loads(pickle.dumps(store))
+    dup = _duplicates(restored, frame.iloc[20_000:], 1_000)
+    np.testing.assert_array_equal(dup, frame.duplicated().to_numpy()[20_000:])
+
+
+def test_runs_are_merged_as_they_grow(frame):
+    store = HashStore(buckets=2)
+    _duplicates(store, frame, 100)
+    #runs halve in length at most from one to the next, like the levels of an LSM tree
+    for bucket in store.runs:
+        lengths = [len(run) for run in bucket]
+        assert lengths == sorted(lengths, reverse=True)
+        assert len(lengths) <= int(np.log2(max(sum(lengths), 2))) + 1
+    assert sum(len(run) for bucket in store.runs for run in bucket) == store.size
+
+
+def test_numbers_hash_by_value_across_dtypes():
+    ints = pd.DataFrame({'n': [1, 2, -3, 0], 's': ['a', 'b', 'c', 'd']})
+    floats = pd.DataFrame({'n': [1.0, 2.0, -3.0, -0.0], 's': ['a', 'b', 'c', 'd']})
+    np.testing.assert_array_equal(row_hashes(ints), row_hashes(floats))
+    narrow = ints.astype({'n': 'int8'})
+    np.testing.assert_array_equal(row_hashes(narrow), row_hashes(ints))
+    nullable = ints.astype({'n': 'Int64'})
+    np.testing.assert_array_equal(row_hashes(nullable), row_hashes(ints))
+
+
+def test_large_integers_keep_distinct_hashes():
+    #all three round to the same float64
+    big = pd.DataFrame({'n': np.array([2 ** 60, 2 ** 60 + 1, 2 ** 60 + 2], dtype=np.int64)})
+    assert len(set(row_hashes(big))) == 3
+    assert row_hashes(big)[0] == row_hashes(pd.DataFrame({'n': [float(2 ** 60)]}))[0]
+
+
+def test_duplicates_across_an_int_to_float_chunk_boundary():
+    #the second chunk has a missing value, so its column is read as float64
+    first = pd.DataFrame({'n': [1, 2, 3, 4], 's': ['a', 'b', 'c', 'd']})
+    second = pd.DataFrame({'n': [1.0, np.nan, 4.0], 's': ['a', 'e', 'x']})
+    store = HashStore()
+    assert not store.add(row_hashes(first)).any()
+    assert store.add(row_hashes(second)).tolist() == [True, False, False]
+
+
+def test_streaming_profile_counts_duplicates_across_chunk_dtypes(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, 'INFER_ROWS', 4)
+    path = tmp_path / 'data.csv'
+    path.write_text("n,s\n1,a\n2,b\n3,c\n4,d\n1,a\n,e\n5,f\n1,a\n")
+    schema = infer_csv_schema(str(path))
+    profile = stream_profile(str(path), chunksize=4, schema=schema)
+    assert profile['dup_count'] == 2
+
+    out = io.StringIO()
+    rows, dropped = dedup_frames(iter_frames(str(path), 4, schema), out)
+    assert (rows, dropped) == (8, 2)
+    assert len(pd.read_csv(io.StringIO(out.getvalue()))) == 6
@@ -0,0 +1,62 @@
+import gzip
+import pytest
+from models import db, CSVFile
+from utils.downloads import GZIP_MIN_BYTES, content_disposition
+
+
+@pytest.fixture
+def stored(client, tmp_path):
+    content = b'id,name\n' + b''.join(b'%d,name %d\n' % (i, i) for i in range(20_000))
+    assert len(content) >= GZIP_MIN_BYTES
+    path = tmp_path / 'stored.csv'
+    path.write_bytes(content)
+    record = CSVFile(user_sub='u1', filename='stored.csv', filepath=str(path))
+    db.session.add(record)
+    db.session.commit()
+    return f'/download/csv/{record.id}', content
+
+
+def test_ranges_and_conditional_requests(client, stored):
+    url, content = stored
+    response = client.get(url)
+    assert response.status_code == 200 and response.data == content
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    etag = response.headers['ETag']
+
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+    response = client.get(url, headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206 and response.data == content[10:20]
+    assert response.headers['Content-Range'] == f'bytes 10-19/{len(content)}'
+    assert client.get(url, headers={'Range': f'bytes={len(content)}-'}).status_code == 416
+
+
+def test_gzip_when_accepted(client, stored):
+    url, content = stored
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.data) == content
+    assert len(response.data) < len(content) / 3
+    etag = response.headers['ETag']
+    assert etag != client.get(url).headers['ETag']
+    assert client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code == 304
+    #ranges are of the stored bytes, so they are served uncompressed
+    response = client.get(url, headers={'Accept-Encoding': 'gzip', 'Range': 'bytes=0-1'})
+    assert response.status_code == 206 and response.data == b'id'
+
+    client.application.config['GZIP_DOWNLOADS'] = False
+    assert 'Content-Encoding' not in client.get(url, headers={'Accept-Encoding': 'gzip'}).headers
+
+
+def test_front_server_offload(client, stored, tmp_path):
+    url, _ = stored
+    client.application.config.update(X_ACCEL_REDIRECT_PREFIX='/protected', X_ACCEL_ROOT=str(tmp_path))
+    response = client.get(url)
+    assert response.headers['X-Accel-Redirect'] == '/protected/stored.csv' and response.data == b''
+    #files outside the root are sent by the app
+    client.application.config['X_ACCEL_ROOT'] = str(tmp_path / 'elsewhere')
+    assert 'X-Accel-Redirect' not in client.get(url).headers
+
+
+def test_content_disposition_of_non_ascii_names():
+    assert content_disposition('plain.csv') == 'attachment; filename="plain.csv"'
+    assert content_disposition('données.csv') == "attachment; filename*=UTF-8''donn%C3%A9es.csv"
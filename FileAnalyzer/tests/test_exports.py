@@ -0,0 +1,33 @@
+import pandas as pd
+from models import db, CSVFile, User
+
+
+def _upload(tmp_path, name, frame, user_sub='u1'):
+    path = tmp_path / f"{CSVFile.query.count()}.csv"
+    frame.to_csv(path, index=False)
+    record = CSVFile(user_sub=user_sub, filename=name, filepath=str(path))
+    db.session.add(record)
+    db.session.commit()
+    return record
+
+
+def test_same_named_uploads_download_their_own_exports(client, tmp_path):
+    first = _upload(tmp_path, 'data.csv', pd.DataFrame({'x': [1, 1, 2]}))
+    second = _upload(tmp_path, 'data.csv', pd.DataFrame({'x': [7, 8, 8, 9]}))
+
+    for record, rows in ((first, ['1', '2']), (second, ['7', '8', '9'])):
+        response = client.get(f'/exports/{record.id}/cleaned')
+        assert response.status_code == 200
+        assert response.get_data(as_text=True).split() == ['x', *rows]
+        assert 'cleaned_data.csv' in response.headers['Content-Disposition']
+
+
+def test_exports_of_other_users_and_unknown_kinds_are_not_found(client, tmp_path):
+    db.session.add(User(sub='u2', name='V', email='v@example.com'))
+    other = _upload(tmp_path, 'data.csv', pd.DataFrame({'x': [1]}), user_sub='u2')
+    own = _upload(tmp_path, 'data.csv', pd.DataFrame({'x': [1]}))
+
+    assert client.get(f'/exports/{other.id}/cleaned').status_code == 404
+    assert client.get(f'/exports/{own.id}/sideways').status_code == 404
+    #a unique rows export is only built by its job
+    assert client.get(f'/exports/{own.id}/unique-0123456789ab').status_code == 404
@@ -0,0 +1,66 @@
+import codecs
+import numpy as np
+import pandas as pd
+from utils.ingest import infer_csv_schema, detect_encoding, sniff_dialect, record_ends, same_dialect
+from utils.storage import read_frame
+
+
+def _types(schema):
+    return {col['name']: (col['type'], col['format']) for col in schema['columns']}
+
+
+def test_schema_of_a_semicolon_cp1252_file(tmp_path):
+    path = tmp_path / 'excel.csv'
+    rows = ''.join(f'{i};{i / 4};café {i % 3};{"true" if i % 2 else "false"};{i + 1:02d}.03.2024;n{i}\n'
+                   for i in range(20))
+    path.write_bytes(('id;price;shop;open;day;note\n' + rows).encode('cp1252'))
+
+    schema = infer_csv_schema(str(path))
+    assert (schema['encoding'], schema['delimiter'], schema['header']) == ('cp1252', ';', True)
+    assert _types(schema) == {
+        'id': ('int64', None), 'price': ('float64', None), 'shop': ('category', None),
+        'open': ('bool', None), 'day': ('datetime', '%d.%m.%Y'), 'note': ('string', None),
+    }
+    df = read_frame(str(path), schema=schema)
+    assert df['shop'].iloc[0] == 'café 0'
+    assert df['day'].iloc[0] == pd.Timestamp('2024-03-01')
+
+
+def test_headerless_numbers_get_column_names(tmp_path):
+    path = tmp_path / 'plain.csv'
+    path.write_text(''.join(f'{i}\t{i * 0.5}\n' for i in range(10)))
+    schema = infer_csv_schema(str(path))
+    assert (schema['delimiter'], schema['header']) == ('\t', False)
+    assert _types(schema) == {'column_1': ('int64', None), 'column_2': ('float64', None)}
+    df = read_frame(str(path), schema=schema)
+    assert list(df.columns) == ['column_1', 'column_2'] and len(df) == 10
+
+
+def test_detect_encoding():
+    assert detect_encoding(codecs.BOM_UTF8 + b'a,b\n') == 'utf-8-sig'
+    assert detect_encoding('naïve'.encode('utf-8')) == 'utf-8'
+    #cut inside a two-byte character
+    assert detect_encoding('naïve'.encode('utf-8')[:3]) == 'utf-8'
+    assert detect_encoding('€ 5'.encode('cp1252')) == 'cp1252'
+    assert detect_encoding(b'\x81\x8d') == 'latin-1'
+
+
+def test_sniff_dialect_header_votes():
+    assert sniff_dialect('year|total\n2020|5\n2021|7\n2022|') == ('|', '"', True)
+    assert sniff_dialect('2019,4\n2020,5\n2021,7\n') == (',', '"', False)
+
+
+def test_record_ends_skip_newlines_in_quoted_fields():
+    raw = b'a,"two\nlines"\nb,"say ""hi""\n"\nc,d'
+    assert record_ends(raw).tolist() == [14, 30]
+    assert np.array_equal(record_ends(raw.replace(b'"', b"'"), "'"), record_ends(raw))
+
+
+def test_schema_from_a_prefix_of_whole_records(tmp_path):
+    path = tmp_path / 'growing.csv'
+    content = b'name,qty\n' + b''.join(b'"item\n%d",%d\n' % (i, i) for i in range(50))
+    path.write_bytes(content)
+    #the prefix ends inside a quoted field of the fourth record
+    schema = infer_csv_schema(str(path), max_bytes=content.index(b'3",3') - 1)
+    assert _types(schema) == {'name': ('string', None), 'qty': ('int64', None)}
+    assert same_dialect(schema, infer_csv_schema(str(path)))
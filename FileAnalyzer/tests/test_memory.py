@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+from utils.memory import compact_frame, PeakRSS
+from utils.stats import compute_basic_stats
+from utils.dedup import row_hashes
+
+
+def _frame(n=5_000):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'small': rng.integers(0, 100, n),
+        'large': rng.integers(0, 2 ** 40, n),
+        'halves': rng.integers(0, 100, n) / 2,
+        'noisy': rng.normal(size=n),
+        'city': rng.choice(['Oslo', 'Lima', 'Pune'], n).astype(object),
+        'id': [f'row-{i}' for i in range(n)],
+        'flag': rng.random(n) < 0.5,
+        'nullable': pd.array(rng.integers(0, 9, n), dtype='Int64'),
+    })
+
+
+def test_compact_frame_shrinks_without_changing_values():
+    original = _frame()
+    df = compact_frame(original.copy())
+    assert df.dtypes.astype(str).to_dict() == {
+        'small': 'int8', 'large': 'int64', 'halves': 'float32', 'noisy': 'float64',
+        'city': 'category', 'id': original['id'].dtype.name, 'flag': 'bool', 'nullable': 'Int64',
+    }
+    assert df.memory_usage(deep=True).sum() < original.memory_usage(deep=True).sum()
+    assert df.attrs['source_dtypes'] == original.dtypes.astype(str).to_dict()
+    for col in original:
+        assert (df[col].astype(object) == original[col].astype(object)).all(), col
+
+
+def test_compacted_frames_give_the_same_statistics_and_row_hashes():
+    original = _frame()
+    df = compact_frame(original.copy())
+    assert compute_basic_stats(df) == compute_basic_stats(original)
+    np.testing.assert_array_equal(row_hashes(df), row_hashes(original))
+
+
+def test_small_frames_are_left_alone():
+    original = _frame(100)
+    df = compact_frame(original.copy())
+    pd.testing.assert_frame_equal(df, original)
+
+
+def test_peak_rss_sees_an_allocation():
+    with PeakRSS(interval=0.001) as rss:
+        block = np.ones(64 * 2 ** 20 // 8)
+        block.sum()
+    del block
+    assert rss.peak_mb >= rss.start / 2 ** 20
+    assert rss.growth_mb > 32
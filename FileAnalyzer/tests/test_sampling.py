@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+from utils.ingest import infer_csv_schema
+from utils.sampling import ratio_estimate, median_interval, sample_csv, sample_profile
+
+
+def test_ratio_interval_covers_the_true_ratio_about_95_percent_of_the_time():
+    rng = np.random.default_rng(0)
+    #blocks of unequal size whose rows are alike within a block
+    sizes = rng.integers(50, 150, 2_000)
+    means = rng.normal(10, 3, 2_000)
+    totals = np.array([rng.normal(mean, 1, size).sum() for mean, size in zip(means, sizes)])
+    truth = totals.sum() / sizes.sum()
+    covered = 0
+    for _ in range(400):
+        picked = rng.choice(len(sizes), 30, replace=False)
+        ratio, (lo, hi) = ratio_estimate(totals[picked], sizes[picked])
+        assert lo <= ratio <= hi
+        covered += lo <= truth <= hi
+    assert 0.90 <= covered / 400 <= 0.99
+
+
+def test_ratio_estimate_without_enough_blocks_has_no_interval():
+    ratio, ci = ratio_estimate([3], [4])
+    assert ratio == 0.75 and np.isnan(ci).all()
+    ratio, ci = ratio_estimate([0, 0], [0, 0])
+    assert np.isnan(ratio) and np.isnan(ci).all()
+
+
+def test_median_interval_covers_the_true_median_about_95_percent_of_the_time():
+    rng = np.random.default_rng(1)
+    population = rng.lognormal(0, 1, (1_000, 40))
+    truth = np.median(population)
+    covered = 0
+    for _ in range(400):
+        blocks = population[rng.choice(len(population), 25, replace=False)]
+        block_ids = np.repeat(np.arange(25), blocks.shape[1])
+        median, (lo, hi) = median_interval(blocks.ravel(), block_ids, 25)
+        assert lo <= median <= hi
+        covered += lo <= truth <= hi
+    assert 0.90 <= covered / 400 <= 0.99
+
+
+def test_median_interval_ignores_missing_values():
+    values = np.array([np.nan, 1.0, 2.0, 3.0, np.nan, 4.0, 5.0])
+    median, _ = median_interval(values, np.array([0, 0, 0, 1, 1, 1, 1]), 2)
+    assert median == 3.0
+
+
+@pytest.fixture
+def sorted_csv(tmp_path):
+    rng = np.random.default_rng(2)
+    n = 200_000
+    df = pd.DataFrame({'x': np.sort(rng.normal(100, 20, n)).round(3), 'label': rng.choice(['a', 'b'], n)})
+    df.loc[rng.random(n) < 0.1, 'label'] = None
+    path = tmp_path / 'sorted.csv'
+    df.to_csv(path, index=False)
+    return str(path), df
+
+
+def test_sampled_profile_intervals_contain_the_exact_values(sorted_csv):
+    path, df = sorted_csv
+    sample = sample_csv(path, infer_csv_schema(path), blocks=40, block_bytes=4_096)
+    profile = sample_profile(*sample, filename='sorted.csv')
+
+    assert profile['sample']['rows'] < len(df) / 10
+    lo, hi = profile['sample']['total_rows_ci']
+    assert lo <= len(df) <= hi
+    stats = {stat['column']: stat for stat in profile['basic_stats']}
+    lo, hi = stats['x']['mean_ci']
+    assert lo <= df['x'].mean() <= hi
+    lo, hi = stats['x']['median_ci']
+    assert lo <= df['x'].median() <= hi
+    lo, hi = stats['label']['missing_ci']
+    assert lo <= df['label'].isna().sum() <= hi
+    assert profile['dup_count'] is None
@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+import pytest
+from utils.sketches import KLLSketch, MisraGries, PairwiseMoments
+from utils.stats import StreamingProfiler
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(1)
+    n = 20_000
+    x = rng.normal(1_000, 5, n)
+    df = pd.DataFrame({
+        'x': x,
+        'y': 0.5 * x + rng.normal(0, 5, n),
+        'z': rng.exponential(2, n),
+        'k': rng.integers(0, 10, n),
+        's': rng.choice(['a', 'b'], n),
+    })
+    df.loc[rng.choice(n, 2_000, replace=False), 'y'] = np.nan
+    df.loc[rng.choice(n, 500, replace=False), 'z'] = np.nan
+    return df
+
+
+def test_merged_moments_match_pandas(frame):
+    numeric = frame.select_dtypes(include='number')
+    parts = []
+    #each part gets its own shift from its own first block
+    for part in (numeric.iloc[:7_000], numeric.iloc[7_000:7_001], numeric.iloc[7_001:]):
+        moments = PairwiseMoments(numeric.columns)
+        moments.update(part.to_numpy(dtype=float, na_value=np.nan))
+        parts.append(moments)
+    merged = PairwiseMoments(numeric.columns)
+    for moments in parts:
+        merged.merge(moments)
+
+    np.testing.assert_allclose(merged.mean(), numeric.mean().to_numpy())
+    np.testing.assert_allclose(merged.var(), numeric.var().to_numpy())
+    np.testing.assert_array_equal(merged.count(), numeric.count().to_numpy())
+    np.testing.assert_allclose(merged.corr().to_numpy(), numeric.corr().to_numpy(), atol=1e-10)
+
+
+def test_merging_empty_moments_changes_nothing(frame):
+    numeric = frame.select_dtypes(include='number')
+    moments = PairwiseMoments(numeric.columns)
+    moments.update(numeric.to_numpy(dtype=float, na_value=np.nan))
+    before = moments.corr()
+    moments.merge(PairwiseMoments(numeric.columns))
+    pd.testing.assert_frame_equal(moments.corr(), before)
+
+
+def _rank_errors(sketch, values):
+    qs = np.linspace(0.01, 0.99, 99)
+    ranks = np.searchsorted(np.sort(values), sketch.quantiles(qs), side='right') / len(values)
+    return np.abs(ranks - qs)
+
+
+def test_kll_quantiles_stay_within_the_rank_error():
+    values = np.random.default_rng(2).lognormal(0, 2, 200_000)
+    sketch = KLLSketch(k=200, seed=0)
+    for chunk in np.array_split(values, 37):
+        sketch.update(chunk)
+    assert sketch.n == len(values)
+    assert _rank_errors(sketch, values).max() <= sketch.normalized_rank_error()
+
+
+def test_merged_kll_sketches_stay_within_the_rank_error():
+    values = np.random.default_rng(3).normal(0, 1, 150_000)
+    merged = KLLSketch(k=200, seed=0)
+    for i, part in enumerate(np.array_split(values, 5)):
+        sketch = KLLSketch(k=200, seed=i + 1)
+        sketch.update(part)
+        merged.merge(sketch)
+    assert merged.n == len(values)
+    assert _rank_errors(merged, values).max() <= merged.normalized_rank_error()
+    assert sum(len(level) << h for h, level in enumerate(merged.levels)) == len(values)
+
+
+def _skewed(seed, n=50_000):
+    #a few heavy values over a long tail of rare ones
+    rng = np.random.default_rng(seed)
+    return pd.Series(np.where(rng.random(n) < 0.3, rng.integers(0, 5, n), rng.integers(5, 20_000, n)))
+
+
+def _check_undercount(summary, values):
+    counts = values.value_counts()
+    top = summary.top()
+    assert len(top) <= summary.k
+    assert (top <= counts[top.index]).all()
+    assert (counts[top.index] - top <= summary.max_error).all()
+    #anything more frequent than the bound must have been kept
+    assert set(counts[counts > summary.max_error].index) <= set(top.index)
+    assert summary.max_error <= summary.n / (summary.k + 1)
+
+
+def test_misra_gries_undercounts_by_at_most_max_error():
+    values = _skewed(4)
+    summary = MisraGries(k=64)
+    for start in range(0, len(values), 2_500):
+        summary.update(values.iloc[start:start + 2_500])
+    _check_undercount(summary, values)
+    assert list(summary.top(5).index) == list(values.value_counts().index[:5])
+
+
+def test_merged_misra_gries_undercounts_by_at_most_max_error():
+    parts = [_skewed(seed) for seed in (5, 6, 7)]
+    merged = MisraGries(k=64)
+    for part in parts:
+        summary = MisraGries(k=64)
+        summary.update(part)
+        merged.merge(summary)
+    _check_undercount(merged, pd.concat(parts, ignore_index=True))
+
+
+def test_streamed_mode_of_values_that_never_repeat_comes_from_the_densest_range():
+    values = np.random.default_rng(8).normal(50, 1, 20_000)
+    profiler = StreamingProfiler(top_k=16)
+    for chunk in np.array_split(values, 4):
+        profiler.update(pd.DataFrame({'x': chunk}))
+    profile = profiler.result()
+    mode = profile['basic_stats'][0]['mode']
+    assert isinstance(mode, float) and abs(mode - 50) < 0.5
+    assert profile['accuracy']['density_modes'] == ['x']
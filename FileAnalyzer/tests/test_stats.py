@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+from utils.stats import compute_basic_stats
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(0)
+    n = 5_000
+    df = pd.DataFrame({
+        'x': rng.normal(10, 3, n),
+        'k': rng.integers(0, 50, n),
+        'f': rng.choice([0.5, 1.5, 2.5, np.nan], n),
+        'empty': np.full(n, np.nan),
+        's': rng.choice(['a', 'b', 'c', None], n, p=[0.5, 0.2, 0.2, 0.1]),
+    })
+    df.loc[rng.choice(n, 300, replace=False), 'x'] = np.nan
+    return df
+
+
+def test_basic_stats_match_pandas(frame):
+    stats = {stat['column']: stat for stat in compute_basic_stats(frame)}
+    assert list(stats) == list(frame.columns)
+    for col in ('x', 'k', 'f'):
+        series = frame[col]
+        stat = stats[col]
+        assert stat['mean'] == pytest.approx(series.mean())
+        assert stat['median'] == pytest.approx(series.median())
+        assert stat['std'] == pytest.approx(series.std())
+        assert stat['min'] == series.min()
+        assert stat['max'] == series.max()
+        assert stat['mode'] == series.mode().iloc[0]
+        assert stat['missing'] == series.isna().sum()
+
+
+def test_basic_stats_of_an_all_missing_column(frame):
+    stat = {stat['column']: stat for stat in compute_basic_stats(frame)}['empty']
+    assert np.isnan(stat['mean']) and np.isnan(stat['median']) and np.isnan(stat['std'])
+    assert stat['mode'] == 'N/A'
+    assert stat['missing'] == len(frame)
+
+
+def test_basic_stats_of_a_text_column(frame):
+    stat = {stat['column']: stat for stat in compute_basic_stats(frame)}['s']
+    assert stat['mean'] == 'N/A' and stat['median'] == 'N/A'
+    assert stat['mode'] == frame['s'].mode().iloc[0]
+    assert stat['missing'] == frame['s'].isna().sum()
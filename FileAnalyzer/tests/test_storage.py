@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+import utils.ingest
+from utils.ingest import infer_csv_schema
+from utils.storage import read_frame, read_csv_block, iter_frames
+
+
+@pytest.fixture
+def late_text(tmp_path, monkeypatch):
+    """
+    A CSV whose numeric columns first hold text after the rows sniffed for its schema.
+    """
+    monkeypatch.setattr(utils.ingest, 'INFER_ROWS', 5)
+    path = tmp_path / 'late.csv'
+    path.write_text('price,qty,name\n' + ''.join(f'{i}.5,{i},n{i}\n' for i in range(8))
+                    + 'n/a,lots,n8\n9.5,9,n9\n')
+    schema = infer_csv_schema(str(path))
+    assert [col['type'] for col in schema['columns'][:2]] == ['float64', 'int64']
+    return str(path), schema
+
+
+def test_read_frame_reads_late_text_in_numbers_as_missing(late_text):
+    path, schema = late_text
+    with pytest.warns(UserWarning, match='not numbers'):
+        df = read_frame(path, schema=schema)
+    assert len(df) == 10
+    assert df['price'].dtype == np.float64 and df['qty'].dtype == np.float64
+    assert df['price'].isna().sum() == df['qty'].isna().sum() == 1
+    assert df['price'].iloc[9] == 9.5
+
+
+def test_iter_frames_keeps_float_dtypes_across_chunks(late_text):
+    path, schema = late_text
+    with pytest.warns(UserWarning, match='not numbers'):
+        chunks = list(iter_frames(path, 4, schema))
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    assert all(chunk['price'].dtype == np.float64 for chunk in chunks)
+    assert chunks[2]['price'].isna().tolist() == [True, False]
+
+
+def test_read_csv_block_reads_late_text_as_missing(late_text):
+    path, schema = late_text
+    with pytest.warns(UserWarning, match='not numbers'):
+        df = read_csv_block(b'n/a,lots,n8\n9.5,9,n9\n', schema)
+    pd.testing.assert_series_equal(df['price'], pd.Series([np.nan, 9.5], name='price'))
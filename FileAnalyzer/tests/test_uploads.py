@@ -0,0 +1,102 @@
+import hashlib
+import pytest
+import utils.ingest
+from models import db, CSVFile, Job, Upload, User
+from utils.ingest import infer_csv_schema
+from utils.jobs import JobError
+from utils.profile import profile_upload
+
+
+def _received(tmp_path, content):
+    path = tmp_path / 'received.csv'
+    path.write_bytes(content)
+    schema = infer_csv_schema(str(path))
+    record = CSVFile(user_sub='u1', filename='received.csv', filepath=str(path), csv_schema=schema)
+    db.session.add(record)
+    db.session.flush()
+    upload = Upload(id='u' * 32, user_sub='u1', filename='received.csv', size=len(content), received=len(content),
+                    path=str(path), csv_schema=schema, status='complete', csv_id=record.id)
+    db.session.add(upload)
+    db.session.commit()
+    return upload
+
+
+def test_profile_upload_fails_the_job_on_a_badly_encoded_row(db_app, tmp_path, monkeypatch):
+    monkeypatch.setattr(utils.ingest, 'SNIFF_BYTES', 64)
+    monkeypatch.setattr(utils.ingest, 'INFER_ROWS', 5)
+    upload = _received(tmp_path, b'name,qty\n' + b'plain,1\n' * 20 + b'caf\xe9,2\n')
+    assert upload.csv_schema['encoding'].startswith('utf-8')
+    with pytest.raises(JobError, match='Could not parse'):
+        profile_upload(upload.id, lambda percent, message: None)
+
+
+def test_same_named_uploads_download_their_own_rows(client, tmp_path):
+    records = []
+    for i, content in enumerate((b'x\n1\n', b'x\n2\n')):
+        path = tmp_path / f'{i}.csv'
+        path.write_bytes(content)
+        records.append(CSVFile(user_sub='u1', filename='data.csv', filepath=str(path)))
+    db.session.add(User(sub='u2', name='V', email='v@example.com'))
+    records.append(CSVFile(user_sub='u2', filename='data.csv', filepath=str(path)))
+    db.session.add_all(records)
+    db.session.commit()
+
+    assert [client.get(f'/download/csv/{record.id}').data for record in records[:2]] == [b'x\n1\n', b'x\n2\n']
+    assert 'data.csv' in client.get(f'/download/csv/{records[0].id}').headers['Content-Disposition']
+    assert client.get(f'/download/csv/{records[2].id}').status_code == 404
+
+
+def _put(client, upload_id, offset, chunk, checksum=None):
+    return client.put(f'/api/uploads/{upload_id}?offset={offset}', data=chunk,
+                      headers={'X-Chunk-SHA256': checksum or hashlib.sha256(chunk).hexdigest()})
+
+
+@pytest.fixture
+def payload(client):
+    client.application.config.update(UPLOAD_CHUNK_BYTES=1024, UPLOAD_SNIFF_BYTES=2048)
+    return b'x,label\n' + b''.join(b'%d,"row\n%d"\n' % (i, i) for i in range(500))
+
+
+def test_chunked_upload_resumes_at_the_stored_offset(client, payload):
+    response = client.post('/api/uploads', json={'filename': 'chunked.csv', 'size': len(payload)})
+    assert response.status_code == 201
+    upload = response.get_json()
+    assert (upload['offset'], upload['chunk_size'], upload['status']) == (0, 1024, 'receiving')
+
+    assert _put(client, upload['id'], 0, payload[:1024], checksum='0' * 64).status_code == 400
+    assert _put(client, upload['id'], 0, payload[:1024]).get_json()['offset'] == 1024
+    #a chunk whose response was lost is refused with the offset to resume from
+    replay = _put(client, upload['id'], 0, payload[:1024])
+    assert replay.status_code == 409 and replay.get_json()['offset'] == 1024
+    assert _put(client, upload['id'], 4096, payload[4096:5120]).status_code == 409
+    assert _put(client, upload['id'], 1024, payload[1024:3072]).status_code == 413
+    assert client.get(f"/api/uploads/{upload['id']}").get_json()['offset'] == 1024
+
+    offset = 1024
+    while offset < len(payload):
+        upload = _put(client, upload['id'], offset, payload[offset:offset + 1024]).get_json()
+        offset = upload['offset']
+    assert upload['status'] == 'complete' and upload['next_url']
+    record = db.session.get(CSVFile, upload['csv_id'])
+    assert record.content_hash == hashlib.sha256(payload).hexdigest()
+    with open(record.filepath, 'rb') as f:
+        assert f.read() == payload
+    assert record.csv_schema['columns'][1] == {'name': 'label', 'type': 'string', 'format': None}
+    assert db.session.get(Job, upload['job_id']).kind == 'analysis'
+    assert _put(client, upload['id'], offset, b'1,x\n').status_code == 409
+
+
+def test_uploads_are_checked_before_chunks_are_stored(client, payload):
+    assert client.post('/api/uploads', json={'filename': 'notes.txt', 'size': 10}).status_code == 400
+    assert client.post('/api/uploads', json={'filename': 'a.csv', 'size': 0}).status_code == 400
+    upload = client.post('/api/uploads', json={'filename': 'a.csv', 'size': 10}).get_json()
+    response = client.put(f"/api/uploads/{upload['id']}?offset=0", data=b'x\n1\n')
+    assert response.status_code == 400 and 'X-Chunk-SHA256' in response.get_json()['error']
+    assert _put(client, upload['id'], 0, b'x\n1\n2\n3\n4\n5\n').status_code == 413
+
+    db.session.add(User(sub='u2', name='V', email='v@example.com'))
+    db.session.commit()
+    with client.session_transaction() as session:
+        session['user'] = {'sub': 'u2', 'name': 'V', 'email': 'v@example.com', 'picture': None}
+    assert client.get(f"/api/uploads/{upload['id']}").status_code == 404
+    assert _put(client, upload['id'], 0, b'x\n').status_code == 404
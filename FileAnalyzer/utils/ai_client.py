@@ -0,0 +1,192 @@
+import os
+import time
+import fcntl
+import random
+import asyncio
+import warnings
+import functools
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from flask import current_app
+
+MAX_COMPLETION_TOKENS = 1500
+MAX_ATTEMPTS = 4
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+
+
+@functools.cache
+def retryable_errors():
+    """
+    Failures worth another attempt; TimeoutError covers our own per-attempt timeout.
+    The openai SDK is imported here rather than at module load, it is slow to import.
+    """
+    import openai
+    return openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError, TimeoutError
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE_SECONDS, cap=BACKOFF_MAX_SECONDS):
+    """
+    Full-jitter exponential backoff: a random delay up to base * 2**attempt, capped,
+    so clients that failed together do not retry together.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _retry_after(error):
+    # rate limit responses may say how long to wait
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers.get('retry-after', 0)) if response is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class ConcurrencyLimiter:
+    """
+    Semaphore shared by every worker process and thread on the host, made of
+    `slots` lock files: holding an flock on one of them is a permit. The OS drops
+    the lock when a process dies, so permits cannot leak.
+    """
+
+    def __init__(self, directory, slots, poll_seconds=0.05):
+        self.directory = directory
+        self.slots = slots
+        self.poll_seconds = poll_seconds
+
+    def _try_acquire(self):
+        for slot in range(self.slots):
+            lock_file = open(os.path.join(self.directory, f"slot-{slot}.lock"), 'w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_file
+            except BlockingIOError:
+                lock_file.close()
+        return None
+
+    @asynccontextmanager
+    async def permit(self, deadline):
+        """
+        Wait for a free slot until the monotonic deadline, then hold it.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        delay = self.poll_seconds
+        lock_file = self._try_acquire()
+        while lock_file is None:
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError("No AI request slot became free before the deadline")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+            lock_file = self._try_acquire()
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+
+class InsightClient(ABC):
+    """
+    Base of the async completion clients. Subclasses implement _stream(prompt,
+    max_tokens) as an async generator of text pieces; stream() adds the shared
+    concurrency limit, a timeout per attempt, an overall deadline, and retries with
+    backoff for attempts that fail before producing any text.
+    """
+
+    def __init__(self, model, limiter, request_timeout=120, deadline=300, max_attempts=MAX_ATTEMPTS):
+        self.model = model
+        self.limiter = limiter
+        self.request_timeout = request_timeout
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+
+    @abstractmethod
+    def _stream(self, prompt, max_tokens):
+        """
+        Async generator of the completion's text pieces, from one attempt.
+        """
+
+    async def stream(self, prompt, max_tokens=MAX_COMPLETION_TOKENS):
+        """
+        Yield the completion of a prompt piece by piece as the model produces it.
+        """
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(self.max_attempts):
+            started = False
+            try:
+                async with self.limiter.permit(deadline):
+                    async with asyncio.timeout(min(self.request_timeout, deadline - time.monotonic())):
+                        async for piece in self._stream(prompt, max_tokens):
+                            started = True
+                            yield piece
+                return
+            except retryable_errors() as e:
+                #text already handed out cannot be taken back, so only clean failures are retried
+                if started or attempt == self.max_attempts - 1:
+                    raise
+                delay = max(backoff_delay(attempt), _retry_after(e))
+                if time.monotonic() + delay >= deadline:
+                    raise
+                warnings.warn(f"AI request attempt {attempt + 1} failed, retrying in {delay:.1f}s: {e!r}")
+                await asyncio.sleep(delay)
+
+    async def complete(self, prompt, max_tokens=MAX_COMPLETION_TOKENS):
+        return ''.join([piece async for piece in self.stream(prompt, max_tokens)])
+
+
+class OpenAIInsightClient(InsightClient):
+    """
+    Streaming chat completions from the OpenAI API.
+    """
+
+    async def _stream(self, prompt, max_tokens):
+        import openai
+        #retries are ours, so the SDK's own are switched off
+        async with openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0) as client:
+            response = await client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+                stream=True
+            )
+            async for event in response:
+                if event.choices and event.choices[0].delta.content:
+                    yield event.choices[0].delta.content
+
+
+class StubInsightClient(InsightClient):
+    """
+    Offline stand-in for the OpenAI client (AI_CLIENT=stub). It streams back a
+    deterministic text describing the prompt it received, word by word, waiting
+    word_seconds before each word.
+    """
+
+    def __init__(self, *args, word_seconds=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.word_seconds = word_seconds
+        self.prompts = []
+
+    async def _stream(self, prompt, max_tokens):
+        self.prompts.append(prompt)
+        sections = [line[:-1] for line in prompt.splitlines() if line.endswith(':') and not line.startswith(' ')]
+        text = (
+            f"Stub analysis from {self.model}.\n"
+            f"The prompt had about {len(prompt) // 4 + 1} tokens and covered: {', '.join(sections) or 'no sections'}."
+        )
+        for word in text.split(' '):
+            await asyncio.sleep(self.word_seconds)
+            yield word + ' '
+
+
+INSIGHT_CLIENTS = {'openai': OpenAIInsightClient, 'stub': StubInsightClient}
+
+
+def get_insight_client():
+    """
+    Return the insight client selected by the AI_CLIENT setting.
+    """
+    config = current_app.config
+    limiter = ConcurrencyLimiter(config['AI_LIMITER_DIR'], config['AI_MAX_CONCURRENCY'])
+    options = {'word_seconds': config['AI_STUB_WORD_SECONDS']} if config['AI_CLIENT'] == 'stub' else {}
+    return INSIGHT_CLIENTS[config['AI_CLIENT']](
+        config['AI_MODEL'], limiter, config['AI_REQUEST_TIMEOUT'], config['AI_DEADLINE'], **options)
@@ -1,70 +1,301 @@
+import queue
+import asyncio
 import warnings
-import os
-import openai
+import itertools
+import threading
+import numpy as np
+from flask import current_app
+from utils.cache import get_insight_cache
+from utils.correlation import correlation_matrix, top_pairs, pair_count
+from utils.ai_client import get_insight_client
+from utils.metrics import metrics
 
-# Configure OpenAI once for all insight calls
-openai.api_key = os.getenv("OPENAI_API_KEY")
-MODEL = "gpt-4o"
-MAX_RETRIES = 3
+# Bump whenever the prompt layout changes so cached insights are not reused
+PROMPT_VERSION = 4
+UNAVAILABLE_MESSAGE = "AI insights currently unavailable due to an error."
+# rough size of a token for English text and numbers, used to budget the prompt
+CHARS_PER_TOKEN = 4
+SAMPLE_ROWS = 5
+SAMPLE_COLUMNS = 12
+TOP_VALUES_PER_COLUMN = 3
+MAX_CORRELATION_LINES = 2000
+# share of the token budget each section gets; what a section leaves unused rolls over
+SECTION_SHARES = {
+    'Summary statistics': 0.4,
+    'Strongest correlations between numeric columns': 0.2,
+    'Top values of text columns': 0.25,
+    'The first rows of the data': 0.15,
+}
 
+MERGE_INSTRUCTIONS = (
+    "The analyses above each cover one group of columns of the same dataset. "
+    "Combine them into a single detailed analysis for a professional report, keeping the concrete figures, "
+    "relating findings across the groups where possible and ending with recommendations. "
+    "Use only standard ASCII characters, without bullet points, emojis, or special punctuation."
+)
 
-def build_insight_prompt(df):
+INSTRUCTIONS = (
+    "Provide a detailed analysis of this dataset for a professional report. "
+    "Discuss notable figures, trends, correlations, outliers, and potential relationships. "
+    "Offer hypotheses for why these patterns exist, give concrete examples, and draw multiple conclusions. "
+    "Conclude with recommendations or suggestions for further investigation. "
+    "Use only standard ASCII characters, without bullet points, emojis, or special punctuation."
+)
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _fmt(value):
+    return f"{value:.4g}" if isinstance(value, (float, np.floating)) else str(value)
+
+
+def _stats_lines(df):
+    # numeric columns first, they carry most of the figures the analysis discusses
+    numeric_cols = df.select_dtypes(include='number').columns
+    if len(numeric_cols):
+        block = df[numeric_cols].to_numpy(dtype=float, na_value=np.nan)
+        with warnings.catch_warnings(), np.errstate(all='ignore'):
+            warnings.simplefilter('ignore', RuntimeWarning)
+            stats = {
+                'count': (~np.isnan(block)).sum(axis=0), 'mean': np.nanmean(block, axis=0),
+                'std': np.nanstd(block, axis=0, ddof=1), 'min': np.nanmin(block, axis=0),
+                'median': np.nanmedian(block, axis=0), 'max': np.nanmax(block, axis=0),
+            }
+        for i, col in enumerate(numeric_cols):
+            yield f"{col} (numeric): " + ", ".join(f"{name}={_fmt(values[i])}" for name, values in stats.items())
+    for col in df.columns.difference(numeric_cols, sort=False):
+        values = df[col]
+        yield (f"{col} ({values.dtype}): count={values.count()}, unique={values.nunique()}, "
+               f"missing={int(values.isna().sum())}")
+
+
+def _profile_stats_lines(profile, columns):
+    # the stored profile covers every row, where the frame may only hold the first ones
+    stats = {stat['column']: stat for stat in profile['basic_stats']}
+    numeric_cols = [col for col in columns if col in profile['numeric_cols']]
+    for col in [*numeric_cols, *(col for col in columns if col not in numeric_cols)]:
+        stat = stats[col]
+        kind = 'numeric' if col in numeric_cols else profile['dtypes'][col]
+        figures = [f"count={profile['total_rows'] - stat['missing']}"]
+        figures += [f"{name}={_fmt(stat[name])}" for name in ('mean', 'std', 'min', 'median', 'max', 'mode')
+                    if name in stat and stat[name] != 'N/A']
+        yield f"{col} ({kind}): " + ", ".join(figures) + f", missing={stat['missing']}"
+
+
+def _correlation_lines(df, corr=None):
+    numeric_cols = df.select_dtypes(include='number').columns
+    if len(numeric_cols) < 2:
+        return 0, iter(())
+    if corr is None:
+        corr = correlation_matrix(df)
+    else:
+        #a matrix the analysis already computed, limited to the columns in view
+        cols = [col for col in numeric_cols if col in corr.columns]
+        corr = corr.loc[cols, cols]
+    #strongest relationships first; no prompt budget fits more than MAX_CORRELATION_LINES
+    lines = (f"{a} ~ {b}: {r:.3f}" for a, b, r in top_pairs(corr, MAX_CORRELATION_LINES))
+    return pair_count(corr), lines
+
+
+def _top_value_lines(df, top=None):
+    text_cols = df.select_dtypes(exclude='number').columns
+    if top is not None:
+        #counted over the whole file by the analysis
+        counts = {col: top.get(col, [])[:TOP_VALUES_PER_COLUMN] for col in text_cols}
+    else:
+        counts = {col: df[col].value_counts().head(TOP_VALUES_PER_COLUMN).items() for col in text_cols}
+    lines = (f"{col}: " + ", ".join(f"{value} ({count})" for value, count in counts[col]) for col in text_cols)
+    return len(text_cols), lines
+
+
+def _sample_lines(df):
+    sample = df.iloc[:SAMPLE_ROWS, :SAMPLE_COLUMNS].to_string(index=False).splitlines()
+    if df.shape[1] > SAMPLE_COLUMNS:
+        sample.append(f"(first {SAMPLE_COLUMNS} of {df.shape[1]} columns shown)")
+    return len(sample), iter(sample)
+
+
+def _take(section, allowance):
     """
-    Construct the prompt for AI-based dataset analysis.
+    Move lines from a section's iterator into the prompt while they fit the
+    allowance, the section title counting with its first line. Returns tokens spent.
     """
-    stats = df.describe(include='all').to_string()
-    columns = ', '.join(df.columns)
-    sample_rows = df.head(5).to_string(index=False)
-
-    corr_section = ''
-    if df.select_dtypes(include='number').shape[1] >= 2:
-        corr_section = df.corr(numeric_only=True).to_string()
-
-    top_cats = ''
-    for col in df.select_dtypes(include='object').columns:
-        top = df[col].value_counts().head(3)
-        top_cats += (
-            f"\nTop values in '{col}':\n"
-            f"{top.to_string()}\n"
-        )
+    spent = 0
+    header_cost = 0 if section['taken'] else estimate_tokens(section['title']) + 1
+    for line in section['lines']:
+        cost = estimate_tokens(line) + header_cost
+        if spent + cost > allowance:
+            section['lines'] = itertools.chain([line], section['lines'])
+            break
+        section['taken'].append(line)
+        spent += cost
+        header_cost = 0
+    return spent
+
+
+def _user_focus(user_prompt):
+    if not user_prompt.strip():
+        return ""
+    return f"\n\nPlease focus especially on the following aspect as requested by the user:\n{user_prompt.strip()}"
+
+
+def build_insight_prompt(df, user_prompt="", token_budget=6000, scope=None, profile=None):
+    """
+    Construct the prompt for AI-based dataset analysis, bounded by token_budget.
+    Sections are ranked and each gets a share of the budget, its lines ordered so
+    the most informative come first; lines that do not fit are dropped and the
+    prompt says how many were left out. scope describes a column group of a
+    larger dataset. With the dataset's analysis profile, the row count, statistics,
+    correlations and top values come from it and df only supplies the first rows,
+    so a frame holding only the start of a large file describes all of it.
+    """
+    rows = profile['total_rows'] if profile else len(df)
     #we need to use a very general question becauese of the veriaty of the files that can be uploaded
-    return (
-        f"Here is a dataset with columns: {columns}\n\n"
-        f"Summary statistics:\n{stats}\n\n"
-        f"The first 5 rows of the data:\n{sample_rows}\n{top_cats}"
-        f"Correlation between numeric columns:\n{corr_section}\n\n"
-        "Provide a detailed analysis of this dataset for a professional report. "
-        "Discuss notable figures, trends, correlations, outliers, and potential relationships. "
-        "Offer hypotheses for why these patterns exist, give concrete examples, and draw multiple conclusions. "
-        "Conclude with recommendations or suggestions for further investigation. "
-        "Use only standard ASCII characters, without bullet points, emojis, or special punctuation."
+    if scope:
+        head = f"Here is one group of columns ({scope}) of a dataset with {rows} rows.\n\n"
+    else:
+        head = f"Here is a dataset with {rows} rows and {df.shape[1]} columns.\n\n"
+    tail = INSTRUCTIONS + _user_focus(user_prompt)
+    available = token_budget - estimate_tokens(head) - estimate_tokens(tail)
+
+    builders = {
+        'Summary statistics': lambda: (
+            df.shape[1], _profile_stats_lines(profile, df.columns) if profile else _stats_lines(df)),
+        'Strongest correlations between numeric columns': lambda: _correlation_lines(
+            df, profile['corr'] if profile else None),
+        'Top values of text columns': lambda: _top_value_lines(df, profile['top_values'] if profile else None),
+        'The first rows of the data': lambda: _sample_lines(df),
+    }
+    sections = []
+    carry = 0
+    for title, share in SECTION_SHARES.items():
+        total, lines = builders[title]()
+        section = {'title': title, 'total': total, 'lines': lines, 'taken': []}
+        allowance = max(int(available * share), 0) + carry
+        carry = allowance - _take(section, allowance)
+        sections.append(section)
+    #a second pass lets truncated sections use what the others left over
+    for section in sections:
+        if carry <= 0:
+            break
+        carry -= _take(section, carry)
+
+    body = ""
+    for section in sections:
+        if not section['taken']:
+            continue
+        omitted = section['total'] - len(section['taken'])
+        body += f"{section['title']}:\n" + "\n".join(section['taken'])
+        body += f"\n... {omitted} more left out for length\n\n" if omitted else "\n\n"
+    return head + body + tail
+
+
+def column_groups(columns, group_size):
+    """
+    Split a column list into consecutive groups of at most group_size columns.
+    """
+    columns = list(columns)
+    return [columns[i:i + group_size] for i in range(0, len(columns), group_size)] or [columns]
+
+
+def build_merge_prompt(df, partials, user_prompt="", token_budget=6000, profile=None):
+    """
+    Construct the prompt that merges per-column-group analyses, giving each the
+    same share of the token budget.
+    """
+    rows = profile['total_rows'] if profile else len(df)
+    head = f"A dataset with {rows} rows and {df.shape[1]} columns was analysed in {len(partials)} column groups.\n\n"
+    tail = MERGE_INSTRUCTIONS + _user_focus(user_prompt)
+    share = max(token_budget - estimate_tokens(head) - estimate_tokens(tail), 0) // max(len(partials), 1)
+    body = "".join(
+        f"Analysis of {scope}:\n{text[:share * CHARS_PER_TOKEN]}\n\n" for scope, text in partials
     )
+    return head + body + tail
 
 
-def generate_ai_insight(df, user_prompt=""):
+async def stream_insight(df, user_prompt, client, token_budget, group_size, profile=None):
     """
-    Generate a detailed AI-powered data analysis report with optional user focus.
+    Stream the insight for a dataset. Datasets wider than group_size are analysed
+    per column group in concurrent requests, whose answers are then merged by a
+    final streamed request; groups that fail are left out of the merge.
     """
-    base_prompt = build_insight_prompt(df)
+    groups = column_groups(df.columns, group_size)
+    if len(groups) == 1:
+        async for piece in client.stream(build_insight_prompt(df, user_prompt, token_budget, profile=profile)):
+            yield piece
+        return
+
+    scopes = [f"columns {group[0]} to {group[-1]}, group {i + 1} of {len(groups)}" for i, group in enumerate(groups)]
+    prompts = [build_insight_prompt(df[group], user_prompt, token_budget, scope, profile)
+               for group, scope in zip(groups, scopes)]
+    answers = await asyncio.gather(*(client.complete(prompt) for prompt in prompts), return_exceptions=True)
+    partials = [(scope, answer) for scope, answer in zip(scopes, answers) if isinstance(answer, str)]
+    if not partials:
+        raise answers[0]
+    for scope, answer in zip(scopes, answers):
+        if not isinstance(answer, str):
+            warnings.warn(f"AI analysis of {scope} failed: {answer!r}")
+    async for piece in client.stream(build_merge_prompt(df, partials, user_prompt, token_budget, profile)):
+        yield piece
 
-    if user_prompt.strip():
-        full_prompt = (
-            f"{base_prompt}\n\n"
-            f"Please focus especially on the following aspect as requested by the user:\n{user_prompt.strip()}"
-        )
-    else:
-        full_prompt = base_prompt
 
-    for attempt in range(1, MAX_RETRIES + 1):
+def iter_ai_insight(df, user_prompt="", content_hash=None, client=None, profile=None):
+    """
+    Yield the AI-powered analysis text piece by piece while the model writes it, so
+    callers can lay out text before the completion ends. The request runs on its
+    own event loop in a helper thread. With a content hash, complete answers are
+    cached per dataset, user prompt and model and served in one piece. profile is
+    the dataset's analysis profile, see build_insight_prompt.
+    """
+    config = current_app.config
+    client = client or get_insight_client()
+    cache = get_insight_cache()
+    key = (content_hash, user_prompt.strip(), client.model, PROMPT_VERSION)
+    if content_hash:
+        cached = cache.get(key)
+        metrics.cache_lookup('insight', cached is not None)
+        if cached is not None:
+            yield cached
+            return
+
+    pieces = queue.Queue()
+    done = object()
+
+    async def produce():
+        async for piece in stream_insight(df, user_prompt, client, config['AI_PROMPT_TOKEN_BUDGET'],
+                                          config['AI_COLUMN_GROUP_SIZE'], profile):
+            pieces.put(piece)
+
+    def run():
         try:
-            resp = openai.chat.completions.create(
-                model=MODEL,
-                messages=[{"role": "user", "content": full_prompt}],
-                max_tokens=1500
-            )
-            return resp.choices[0].message.content
-        except openai.error.OpenAIError as e:
-            warnings.warn(f"OpenAI API error on attempt {attempt}: {e}")
-            if attempt == MAX_RETRIES:
-                return "AI insights currently unavailable due to an error."
-            continue
+            asyncio.run(produce())
+            pieces.put(done)
+        except Exception as e:
+            pieces.put(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    received = []
+    while True:
+        item = pieces.get()
+        if item is done:
+            break
+        if isinstance(item, Exception):
+            warnings.warn(f"AI insight request failed: {item!r}")
+            #a partial answer is kept as is but never cached
+            if not received:
+                yield UNAVAILABLE_MESSAGE
+            return
+        received.append(item)
+        yield item
+
+    if content_hash:
+        cache.set(key, ''.join(received))
+
+
+def generate_ai_insight(df, user_prompt="", content_hash=None, client=None, profile=None):
+    """
+    Generate a detailed AI-powered data analysis report with optional user focus.
+    """
+    return ''.join(iter_ai_insight(df, user_prompt, content_hash, client, profile))
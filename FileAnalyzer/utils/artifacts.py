@@ -0,0 +1,188 @@
+import os
+import uuid
+import shutil
+import threading
+from flask import current_app
+from werkzeug.security import safe_join
+
+BLOCK_SIZE = 256 * 1024
+
+# one store per configuration and process; boto3 clients are thread safe and slow to create
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class LocalArtifactStore:
+    """
+    Artifacts as files under a root directory, keyed by their relative path.
+    Writes go to a temporary file renamed into place, so readers and concurrent
+    writers of the same key only ever see a complete file. Put ARTIFACT_DIR on
+    a shared volume to share it between hosts.
+    """
+    shared = False
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        path = safe_join(self.root, key)
+        if path is None:
+            raise ValueError(f"Invalid artifact key: {key}")
+        return path
+
+    def _write(self, key, write):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def put_bytes(self, key, data):
+        self._write(key, lambda f: f.write(data))
+
+    def put_file(self, key, path):
+        def copy(f):
+            with open(path, 'rb') as src:
+                shutil.copyfileobj(src, f, BLOCK_SIZE)
+        self._write(key, copy)
+
+    def get_bytes(self, key):
+        """
+        Return the contents of an artifact, or None when it does not exist.
+        """
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def iter_bytes(self, key):
+        with open(self._path(key), 'rb') as f:
+            for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+                yield block
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def local_path(self, key):
+        """
+        Path of the artifact on this host's disk, for send_file, or None.
+        """
+        path = self._path(key)
+        return path if os.path.exists(path) else None
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete_prefix(self, prefix):
+        """
+        Delete every artifact whose key starts with prefix.
+        """
+        directory, _, start = self._path(prefix).rpartition(os.sep)
+        if not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            if name.startswith(start):
+                path = os.path.join(directory, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    self.delete(os.path.relpath(path, self.root))
+
+
+class S3ArtifactStore:
+    """
+    Artifacts as objects of an S3-compatible bucket, keyed by prefix + key. Every
+    replica configured with the same bucket sees the others' artifacts. A PUT
+    replaces an object whole, so readers never see a partial write.
+    """
+    shared = True
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None):
+        try:
+            import boto3
+            from botocore.config import Config as BotoConfig
+        except ImportError:
+            raise RuntimeError("ARTIFACT_STORE=s3 needs the boto3 package")
+        self.bucket = bucket
+        self.prefix = prefix
+        #checksums only where S3 requires them, which S3-compatible servers also accept
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region, config=BotoConfig(
+            request_checksum_calculation='when_required', response_checksum_validation='when_required'))
+
+    def _missing(self, error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def put_bytes(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+    def put_file(self, key, path):
+        with open(path, 'rb') as f:
+            self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=f)
+
+    def get_bytes(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body'].read()
+        except ClientError as e:
+            if self._missing(e):
+                return None
+            raise
+
+    def iter_bytes(self, key):
+        body = self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body']
+        try:
+            yield from body.iter_chunks(BLOCK_SIZE)
+        finally:
+            body.close()
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+        except ClientError as e:
+            if self._missing(e):
+                return False
+            raise
+        return True
+
+    def local_path(self, key):
+        return None
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def delete_prefix(self, prefix):
+        pages = self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=self.prefix + prefix)
+        for page in pages:
+            keys = [{'Key': item['Key']} for item in page.get('Contents', [])]
+            if keys:
+                self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': keys, 'Quiet': True})
+
+
+def get_artifact_store():
+    """
+    Return the artifact store configured for the current app.
+    """
+    config = current_app.config
+    kind = config['ARTIFACT_STORE']
+    if kind == 'local':
+        key = (kind, config['ARTIFACT_DIR'])
+    elif kind == 's3':
+        key = (kind, config['ARTIFACT_S3_BUCKET'], config['ARTIFACT_S3_PREFIX'], config['ARTIFACT_S3_ENDPOINT_URL'],
+               config['ARTIFACT_S3_REGION'])
+    else:
+        raise ValueError(f"Unknown artifact store: {kind}")
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = LocalArtifactStore(*key[1:]) if kind == 'local' else S3ArtifactStore(*key[1:])
+        return _stores[key]
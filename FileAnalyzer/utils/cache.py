@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import pickle
+from flask import current_app
+from utils.artifacts import get_artifact_store
+
+# Bump whenever the contents of a profile change so stale entries are ignored
+ANALYSIS_VERSION = 11
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(path):
+    """
+    Compute the sha256 hex digest of a file, reading it in fixed-size chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def evict_lru(directory, max_bytes, suffix):
+    """
+    Delete the least recently used files ending in suffix until the ones left in
+    directory take at most max_bytes. File mtimes serve as access times.
+    """
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(suffix):
+            continue
+        try:
+            st = os.stat(os.path.join(directory, name))
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+class ProfileCache:
+    """
+    On-disk cache of analysis profiles keyed on content hash and analysis version.
+    Every entry is one pickle file; once the directory grows beyond max_bytes the
+    least recently used entries are evicted. With a shared artifact store the
+    entries are also kept there, under profiles/, and a local miss is filled from
+    it, so a profile computed by one replica is found by all of them.
+    """
+
+    def __init__(self, directory, max_bytes, store=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.store = store
+        os.makedirs(directory, exist_ok=True)
+
+    def _name(self, content_hash):
+        return f"{content_hash}-v{ANALYSIS_VERSION}.pkl"
+
+    def _path(self, content_hash):
+        return os.path.join(self.directory, self._name(content_hash))
+
+    def _write(self, path, data):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        # atomic rename so concurrent readers never see a half written entry
+        os.replace(tmp_path, path)
+
+    def _get_local(self, path):
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        # mtime doubles as the last access time for LRU eviction
+        os.utime(path)
+        return entry
+
+    def get(self, content_hash):
+        """
+        Return the cached profile for a content hash, or None on a miss.
+        """
+        profile = self._get_local(self._path(content_hash))
+        return profile if profile is not None else self._get_shared(content_hash)
+
+    def _get_shared(self, content_hash):
+        data = self.store.get_bytes(f"profiles/{self._name(content_hash)}") if self.store else None
+        if data is None:
+            return None
+        try:
+            profile = pickle.loads(data)
+        except (pickle.UnpicklingError, EOFError):
+            return None
+        self._write(self._path(content_hash), data)
+        self._evict()
+        return profile
+
+    def set(self, content_hash, profile):
+        """
+        Store a profile, then evict old entries if the cache is over budget.
+        """
+        data = pickle.dumps(profile, protocol=pickle.HIGHEST_PROTOCOL)
+        self._write(self._path(content_hash), data)
+        if self.store:
+            self.store.put_bytes(f"profiles/{self._name(content_hash)}", data)
+        self._evict()
+
+    def get_comparison(self, hash_a, hash_b):
+        """
+        Return the cached comparison of two files, or None on a miss.
+        """
+        return self._get_local(self._path(f"{hash_a}-compare-{hash_b}"))
+
+    def set_comparison(self, hash_a, hash_b, comparison):
+        """
+        Store the comparison of two files. Comparisons are quick to redo from the
+        profiles, so they stay out of the shared store and on this host, where
+        invalidate finds them by either file's hash.
+        """
+        self._write(self._path(f"{hash_a}-compare-{hash_b}"),
+                    pickle.dumps(comparison, protocol=pickle.HIGHEST_PROTOCOL))
+        self._evict()
+
+    def invalidate(self, content_hash):
+        """
+        Drop every cached version of the profile for a content hash, its sample
+        estimate and its comparisons with other files.
+        """
+        for name in os.listdir(self.directory):
+            if name.startswith(f"{content_hash}-") or f"-compare-{content_hash}-" in name:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+        if self.store:
+            self.store.delete_prefix(f"profiles/{content_hash}-")
+
+    def _evict(self):
+        evict_lru(self.directory, self.max_bytes, '.pkl')
+
+
+def get_profile_cache():
+    """
+    Return the profile cache configured for the current app.
+    """
+    store = get_artifact_store()
+    # a local store sits on the same disk as the cache, so it would only hold a second copy
+    return ProfileCache(
+        current_app.config['PROFILE_CACHE_DIR'],
+        current_app.config['PROFILE_CACHE_MAX_BYTES'],
+        store if store.shared else None
+    )
+
+
+class ExportCache:
+    """
+    On-disk cache of derived CSV exports keyed on the source's content hash and the
+    export kind, so a changed file never serves a stale export, and on the analysis
+    version, whose row hashes decide which rows a cleaned export keeps. Entries are written
+    while they are streamed to the first client and evicted LRU past max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, content_hash, kind):
+        return os.path.join(self.directory, f"{content_hash}-{kind}-v{ANALYSIS_VERSION}.csv")
+
+    def get(self, content_hash, kind):
+        """
+        Return the path of a cached export, or None on a miss.
+        """
+        path = self._path(content_hash, kind)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def write_through(self, content_hash, kind, chunks):
+        """
+        Yield the byte chunks of an export while writing them to the cache. The entry
+        only appears once the export is complete; an aborted download leaves nothing.
+        """
+        path = self._path(content_hash, kind)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        evict_lru(self.directory, self.max_bytes, '.csv')
+
+    def write(self, content_hash, kind, write):
+        """
+        Build an export by calling write with an open text file, and return the path
+        of the entry. Like write_through, the entry only appears once write returns.
+        """
+        path = self._path(content_hash, kind)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'w', newline='') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        evict_lru(self.directory, self.max_bytes, '.csv')
+        return path
+
+    def invalidate(self, content_hash):
+        for name in os.listdir(self.directory):
+            if name.startswith(f"{content_hash}-"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+
+def get_export_cache():
+    """
+    Return the export cache configured for the current app.
+    """
+    return ExportCache(
+        current_app.config['EXPORT_CACHE_DIR'],
+        current_app.config['EXPORT_CACHE_MAX_BYTES']
+    )
+
+
+class InsightCache:
+    """
+    On-disk cache of AI insight texts, one JSON file per key. Entries expire after
+    ttl seconds and the least recently used ones are evicted past max_bytes.
+    Keys are tuples of JSON-serialisable values, hashed into file names.
+    """
+
+    def __init__(self, directory, ttl, max_bytes):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha256(json.dumps(list(key)).encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, key):
+        """
+        Return the cached text for a key, or None when missing or expired.
+        """
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry['created'] > self.ttl:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+        os.utime(path)
+        return entry['text']
+
+    def set(self, key, text):
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'created': time.time(), 'text': text}, f)
+        os.replace(tmp_path, path)
+        evict_lru(self.directory, self.max_bytes, '.json')
+
+
+def get_insight_cache():
+    """
+    Return the AI insight cache configured for the current app.
+    """
+    return InsightCache(
+        current_app.config['AI_CACHE_DIR'],
+        current_app.config['AI_CACHE_TTL_SECONDS'],
+        current_app.config['AI_CACHE_MAX_BYTES']
+    )
@@ -0,0 +1,183 @@
+import os
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+from flask import current_app
+from utils.artifacts import get_artifact_store
+from utils.cache import get_profile_cache
+from utils.dedup import diff_row_sets
+from utils.metrics import metrics
+
+# PSI is summed over the deciles of the earlier file's distribution, with empty
+# bins counted as this share so the logarithm stays finite
+PSI_BINS = 10
+PSI_FLOOR = 1e-4
+# the usual rule of thumb: PSI below 0.1 is no real shift, above 0.25 a major one
+PSI_MODERATE = 0.1
+PSI_MAJOR = 0.25
+
+
+def population_stability(expected, actual):
+    """
+    Population stability index between two arrays of bin shares.
+    """
+    expected = np.maximum(np.asarray(expected, dtype=float), PSI_FLOOR)
+    actual = np.maximum(np.asarray(actual, dtype=float), PSI_FLOOR)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def _cdf(edges, counts):
+    cum = np.concatenate([[0.0], np.cumsum(counts, dtype=float)])
+    return np.asarray(edges, dtype=float), cum / cum[-1] if cum[-1] else None
+
+
+def numeric_shift(bins_a, bins_b):
+    """
+    KS statistic and PSI of a numeric column between two profiles, from their fine
+    histograms. Values are taken as spread evenly within each bin, so both CDFs are
+    piecewise linear and KS, their largest gap, lies on a bin edge of either one.
+    Returns (ks, psi), or (None, None) when a histogram is empty.
+    """
+    edges_a, cdf_a = _cdf(*bins_a)
+    edges_b, cdf_b = _cdf(*bins_b)
+    if cdf_a is None or cdf_b is None:
+        return None, None
+    points = np.union1d(edges_a, edges_b)
+    ks = float(np.max(np.abs(np.interp(points, edges_a, cdf_a) - np.interp(points, edges_b, cdf_b))))
+    cuts = np.unique(np.interp(np.linspace(0, 1, PSI_BINS + 1)[1:-1], cdf_a, edges_a))
+    bounds = np.concatenate([[-np.inf], cuts, [np.inf]])
+    psi = population_stability(np.diff(np.interp(bounds, edges_a, cdf_a)),
+                               np.diff(np.interp(bounds, edges_b, cdf_b)))
+    return ks, psi
+
+
+def categorical_shift(top_a, count_a, top_b, count_b):
+    """
+    PSI of a categorical column between two profiles, over the values in both
+    files' top values plus one bucket for the rest of each file's non-missing rows.
+    A value in only one file's top values counts toward that file's rest bucket,
+    since its count in the other file is unknown. Returns None for an empty column.
+    """
+    if count_a <= 0 or count_b <= 0:
+        return None
+    counts_a, counts_b = dict(top_a), dict(top_b)
+    values = [value for value in counts_a if value in counts_b]
+    shares_a = np.array([counts_a[value] for value in values] + [0], dtype=float) / count_a
+    shares_b = np.array([counts_b[value] for value in values] + [0], dtype=float) / count_b
+    shares_a[-1], shares_b[-1] = max(1 - shares_a.sum(), 0), max(1 - shares_b.sum(), 0)
+    return population_stability(shares_a, shares_b)
+
+
+def shift_level(psi):
+    if psi is None:
+        return None
+    if psi >= PSI_MAJOR:
+        return 'major'
+    return 'moderate' if psi >= PSI_MODERATE else 'none'
+
+
+def _rate(count, rows):
+    return count / rows if rows else 0.0
+
+
+def compare_profiles(a, b):
+    """
+    Compare the profile of a file, a, with that of a later version, b: schema drift,
+    per-column shifts and missing rates, and duplicate and missing row rates.
+    """
+    dtypes_a, dtypes_b = a['dtypes'], b['dtypes']
+    rows_a, rows_b = a['total_rows'], b['total_rows']
+    stats_a = {stat['column']: stat for stat in a['basic_stats']}
+    stats_b = {stat['column']: stat for stat in b['basic_stats']}
+
+    columns = []
+    for col in dtypes_a:
+        if col not in dtypes_b:
+            continue
+        ks = psi = None
+        if col in a['fine_bins'] and col in b['fine_bins']:
+            kind = 'numeric'
+            ks, psi = numeric_shift(a['fine_bins'][col], b['fine_bins'][col])
+        elif col in a['top_values'] and col in b['top_values']:
+            kind = 'categorical'
+            psi = categorical_shift(a['top_values'][col], rows_a - a['missing_stats'][col],
+                                    b['top_values'][col], rows_b - b['missing_stats'][col])
+        else:
+            #numeric in one file and text in the other, which the schema drift reports
+            kind = None
+        columns.append({
+            'column': col,
+            'kind': kind,
+            'mean': (stats_a[col]['mean'], stats_b[col]['mean']) if kind == 'numeric' else None,
+            'missing': (_rate(a['missing_stats'][col], rows_a), _rate(b['missing_stats'][col], rows_b)),
+            'ks': ks,
+            'psi': psi,
+            'shift': shift_level(psi),
+        })
+
+    return {
+        'added': [col for col in dtypes_b if col not in dtypes_a],
+        'removed': [col for col in dtypes_a if col not in dtypes_b],
+        'retyped': [(col, dtypes_a[col], dtypes_b[col]) for col in dtypes_a
+                    if col in dtypes_b and dtypes_a[col] != dtypes_b[col]],
+        'rows': (rows_a, rows_b),
+        'dup_rate': (_rate(a['dup_count'], rows_a), _rate(b['dup_count'], rows_b)),
+        'missing_rows_rate': (_rate(a['missing_rows_count'], rows_a), _rate(b['missing_rows_count'], rows_b)),
+        'columns': columns,
+    }
+
+
+@contextmanager
+def open_row_set(key):
+    """
+    Open a stored row set with np.load, fetching it to a scratch file first when
+    the artifact store is not on this host's disk. Yields None when it is missing.
+    """
+    store = get_artifact_store()
+    path = store.local_path(key)
+    if path is not None:
+        with np.load(path) as row_set:
+            yield row_set
+        return
+    if not store.exists(key):
+        yield None
+        return
+    spill_root = current_app.config['DEDUP_SPILL_DIR']
+    os.makedirs(spill_root, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=spill_root) as tmp:
+        path = os.path.join(tmp, 'rows.npz')
+        with open(path, 'wb') as f:
+            for block in store.iter_bytes(key):
+                f.write(block)
+        with np.load(path) as row_set:
+            yield row_set
+
+
+def row_diff(key_a, key_b):
+    """
+    Count the distinct rows removed, added and kept between two files from their
+    stored row sets. Returns None when either file has none.
+    """
+    if key_a is None or key_b is None:
+        return None
+    with open_row_set(key_a) as a, open_row_set(key_b) as b:
+        if a is None or b is None:
+            return None
+        removed, added, kept = diff_row_sets(a, b)
+    return {'removed': removed, 'added': added, 'kept': kept}
+
+
+def compare_files(hash_a, profile_a, hash_b, profile_b):
+    """
+    Return the comparison of two profiled files, cached under both content hashes.
+    """
+    cache = get_profile_cache()
+    comparison = cache.get_comparison(hash_a, hash_b)
+    metrics.cache_lookup('compare', comparison is not None)
+    if comparison is not None:
+        return comparison
+    with metrics.span('compare', profile_a['total_rows'] + profile_b['total_rows']):
+        comparison = compare_profiles(profile_a, profile_b)
+        comparison['row_diff'] = row_diff(profile_a.get('row_set'), profile_b.get('row_set'))
+    cache.set_comparison(hash_a, hash_b, comparison)
+    return comparison
@@ -0,0 +1,114 @@
+import math
+import functools
+import numpy as np
+import pandas as pd
+from utils.sketches import PairwiseMoments
+
+
+CORRELATION_METHODS = ('pearson', 'spearman')
+# rows per block fed through the moment sums, bounds the float32 copy of the data
+BLOCK_ROWS = 65_536
+HEATMAP_MAX_COLUMNS = 30
+HEATMAP_ANNOTATE_MAX_COLUMNS = 12
+PAGE_COLUMNS = 20
+
+
+@functools.cache
+def _clustering():
+    # scipy is optional: without it heatmap columns are ordered by the leading eigenvector.
+    # it is imported on first use, only heatmaps need it
+    try:
+        from scipy.cluster.hierarchy import linkage, leaves_list
+        from scipy.spatial.distance import squareform
+    except ImportError:
+        return None
+    return linkage, leaves_list, squareform
+
+
+def correlation_matrix(df, method='pearson', block_rows=BLOCK_ROWS):
+    """
+    Return the pairwise-complete correlation matrix of the numeric columns of df,
+    like df.corr(). Rows are added in blocks to PairwiseMoments, whose matrix
+    products run in float32 BLAS. Spearman correlates each column's ranks; with
+    missing values the ranks are taken over the whole column, not per pair.
+    """
+    if method not in CORRELATION_METHODS:
+        raise ValueError(f"Unknown correlation method: {method}")
+    numeric = df.select_dtypes(include='number')
+    if numeric.shape[1] == 0:
+        return pd.DataFrame(dtype=float)
+    if method == 'spearman':
+        numeric = numeric.rank()
+    moments = PairwiseMoments(numeric.columns, dtype=np.float32)
+    for start in range(0, len(numeric), block_rows):
+        moments.update(numeric.iloc[start:start + block_rows].to_numpy(dtype=float, na_value=np.nan))
+    return moments.corr()
+
+
+def _upper_pairs(corr):
+    values = corr.to_numpy(dtype=float)
+    rows, cols = np.triu_indices_from(values, k=1)
+    r = values[rows, cols]
+    keep = ~np.isnan(r)
+    return rows[keep], cols[keep], r[keep]
+
+
+def pair_count(corr):
+    """
+    Number of column pairs with a defined correlation.
+    """
+    return len(_upper_pairs(corr)[2])
+
+
+def top_pairs(corr, k=None):
+    """
+    Return the k most strongly correlated column pairs, whatever their sign, as
+    [(column, column, r), ...] by descending |r|; every pair when k is None.
+    """
+    rows, cols, r = _upper_pairs(corr)
+    strength = -np.abs(r)
+    if k is not None and k < len(r):
+        #only the k strongest have to be sorted
+        part = np.argpartition(strength, k)[:k]
+        order = part[np.argsort(strength[part], kind='stable')]
+    else:
+        order = np.argsort(strength, kind='stable')
+    names = corr.columns
+    return [(names[rows[i]], names[cols[i]], float(r[i])) for i in order]
+
+
+def heatmap_columns(corr, max_columns=HEATMAP_MAX_COLUMNS):
+    """
+    Choose and order the columns of a correlation heatmap. Wider tables are cut
+    down to the max_columns columns with the strongest correlations, then columns
+    are ordered so correlated ones sit together: by hierarchical clustering when
+    scipy is installed, otherwise by the leading eigenvector.
+    """
+    strength = np.nan_to_num(np.abs(corr.to_numpy(dtype=float)))
+    np.fill_diagonal(strength, 0.0)
+    keep = np.arange(len(corr))
+    if len(keep) > max_columns:
+        keep = np.sort(np.argsort(-strength.max(axis=0), kind='stable')[:max_columns])
+    strength = strength[np.ix_(keep, keep)]
+    if len(keep) < 3:
+        order = np.arange(len(keep))
+    elif _clustering() is not None:
+        linkage, leaves_list, squareform = _clustering()
+        distance = 1.0 - strength
+        np.fill_diagonal(distance, 0.0)
+        order = leaves_list(linkage(squareform(distance, checks=False), method='average'))
+    else:
+        order = np.argsort(np.linalg.eigh(strength)[1][:, -1], kind='stable')
+    return corr.columns[keep[order]].tolist()
+
+
+def correlation_page(corr, row_page=0, col_page=0, page_size=PAGE_COLUMNS):
+    """
+    Return one page_size x page_size tile of a correlation matrix, with the row
+    and column page numbers clamped to the matrix and the page count per axis.
+    """
+    pages = max(math.ceil(len(corr) / page_size), 1)
+    row_page, col_page = min(max(row_page, 0), pages - 1), min(max(col_page, 0), pages - 1)
+    rows = slice(row_page * page_size, (row_page + 1) * page_size)
+    cols = slice(col_page * page_size, (col_page + 1) * page_size)
+    return corr.iloc[rows, cols], row_page, col_page, pages
@@ -0,0 +1,257 @@
+import os
+import zipfile
+import itertools
+import numpy as np
+import pandas as pd
+
+# buckets the hash set is partitioned into, and the run size above which a run is spilled to disk
+HASH_BUCKETS = 16
+SPILL_RUN_ROWS = 1_000_000
+WRITE_CHUNK_ROWS = 100_000
+# mixed into the hashes of integers too large for a float64, so they cannot meet a float's hash
+INEXACT_INT_SALT = np.uint64(0x9E3779B97F4A7C15)
+
+
+def normalize_text(df):
+    """
+    Return a copy of df with text trimmed, lower-cased and inner whitespace collapsed,
+    so rows that only differ in case or spacing compare equal.
+    """
+    df = df.copy(deep=False)
+    for col in df.columns:
+        if not pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = (df[col].astype('str').str.strip().str.lower()
+                       .str.replace(r'\s+', ' ', regex=True))
+    return df
+
+
+def _number_hashes(values):
+    """
+    Hash the values of a numeric column so that equal numbers match whatever the
+    column's dtype: a column read as int64 in one chunk may be float64 in the next,
+    once a missing value shows up. Every value is hashed as a float64, except
+    integers a float64 cannot hold exactly, which keep their own salted hash.
+    """
+    if values.dtype.kind in 'iu':
+        as_float = values.astype(np.float64)
+        hashes = pd.util.hash_array(as_float)
+        with np.errstate(invalid='ignore'):
+            inexact = as_float.astype(values.dtype) != values
+        if inexact.any():
+            hashes[inexact] = pd.util.hash_array(values[inexact]) ^ INEXACT_INT_SALT
+        return hashes
+    #adding 0.0 turns -0.0 into 0.0, which compare equal
+    return pd.util.hash_array(values.astype(np.float64) + 0.0)
+
+
+def row_hashes(df, subset=None, normalize=False):
+    """
+    Hash every row of a frame to a uint64 in one vectorized pass. subset limits the
+    hash to key columns; normalize matches near-duplicates (see normalize_text).
+    Numbers hash by value, so 1 in an int column matches 1.0 in a float one.
+    """
+    if subset:
+        df = df[list(subset)]
+    if normalize:
+        df = normalize_text(df)
+    numbers = [i for i, dtype in enumerate(df.dtypes)
+               if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)]
+    if numbers:
+        df = df.copy(deep=False)
+        for i in numbers:
+            column = df.iloc[:, i]
+            values = column.to_numpy() if isinstance(column.dtype, np.dtype) else \
+                column.to_numpy(dtype=np.float64, na_value=np.nan)
+            df.isetitem(i, _number_hashes(values))
+    return pd.util.hash_pandas_object(df, index=False).to_numpy(copy=True)
+
+
+def duplicate_mask(hashes):
+    """
+    Flag every row whose hash already occurred earlier in the array.
+    """
+    return np.array(pd.Index(hashes).duplicated(keep='first'))
+
+
+class HashStore:
+    """
+    Set of row hashes that grows chunk by chunk. Hashes are split into buckets and
+    each bucket keeps sorted runs that are merged as they grow, like the levels of an
+    LSM tree, so lookups are binary searches over a few runs. Runs longer than
+    spill_rows are written to directory and memory-mapped, which lets the set
+    outgrow memory. Pickled stores refer to their spilled runs by path.
+    """
+
+    def __init__(self, directory=None, buckets=HASH_BUCKETS, spill_rows=SPILL_RUN_ROWS):
+        self.directory = directory
+        self.buckets = buckets
+        self.spill_rows = spill_rows
+        self.runs = [[] for _ in range(buckets)]
+        self.size = 0
+        self._names = itertools.count()
+        self._mapped = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_names'] = next(self._names)
+        state['_mapped'] = {}
+        return state
+
+    def __setstate__(self, state):
+        state['_names'] = itertools.count(state['_names'])
+        self.__dict__.update(state)
+        missing = [run for bucket in self.runs for run in bucket if isinstance(run, str) and not os.path.exists(run)]
+        if missing:
+            raise ValueError(f"Spilled hash runs are missing: {missing[:3]}")
+
+    def _array(self, run):
+        if not isinstance(run, str):
+            return run
+        if run not in self._mapped:
+            self._mapped[run] = np.load(run, mmap_mode='r')
+        return self._mapped[run]
+
+    def _store(self, run):
+        # keep small runs in memory, write large ones to disk
+        if self.directory is None or len(run) <= self.spill_rows:
+            return run
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"run-{next(self._names):06d}.npy")
+        np.save(path, run)
+        return path
+
+    def _drop(self, run):
+        if isinstance(run, str):
+            self._mapped.pop(run, None)
+            os.remove(run)
+
+    def _push(self, bucket, run):
+        runs = self.runs[bucket]
+        while runs and len(self._array(runs[-1])) <= len(run):
+            last = runs.pop()
+            run = np.sort(np.concatenate([self._array(last), run]), kind='stable')
+            self._drop(last)
+        runs.append(self._store(run))
+
+    def add(self, hashes):
+        """
+        Add a chunk of row hashes and return the mask of those already in the set,
+        from earlier chunks or earlier in this one.
+        """
+        dup = duplicate_mask(hashes)
+        bucket_ids = hashes % np.uint64(self.buckets)
+        for bucket in range(self.buckets):
+            rows = np.flatnonzero((bucket_ids == bucket) & ~dup)
+            if not len(rows):
+                continue
+            #sorted lookups walk each run in order instead of jumping around it
+            order = np.argsort(hashes[rows])
+            rows = rows[order]
+            candidates = hashes[rows]
+            seen = np.zeros(len(candidates), dtype=bool)
+            for run in self.runs[bucket]:
+                run = self._array(run)
+                pos = np.minimum(np.searchsorted(run, candidates), len(run) - 1)
+                seen |= run[pos] == candidates
+            dup[rows[seen]] = True
+            new = candidates[~seen]
+            if len(new):
+                self._push(bucket, new)
+                self.size += len(new)
+        return dup
+
+    def sorted_buckets(self):
+        """
+        Yield the hashes of each bucket as one sorted array, a bucket at a time.
+        """
+        for runs in self.runs:
+            arrays = [self._array(run) for run in runs]
+            yield np.sort(np.concatenate(arrays)) if arrays else np.empty(0, dtype=np.uint64)
+
+    def clear(self):
+        for bucket in self.runs:
+            for run in bucket:
+                self._drop(run)
+        self.runs = [[] for _ in range(self.buckets)]
+        self.size = 0
+
+
+def bucket_hashes(hashes, buckets=HASH_BUCKETS):
+    """
+    Split row hashes into the sorted distinct hashes of each bucket, as a
+    HashStore holding them would yield them from sorted_buckets().
+    """
+    #sorting and dropping repeats is many times faster than np.unique on uint64
+    ordered = np.sort(hashes)
+    distinct = ordered[np.concatenate([[True], ordered[1:] != ordered[:-1]])] if len(ordered) else ordered
+    bucket_ids = distinct % np.uint64(buckets)
+    return [distinct[bucket_ids == bucket] for bucket in range(buckets)]
+
+
+def write_row_set(file, buckets):
+    """
+    Write the sorted hashes of each bucket of a row set to an .npz archive, one
+    member per bucket, so neither writing nor reading needs more than one bucket
+    in memory. file is a path or a binary file.
+    """
+    with zipfile.ZipFile(file, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for i, hashes in enumerate(buckets):
+            with archive.open(f"bucket{i:03d}.npy", 'w', force_zip64=True) as member:
+                np.lib.format.write_array(member, np.asarray(hashes, dtype=np.uint64))
+
+
+def diff_row_sets(a, b):
+    """
+    Count the distinct rows only in a, only in b and in both, from two row sets
+    written by write_row_set and opened with np.load. Returns (only a, only b, both).
+    """
+    if a.files != b.files:
+        raise ValueError("The row sets were written with different bucket counts")
+    only_a = only_b = both = 0
+    for name in a.files:
+        hashes_a, hashes_b = a[name], b[name]
+        shared = 0
+        if len(hashes_a) and len(hashes_b):
+            pos = np.minimum(np.searchsorted(hashes_b, hashes_a), len(hashes_b) - 1)
+            shared = int(np.count_nonzero(hashes_b[pos] == hashes_a))
+        only_a += len(hashes_a) - shared
+        only_b += len(hashes_b) - shared
+        both += shared
+    return only_a, only_b, both
+
+
+def write_rows(df, keep, file, header=True, chunk_rows=WRITE_CHUNK_ROWS):
+    """
+    Write the rows of df where keep is True as CSV, slice by slice, so no filtered
+    copy of the whole frame is made. file is a path or an open text file.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'w', newline='') as f:
+            return write_rows(df, keep, f, header, chunk_rows)
+    if not len(df):
+        df.to_csv(file, index=False, header=header)
+        return 0
+    written = 0
+    for start in range(0, len(df), chunk_rows):
+        part = df.iloc[start:start + chunk_rows][keep[start:start + chunk_rows]]
+        part.to_csv(file, index=False, header=header and start == 0)
+        written += len(part)
+    return written
+
+
+def dedup_frames(frames, file, subset=None, normalize=False, spill_dir=None):
+    """
+    Stream DataFrame chunks into a CSV of their unique rows, by full row or by the
+    key columns in subset. Returns (rows read, duplicates dropped).
+    """
+    store = HashStore(spill_dir)
+    rows = dropped = 0
+    try:
+        for i, chunk in enumerate(frames):
+            dup = store.add(row_hashes(chunk, subset, normalize))
+            write_rows(chunk, ~dup, file, header=i == 0)
+            rows += len(chunk)
+            dropped += int(dup.sum())
+    finally:
+        store.clear()
+    return rows, dropped
@@ -0,0 +1,90 @@
+import os
+from urllib.parse import quote
+from flask import current_app, request, send_file, Response, abort
+from utils.exports import gzip_chunks
+from utils.artifacts import get_artifact_store
+
+FILE_BLOCK_SIZE = 256 * 1024
+# smaller files are not worth compressing on the fly
+GZIP_MIN_BYTES = 64 * 1024
+
+
+def accepts_gzip():
+    return current_app.config['GZIP_DOWNLOADS'] and request.accept_encodings.quality('gzip') > 0
+
+
+def content_disposition(download_name):
+    try:
+        download_name.encode('ascii')
+        return f'attachment; filename="{download_name}"'
+    except UnicodeEncodeError:
+        return f"attachment; filename*=UTF-8''{quote(download_name)}"
+
+
+def iter_file(path, block_size=FILE_BLOCK_SIZE):
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            yield block
+
+
+def _accel_redirect_uri(path):
+    # map a file under X_ACCEL_ROOT to the internal nginx location at X_ACCEL_REDIRECT_PREFIX
+    prefix = current_app.config['X_ACCEL_REDIRECT_PREFIX']
+    if not prefix:
+        return None
+    relative = os.path.relpath(os.path.realpath(path), os.path.realpath(current_app.config['X_ACCEL_ROOT']))
+    if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+        return None
+    return f"{prefix.rstrip('/')}/{quote(relative.replace(os.sep, '/'))}"
+
+
+def _send_gzip(path, download_name, mimetype):
+    st = os.stat(path)
+    response = Response(gzip_chunks(iter_file(path)), mimetype=mimetype, headers={
+        'Content-Disposition': content_disposition(download_name),
+        'Content-Encoding': 'gzip',
+        'Vary': 'Accept-Encoding',
+    })
+    response.set_etag(f"{st.st_mtime_ns:x}-{st.st_size:x}-gzip")
+    response.last_modified = st.st_mtime
+    response.cache_control.no_cache = True
+    #a 304 never starts the generator, so the file is not even opened
+    return response.make_conditional(request)
+
+
+def send_stored_file(path, download_name, mimetype):
+    """
+    Send a file from disk without reading it into memory. nginx (X-Accel-Redirect)
+    or the front server (USE_X_SENDFILE) serve it when configured; otherwise
+    send_file streams it with sendfile where the server supports it, answering
+    Range and conditional requests. CSVs can instead go out gzip-compressed.
+    """
+    accel_uri = _accel_redirect_uri(path)
+    if accel_uri:
+        response = Response(mimetype=mimetype, headers={'Content-Disposition': content_disposition(download_name)})
+        response.headers['X-Accel-Redirect'] = accel_uri
+        return response
+
+    if (mimetype == 'text/csv' and not current_app.config['USE_X_SENDFILE'] and 'Range' not in request.headers
+            and accepts_gzip() and os.path.getsize(path) >= GZIP_MIN_BYTES):
+        return _send_gzip(path, download_name, mimetype)
+
+    return send_file(path, mimetype=mimetype, download_name=download_name, as_attachment=True,
+                     conditional=True, max_age=0)
+
+
+def send_artifact(key, download_name, mimetype, as_attachment=True):
+    """
+    Send an artifact: from disk like send_stored_file when the store is local,
+    streamed through from the store otherwise.
+    """
+    store = get_artifact_store()
+    path = store.local_path(key)
+    if path is not None:
+        if as_attachment:
+            return send_stored_file(path, download_name, mimetype)
+        return send_file(path, mimetype=mimetype, conditional=True, max_age=0)
+    if not store.exists(key):
+        abort(404)
+    headers = {'Content-Disposition': content_disposition(download_name)} if as_attachment else {}
+    return Response(store.iter_bytes(key), mimetype=mimetype, headers=headers)
@@ -0,0 +1,47 @@
+import io
+import os
+import zlib
+import tempfile
+from utils.dedup import HashStore, row_hashes, write_rows
+from utils.storage import iter_frames, read_frame
+
+# derived exports of an upload, served as <kind>_<filename>
+EXPORT_KINDS = ('cleaned', 'missing')
+
+
+def iter_export(path, kind, chunksize, spill_root, schema=None):
+    """
+    Yield a derived export of a stored upload as CSV byte chunks, one per data chunk:
+    'cleaned' keeps the first occurrence of every row, 'missing' the rows with any
+    missing value. Row hashes that outgrow memory spill under spill_root; schema
+    is the CSV's ingestion schema.
+    """
+    os.makedirs(spill_root, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=spill_root) as spill_dir:
+        store = HashStore(spill_dir)
+        header = True
+        for chunk in iter_frames(path, chunksize, schema):
+            if kind == 'cleaned':
+                keep = ~store.add(row_hashes(chunk))
+            else:
+                keep = chunk.isna().any(axis=1).to_numpy()
+            buf = io.StringIO()
+            write_rows(chunk, keep, buf, header=header)
+            header = False
+            yield buf.getvalue().encode()
+        store.clear()
+    if header:
+        #no data rows, the export is just the header line
+        yield read_frame(path, nrows=0, schema=schema).to_csv(index=False).encode()
+
+
+def gzip_chunks(chunks, level=6):
+    """
+    Compress a stream of byte chunks into one gzip stream as it goes.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,159 @@
+import io
+import csv
+import codecs
+import warnings
+import numpy as np
+import pandas as pd
+
+# bytes sniffed for the encoding and dialect, rows sampled to infer column types
+SNIFF_BYTES = 64 * 1024
+INFER_ROWS = 10_000
+DELIMITERS = ',;\t|'
+# text columns with at most this many distinct values, and at most this share of the rows, become categoricals
+CATEGORY_MAX_UNIQUE = 1000
+CATEGORY_MAX_RATIO = 0.5
+DATE_FORMATS = (
+    '%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M',
+    '%d/%m/%Y', '%m/%d/%Y', '%d.%m.%Y', '%d-%m-%Y',
+    '%d/%m/%Y %H:%M', '%m/%d/%Y %H:%M', '%d.%m.%Y %H:%M',
+)
+
+
+def detect_encoding(sample):
+    """
+    Guess the text encoding of the first bytes of a file: UTF-8 (with or without a
+    byte order mark), else Windows-1252 as written by Excel, else Latin-1.
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        sample.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError as e:
+        #the sample may end in the middle of a multi-byte character
+        if e.start >= len(sample) - 3 and e.reason == 'unexpected end of data':
+            return 'utf-8'
+    try:
+        sample.decode('cp1252')
+        return 'cp1252'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+
+def _is_number(field):
+    try:
+        float(field)
+        return True
+    except ValueError:
+        return False
+
+
+def sniff_dialect(text):
+    """
+    Return (delimiter, quotechar, header) for a decoded sample of a CSV file. The
+    first row is a header unless it holds numbers in columns that are numeric
+    further down, header names rarely being numbers.
+    """
+    lines = text.splitlines()
+    #the last line of a sample is usually cut short
+    sample = "\n".join(lines[:-1] if len(lines) > 1 else lines)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=DELIMITERS)
+        delimiter, quotechar = dialect.delimiter, dialect.quotechar or '"'
+    except csv.Error:
+        delimiter, quotechar = ',', '"'
+    rows = list(csv.reader(sample.splitlines(), delimiter=delimiter, quotechar=quotechar))
+    if len(rows) < 2:
+        return delimiter, quotechar, True
+    votes = 0
+    for i, field in enumerate(rows[0]):
+        below = [row[i].strip() for row in rows[1:] if i < len(row) and row[i].strip()]
+        if below and all(_is_number(value) for value in below) and field.strip():
+            votes += -1 if _is_number(field) else 1
+    return delimiter, quotechar, votes >= 0
+
+
+def _column_type(values):
+    """
+    Infer the stored type of one sampled column.
+    """
+    if pd.api.types.is_bool_dtype(values):
+        return 'bool', None
+    if pd.api.types.is_integer_dtype(values):
+        return 'int64', None
+    if pd.api.types.is_numeric_dtype(values):
+        return 'float64', None
+    values = values.dropna().astype(str)
+    if values.empty:
+        return 'string', None
+    first = values.iloc[0]
+    if len(first) <= 32 and any(ch.isdigit() for ch in first):
+        for fmt in DATE_FORMATS:
+            if pd.to_datetime(values, format=fmt, errors='coerce').notna().all():
+                return 'datetime', fmt
+    distinct = values.nunique()
+    if distinct <= CATEGORY_MAX_UNIQUE and distinct <= CATEGORY_MAX_RATIO * len(values):
+        return 'category', None
+    return 'string', None
+
+
+def record_ends(raw, quotechar='"'):
+    """
+    Offsets just past every newline of raw that ends a CSV record, i.e. that is
+    not inside a quoted field. raw has to start at a record boundary.
+    """
+    data = np.frombuffer(raw, dtype=np.uint8)
+    newlines = np.flatnonzero(data == ord('\n'))
+    #a doubled quote inside a field counts twice, so the parity still tells inside from outside
+    quotes_before = np.searchsorted(np.flatnonzero(data == ord(quotechar)), newlines)
+    return newlines[quotes_before % 2 == 0] + 1
+
+
+def infer_csv_schema(path, max_bytes=None):
+    """
+    Sniff a CSV once and describe how to parse it: encoding, delimiter, quote
+    character, whether it has a header, and a type for every column inferred from
+    the first INFER_ROWS rows. The result is JSON-serialisable and stored with the
+    upload, so later parses skip inference. max_bytes limits sniffing to the whole
+    records in a prefix of that size, for files that are still being received.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read(SNIFF_BYTES)
+        prefix = raw + f.read(max(max_bytes - len(raw), 0)) if max_bytes is not None else None
+    encoding = detect_encoding(raw)
+    delimiter, quotechar, header = sniff_dialect(raw.decode(encoding, errors='replace'))
+
+    source = path
+    if prefix is not None:
+        ends = record_ends(prefix, quotechar)
+        source = io.BytesIO(prefix[:ends[-1]] if len(ends) else prefix)
+    sample = pd.read_csv(source, sep=delimiter, quotechar=quotechar, encoding=encoding,
+                         header=0 if header else None, nrows=INFER_ROWS)
+    if not header:
+        sample.columns = [f"column_{i + 1}" for i in range(sample.shape[1])]
+    columns = []
+    for col in sample.columns:
+        col_type, fmt = _column_type(sample[col])
+        columns.append({'name': str(col), 'type': col_type, 'format': fmt})
+    return {'encoding': encoding, 'delimiter': delimiter, 'quotechar': quotechar,
+            'header': header, 'columns': columns}
+
+
+def try_infer_csv_schema(path, max_bytes=None):
+    """
+    infer_csv_schema, or None when the file cannot be sniffed; readers then fall
+    back to inferring types on every parse.
+    """
+    try:
+        return infer_csv_schema(path, max_bytes)
+    except (ValueError, UnicodeDecodeError, csv.Error, pd.errors.ParserError, OSError) as e:
+        warnings.warn(f"Could not infer a schema for {path}: {e}")
+        return None
+
+
+def same_dialect(schema, other):
+    """
+    Whether two schemas describe files that can be concatenated byte for byte.
+    """
+    keys = ('encoding', 'delimiter', 'quotechar', 'header')
+    return all(schema.get(key) == other.get(key) for key in keys)
@@ -0,0 +1,176 @@
+import os
+import time
+import threading
+import warnings
+from datetime import datetime, timedelta
+from models import db, Job
+from utils.memory import PeakRSS
+from utils.metrics import metrics, describe
+
+# Registered task functions by job kind, filled in with the @task decorator
+TASKS = {}
+
+
+class JobError(Exception):
+    """
+    Raised by a task to fail its job with a message meant for the user.
+    """
+
+
+def task(kind, priority=100):
+    """
+    Register a function as the handler for a job kind.
+    The function receives the Job row and a progress(percent, message) callback
+    and returns the value stored in Job.result.
+    """
+    def register(func):
+        TASKS[kind] = (func, priority)
+        return func
+    return register
+
+
+class JobQueue:
+    """
+    Database-backed job queue with a pool of worker threads in every process.
+    Jobs are claimed with a conditional UPDATE, so several gunicorn workers can
+    share the same table without running a job twice. A running job's heartbeat
+    is refreshed from a background thread every JOB_STALE_SECONDS / 3, also through
+    stages that report no progress; a job whose heartbeat is older than
+    JOB_STALE_SECONDS is assumed dead and picked up again.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['job_queue'] = self
+        # threads are started lazily so they are created after gunicorn forks
+        app.before_request(self.ensure_started)
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._wakeup = threading.Event()
+            for i in range(self.app.config['JOB_WORKERS']):
+                threading.Thread(target=self._loop, name=f"job-worker-{i}", daemon=True).start()
+
+    def enqueue(self, kind, user_sub, csv_id=None, params=None, priority=None):
+        """
+        Store a new job and wake a worker. Returns the Job row.
+        """
+        if kind not in TASKS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job = Job(kind=kind, user_sub=user_sub, csv_id=csv_id, params=params or {},
+                  priority=TASKS[kind][1] if priority is None else priority)
+        db.session.add(job)
+        db.session.commit()
+        self.ensure_started()
+        self._wakeup.set()
+        return job
+
+    def _claim(self):
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=self.app.config['JOB_STALE_SECONDS'])
+        claimable = db.or_(Job.status == 'queued', db.and_(Job.status == 'running', Job.heartbeat_at < stale))
+        job_id = db.session.execute(
+            db.select(Job.id).where(claimable).order_by(Job.priority, Job.id).limit(1)
+        ).scalar()
+        if job_id is None:
+            return None
+        claimed = db.session.execute(
+            db.update(Job).where(Job.id == job_id, claimable)
+            .values(status='running', heartbeat_at=now, message='Started')
+        )
+        db.session.commit()
+        # another worker may have claimed it between the select and the update
+        return job_id if claimed.rowcount == 1 else None
+
+    def _heartbeat(self, job_id, engine, stop):
+        # on its own connection, so the task's session and transactions are left alone
+        while not stop.wait(self.app.config['JOB_STALE_SECONDS'] / 3):
+            try:
+                with engine.begin() as conn:
+                    conn.execute(db.update(Job).where(Job.id == job_id, Job.status == 'running')
+                                 .values(heartbeat_at=datetime.utcnow()))
+            except Exception as e:
+                warnings.warn(f"Could not refresh the heartbeat of job {job_id}: {e!r}")
+
+    def _run(self, job_id):
+        job = db.session.get(Job, job_id)
+        func, _ = TASKS[job.kind]
+
+        def progress(percent, message):
+            db.session.execute(
+                db.update(Job).where(Job.id == job_id)
+                .values(progress=percent, message=message[:256], heartbeat_at=datetime.utcnow())
+            )
+            db.session.commit()
+
+        #peak memory per job is what sizing the workers needs
+        target = f"job:{job.kind}"
+        metrics.start_trace()
+        profiler = metrics.start_profile(target, {'sub': job.user_sub})
+        start = time.perf_counter()
+        stop = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job_id, db.engine, stop),
+                         name=f"job-heartbeat-{job_id}", daemon=True).start()
+        with PeakRSS() as rss:
+            try:
+                result = func(job, progress)
+                status, message = 'done', 'Finished'
+            except JobError as e:
+                db.session.rollback()
+                result, status, message = None, 'failed', str(e)
+            except Exception as e:
+                db.session.rollback()
+                warnings.warn(f"Job {job_id} ({job.kind}) failed: {e!r}")
+                result, status, message = None, 'failed', f"Unexpected error: {e}"
+            finally:
+                stop.set()
+        seconds = time.perf_counter() - start
+        stages = metrics.finish_trace()
+        if profiler is not None:
+            path = metrics.stop_profile(profiler, target, {'sub': job.user_sub})
+            self.app.logger.info("Profile of job %s (%s) written to %s", job_id, job.kind, path)
+        metrics.observe('job_seconds', seconds, kind=job.kind, status=status)
+        if rss.peak is not None:
+            metrics.observe('job_peak_rss_bytes', rss.peak, kind=job.kind)
+        if rss.peak_mb is not None:
+            self.app.logger.info("Job %s (%s) peak RSS %.1f MB, %.1f MB above its start",
+                                 job_id, job.kind, rss.peak_mb, rss.growth_mb or 0.0)
+        self.app.logger.info("Job %s (%s) %s in %.3fs: %s", job_id, job.kind, status, seconds, describe(stages))
+
+        db.session.execute(
+            db.update(Job).where(Job.id == job_id)
+            .values(status=status, message=message[:256], result=result, peak_rss_mb=rss.peak_mb,
+                    stages=[item.as_dict() for item in stages],
+                    progress=100 if status == 'done' else Job.progress, finished_at=datetime.utcnow())
+        )
+        db.session.commit()
+
+    def _loop(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    job_id = self._claim()
+                    if job_id is not None:
+                        self._run(job_id)
+                        continue
+                except Exception as e:
+                    db.session.rollback()
+                    warnings.warn(f"Job worker error: {e!r}")
+            self._wakeup.wait(self.app.config['JOB_POLL_SECONDS'])
+            self._wakeup.clear()
+
+
+job_queue = JobQueue()
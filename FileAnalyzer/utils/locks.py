@@ -0,0 +1,129 @@
+import time
+import uuid
+import threading
+import warnings
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from models import db, Lock
+from utils.metrics import metrics
+
+# first pause between attempts to take a busy lock, doubled up to LOCK_POLL_SECONDS
+FIRST_POLL_SECONDS = 0.02
+
+
+class LockTimeout(Exception):
+    """
+    Raised when a lock is still held by someone else once the timeout has passed.
+    """
+
+
+class LeaseLock:
+    """
+    Mutual exclusion across threads, processes and hosts that share the database.
+    A lock is a row of the locks table owned by a random token until expires_at.
+    The holder renews it every ttl / 3 seconds from a background thread, so a lock
+    whose holder died is free again within ttl seconds. Locks are taken and released
+    on their own connection and never commit the caller's session.
+    """
+
+    def __init__(self, name, ttl=None, poll_seconds=None):
+        config = current_app.config
+        self.name = name
+        self.ttl = ttl or config['LOCK_TTL_SECONDS']
+        self.poll_seconds = poll_seconds or config['LOCK_POLL_SECONDS']
+        self.owner = uuid.uuid4().hex
+        self._engine = db.engine
+        self._stop = None
+
+    def _try_acquire(self):
+        now = datetime.utcnow()
+        expires = now + timedelta(seconds=self.ttl)
+        try:
+            with self._engine.begin() as conn:
+                conn.execute(db.insert(Lock).values(name=self.name, owner=self.owner, expires_at=expires))
+            return True
+        except IntegrityError:
+            pass
+        #held, unless its holder died without releasing it
+        with self._engine.begin() as conn:
+            taken = conn.execute(
+                db.update(Lock).where(Lock.name == self.name, Lock.expires_at < now)
+                .values(owner=self.owner, expires_at=expires)
+            )
+        return taken.rowcount == 1
+
+    def acquire(self, timeout=None, on_wait=None):
+        """
+        Take the lock, waiting up to timeout seconds (forever when None) and calling
+        on_wait() between attempts. Returns whether it had to wait.
+        """
+        start = time.monotonic()
+        delay = FIRST_POLL_SECONDS
+        waited = False
+        while not self._try_acquire():
+            if timeout is not None and time.monotonic() - start >= timeout:
+                raise LockTimeout(f"Lock {self.name} is still held after {timeout}s")
+            waited = True
+            if on_wait is not None:
+                on_wait()
+            time.sleep(delay)
+            delay = min(delay * 2, self.poll_seconds)
+        if waited:
+            metrics.observe('lock_wait_seconds', time.monotonic() - start, lock=self.name.split(':')[0])
+        self._stop = threading.Event()
+        threading.Thread(target=self._renew_loop, args=(self._stop,), name=f"lock-{self.name}", daemon=True).start()
+        return waited
+
+    def _renew_loop(self, stop):
+        while not stop.wait(self.ttl / 3):
+            try:
+                with self._engine.begin() as conn:
+                    renewed = conn.execute(
+                        db.update(Lock).where(Lock.name == self.name, Lock.owner == self.owner)
+                        .values(expires_at=datetime.utcnow() + timedelta(seconds=self.ttl))
+                    )
+            except Exception as e:
+                warnings.warn(f"Could not renew lock {self.name}: {e!r}")
+                continue
+            if renewed.rowcount != 1:
+                warnings.warn(f"Lock {self.name} expired while held")
+                return
+
+    def release(self):
+        if self._stop is not None:
+            self._stop.set()
+        with self._engine.begin() as conn:
+            conn.execute(db.delete(Lock).where(Lock.name == self.name, Lock.owner == self.owner))
+
+
+@contextmanager
+def lease_lock(name, timeout=None, on_wait=None, ttl=None):
+    """
+    Hold the lock called name for the duration of the block (see LeaseLock).
+    """
+    lock = LeaseLock(name, ttl)
+    lock.acquire(timeout, on_wait)
+    try:
+        yield lock
+    finally:
+        lock.release()
+
+
+def single_flight(name, lookup, compute, timeout=None, on_wait=None):
+    """
+    Return lookup() when it finds a result, otherwise run compute(), which must
+    store its result where lookup() finds it. Only one caller computes at a time,
+    wherever it runs: the others wait for its lock and then look the result up.
+    """
+    result = lookup()
+    if result is not None:
+        return result
+    with lease_lock(name, timeout, on_wait):
+        result = lookup()
+        if result is not None:
+            metrics.inc('single_flight_total', lock=name.split(':')[0], role='waited')
+            return result
+        metrics.inc('single_flight_total', lock=name.split(':')[0], role='computed')
+        return compute()
@@ -0,0 +1,122 @@
+import os
+import resource
+import threading
+import numpy as np
+import pandas as pd
+from utils.storage import read_frame, data_path
+
+# text columns with at most this share of distinct values are stored as categoricals
+CATEGORY_MAX_RATIO = 0.5
+# frames smaller than this are left as they are, compacting them saves nothing
+COMPACT_MIN_ROWS = 1000
+CARDINALITY_SAMPLE_ROWS = 10_000
+RSS_SAMPLE_SECONDS = 0.05
+
+
+def _compact_column(col):
+    """
+    Return the compact form of a column, or None when it has none.
+    """
+    if pd.api.types.is_bool_dtype(col) or isinstance(col.dtype, pd.CategoricalDtype):
+        return None
+    #nullable extension integers keep their type, row hashes depend on it
+    if pd.api.types.is_integer_dtype(col) and isinstance(col.dtype, np.dtype):
+        narrow = pd.to_numeric(col, downcast='integer')
+        return narrow if narrow.dtype != col.dtype else None
+    if pd.api.types.is_float_dtype(col) and col.dtype.itemsize > 4:
+        #only when every value survives the round trip, so no statistic changes
+        narrow = col.to_numpy().astype(np.float32)
+        if np.array_equal(narrow.astype(col.dtype), col.to_numpy(), equal_nan=True):
+            return pd.Series(narrow, index=col.index, name=col.name)
+        return None
+    if pd.api.types.is_object_dtype(col) or pd.api.types.is_string_dtype(col):
+        #mostly unique text shows in a sample already, without hashing the whole column
+        if len(col) > CARDINALITY_SAMPLE_ROWS:
+            sample = col.sample(CARDINALITY_SAMPLE_ROWS, random_state=0)
+            if sample.nunique() > CATEGORY_MAX_RATIO * len(sample):
+                return None
+        if col.nunique() <= CATEGORY_MAX_RATIO * len(col):
+            return col.astype('category')
+    return None
+
+
+def compact_frame(df):
+    """
+    Shrink a frame column by column without changing any value: integers are
+    downcast to the smallest type that holds them, floats to float32 when that
+    is exact, and repetitive text becomes categorical. The dtypes it was loaded
+    with are kept in df.attrs['source_dtypes'] for display. Returns df.
+    """
+    source_dtypes = df.dtypes.astype(str).to_dict()
+    if len(df) >= COMPACT_MIN_ROWS:
+        for col in df.columns:
+            compact = _compact_column(df[col])
+            if compact is not None:
+                df[col] = compact
+    df.attrs['source_dtypes'] = source_dtypes
+    return df
+
+
+def load_analysis_frame(record, nrows=None):
+    """
+    Read a CSV record's data for analysis in its compact form. Every in-memory
+    analysis path loads through here.
+    """
+    return compact_frame(read_frame(data_path(record), nrows=nrows, schema=record.csv_schema))
+
+
+def current_rss():
+    """
+    Resident set size of this process in bytes, or None where /proc is missing.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class PeakRSS:
+    """
+    Context manager that samples the process RSS in a background thread and
+    records the start and peak. Worker threads share the process, so the peak
+    includes whatever runs alongside. Without /proc it falls back to the
+    process-lifetime maximum from getrusage.
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.start = self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            rss = current_rss()
+            if rss is not None:
+                self.peak = max(self.peak, rss)
+
+    def __enter__(self):
+        self.start = self.peak = current_rss()
+        if self.start is not None:
+            self._thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self.peak = max(self.peak, current_rss() or 0)
+        else:
+            #ru_maxrss is in kilobytes on Linux
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return False
+
+    @property
+    def peak_mb(self):
+        return self.peak / 2 ** 20 if self.peak else None
+
+    @property
+    def growth_mb(self):
+        return (self.peak - self.start) / 2 ** 20 if self.peak and self.start else None
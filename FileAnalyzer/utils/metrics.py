@@ -0,0 +1,350 @@
+import os
+import json
+import time
+import uuid
+import cProfile
+import threading
+import warnings
+from contextlib import contextmanager
+from datetime import datetime
+from flask import g, request, session
+from utils.memory import current_rss, RSS_SAMPLE_SECONDS
+
+# upper bounds of the histogram buckets, in seconds and in bytes
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+BYTES_BUCKETS = tuple(2 ** n * 1024 * 1024 for n in range(5, 15))
+
+# name: (type, help, buckets); every name is exported with the fileanalyzer_ prefix
+METRICS = {
+    'http_request_seconds': ('histogram', "Time spent answering a request.", SECONDS_BUCKETS),
+    'stage_seconds': ('histogram', "Time spent in a pipeline stage.", SECONDS_BUCKETS),
+    'stage_peak_rss_bytes': ('histogram', "Process RSS high-water mark during a pipeline stage.", BYTES_BUCKETS),
+    'stage_rows_total': ('counter', "Rows processed by a pipeline stage.", None),
+    'stage_bytes_total': ('counter', "Bytes processed by a pipeline stage.", None),
+    'job_seconds': ('histogram', "Time spent running a background job.", SECONDS_BUCKETS),
+    'job_peak_rss_bytes': ('histogram', "Process RSS high-water mark while a job ran.", BYTES_BUCKETS),
+    'cache_requests_total': ('counter', "Cache lookups by result, hit or miss.", None),
+    'lock_wait_seconds': ('histogram', "Time spent waiting for a lock held elsewhere.", SECONDS_BUCKETS),
+    'single_flight_total': ('counter', "Coalesced computations by role: run by the caller or waited for.", None),
+}
+
+# the stages of the request or job running on this thread
+_local = threading.local()
+
+
+class Span:
+    """
+    One timed pipeline stage. rows and nbytes may be filled in while it runs, when
+    they are only known once the data is read.
+    """
+
+    def __init__(self, stage, rows=None, nbytes=None):
+        self.stage = stage
+        self.rows = rows
+        self.nbytes = nbytes
+        self.seconds = None
+        self.peak = None
+
+    def as_dict(self):
+        return {'stage': self.stage, 'seconds': round(self.seconds, 4), 'rows': self.rows, 'bytes': self.nbytes,
+                'peak_rss_mb': round(self.peak / 2 ** 20, 1) if self.peak else None}
+
+
+def _labels_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metrics:
+    """
+    Counters and histograms of the request and job pipelines, exposed in the
+    Prometheus text format. Every process keeps its own values and writes them to
+    METRICS_DIR every METRICS_FLUSH_SECONDS, so a scrape of any gunicorn worker
+    sums all of them. Files of exited processes keep counting, like their values
+    did. Open spans share one thread sampling the RSS for their peaks.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._values = {}
+        self._dirty = False
+        self._spans = set()
+        self._spans_open = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['metrics'] = self
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            #a forked process starts from its own values, not a copy of the parent's
+            self._pid = os.getpid()
+            self._values, self._spans = {}, set()
+            self._spans_open = threading.Event()
+            threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+            threading.Thread(target=self._sample_loop, name="metrics-rss", daemon=True).start()
+
+    # ----------------------
+    # Recording
+    # ----------------------
+    def inc(self, name, value=1, **labels):
+        self._ensure_started()
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+            self._dirty = True
+
+    def observe(self, name, value, **labels):
+        self._ensure_started()
+        buckets = METRICS[name][2]
+        key = (name, _labels_key(labels))
+        with self._lock:
+            counts = self._values.setdefault(key, [0] * (len(buckets) + 2))
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+            #the last two slots hold the sum and the count
+            counts[-2] += value
+            counts[-1] += 1
+            self._dirty = True
+
+    def cache_lookup(self, cache, hit):
+        self.inc('cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+    @contextmanager
+    def span(self, stage, rows=None, nbytes=None):
+        """
+        Time a pipeline stage and track the peak RSS while it runs. Yields the
+        Span; the stage is recorded in the metrics and in the trace of the request
+        or job running on this thread, also when it raises.
+        """
+        self._ensure_started()
+        item = Span(stage, rows, nbytes)
+        item.peak = current_rss()
+        with self._lock:
+            self._spans.add(item)
+            self._spans_open.set()
+        start = time.perf_counter()
+        try:
+            yield item
+        finally:
+            item.seconds = time.perf_counter() - start
+            #counts often come from numpy, the trace is stored as JSON
+            item.rows = int(item.rows) if item.rows is not None else None
+            item.nbytes = int(item.nbytes) if item.nbytes is not None else None
+            with self._lock:
+                self._spans.discard(item)
+            if item.peak is not None:
+                item.peak = max(item.peak, current_rss() or 0)
+                self.observe('stage_peak_rss_bytes', item.peak, stage=stage)
+            self.observe('stage_seconds', item.seconds, stage=stage)
+            if item.rows is not None:
+                self.inc('stage_rows_total', item.rows, stage=stage)
+            if item.nbytes is not None:
+                self.inc('stage_bytes_total', item.nbytes, stage=stage)
+            trace = getattr(_local, 'trace', None)
+            if trace is not None:
+                trace.append(item)
+
+    def _sample_loop(self):
+        while True:
+            self._spans_open.wait()
+            time.sleep(RSS_SAMPLE_SECONDS)
+            rss = current_rss()
+            with self._lock:
+                if not self._spans:
+                    self._spans_open.clear()
+                    continue
+                if rss is not None:
+                    for item in self._spans:
+                        item.peak = max(item.peak or 0, rss)
+
+    # ----------------------
+    # Traces and profiling
+    # ----------------------
+    def start_trace(self):
+        _local.trace = []
+
+    def finish_trace(self):
+        """
+        Return the spans recorded on this thread since start_trace and stop recording.
+        """
+        trace, _local.trace = getattr(_local, 'trace', None) or [], None
+        return trace
+
+    def start_profile(self, target, user=None):
+        """
+        Start cProfile on this thread when PROFILE_TARGETS lists the endpoint or
+        job:<kind> target, or PROFILE_USERS lists the user's sub or email; when
+        both are set both have to match. Returns the profiler or None.
+        """
+        config = self.app.config
+        targets, users = config['PROFILE_TARGETS'], config['PROFILE_USERS']
+        if not targets and not users:
+            return None
+        if targets and target not in targets and '*' not in targets:
+            return None
+        if users and not (user and (user.get('sub') in users or user.get('email') in users)):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            #another profiler is already running on this thread
+            return None
+        return profiler
+
+    def stop_profile(self, profiler, target, user=None):
+        """
+        Stop a profiler and dump its stats to PROFILE_DIR, for snakeviz, flameprof
+        or pstats. Returns the dump path.
+        """
+        profiler.disable()
+        directory = self.app.config['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        who = (user or {}).get('sub', 'anonymous').replace('|', '_')
+        name = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{target.replace(':', '_')}-{who}-{uuid.uuid4().hex[:6]}.prof"
+        path = os.path.join(directory, name)
+        profiler.dump_stats(path)
+        return path
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+        self.start_trace()
+        #the session is only read when profiling is on, so static files stay cacheable
+        if self.app.config['PROFILE_TARGETS'] or self.app.config['PROFILE_USERS']:
+            g.profiler = self.start_profile(request.endpoint, session.get('user'))
+
+    def _after_request(self, response):
+        seconds = time.perf_counter() - g.get('metrics_start', time.perf_counter())
+        stages = self.finish_trace()
+        self.observe('http_request_seconds', seconds, endpoint=request.endpoint or 'unmatched',
+                     method=request.method, status=response.status_code)
+        if stages:
+            response.headers['Server-Timing'] = ', '.join(
+                f"{item.stage};dur={item.seconds * 1000:.1f}" for item in stages)
+            self.app.logger.info("%s %s %s in %.3fs: %s", request.method, request.path, response.status_code,
+                                 seconds, describe(stages))
+        return response
+
+    def _teardown_request(self, exc):
+        #runs after the response is built, also when the view raised
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            path = self.stop_profile(profiler, request.endpoint or 'unmatched', session.get('user'))
+            self.app.logger.info("Profile of %s %s written to %s", request.method, request.path, path)
+
+    # ----------------------
+    # Export
+    # ----------------------
+    def _snapshot(self):
+        with self._lock:
+            self._dirty = False
+            return [[name, labels, value] for (name, labels), value in self._values.items()]
+
+    def flush(self):
+        """
+        Write this process's values to METRICS_DIR for the other processes to read.
+        """
+        directory = self.app.config['METRICS_DIR']
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.app.config['METRICS_FLUSH_SECONDS'])
+            if self._dirty:
+                try:
+                    self.flush()
+                except Exception as e:
+                    warnings.warn(f"Could not write metrics: {e!r}")
+
+    def render(self, gauges=()):
+        """
+        Return the metrics of every process in the Prometheus text format, with
+        gauges, a list of (name, help, {labels tuple: value}), appended.
+        """
+        self._ensure_started()
+        self.flush()
+        totals = {}
+        directory = self.app.config['METRICS_DIR']
+        for name in os.listdir(directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    entries = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric, labels, value in entries:
+                if metric not in METRICS:
+                    continue
+                key = (metric, tuple(map(tuple, labels)))
+                if isinstance(value, list):
+                    current = totals.setdefault(key, [0] * len(value))
+                    if len(current) == len(value):
+                        totals[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    totals[key] = totals.get(key, 0) + value
+
+        lines = []
+        for metric, (kind, help_text, buckets) in METRICS.items():
+            series = sorted((labels, value) for (name, labels), value in totals.items() if name == metric)
+            if not series:
+                continue
+            full = f"fileanalyzer_{metric}"
+            lines += [f"# HELP {full} {help_text}", f"# TYPE {full} {kind}"]
+            for labels, value in series:
+                if kind == 'counter':
+                    lines.append(f"{full}{_format_labels(labels)} {value}")
+                    continue
+                for bound, count in zip(buckets, value):
+                    lines.append(f"{full}_bucket{_format_labels(labels, [('le', str(bound))])} {count}")
+                lines.append(f"{full}_bucket{_format_labels(labels, [('le', '+Inf')])} {value[-1]}")
+                lines.append(f"{full}_sum{_format_labels(labels)} {value[-2]}")
+                lines.append(f"{full}_count{_format_labels(labels)} {value[-1]}")
+        for name, help_text, values in gauges:
+            full = f"fileanalyzer_{name}"
+            lines += [f"# HELP {full} {help_text}", f"# TYPE {full} gauge"]
+            lines += [f"{full}{_format_labels(labels)} {value}" for labels, value in sorted(values.items())]
+        return '\n'.join(lines) + '\n'
+
+
+def describe(stages):
+    """
+    One-line summary of recorded spans for the logs.
+    """
+    parts = []
+    for item in stages:
+        part = f"{item.stage} {item.seconds:.3f}s"
+        if item.rows is not None:
+            part += f" {item.rows} rows"
+        if item.nbytes is not None:
+            part += f" {item.nbytes / 2 ** 20:.1f} MB"
+        parts.append(part)
+    return ', '.join(parts)
+
+
+metrics = Metrics()
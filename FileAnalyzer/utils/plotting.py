@@ -1,91 +1,232 @@
 import os
 import io
-import matplotlib.pyplot as plt
-import seaborn as sns
-from flask import url_for, current_app
+import hashlib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from flask import current_app
+from utils.artifacts import get_artifact_store
+from utils.correlation import correlation_matrix, heatmap_columns, HEATMAP_ANNOTATE_MAX_COLUMNS
 
 
-def save_histograms(df, record_id, numeric_cols):
+# matches the default bin count of DataFrame.hist
+HIST_BINS = 10
+# resolution of the stored histograms that charts are re-binned from
+FINE_BINS = 256
+# below this many histograms a process pool costs more than it saves
+PARALLEL_MIN_COLUMNS = 16
+COLUMNS_PER_TASK = 8
+
+_render_pool = None
+
+
+def compute_bins(df, numeric_cols, bins=HIST_BINS):
+    """
+    Compute equal-width histogram bins for all numeric columns in one vectorized
+    pass. Returns {column: (edges, counts)} with the same edges np.histogram uses.
+    """
+    if not numeric_cols:
+        return {}
+    block = df[numeric_cols].to_numpy(dtype=float, na_value=np.nan, copy=True)
+    block[~np.isfinite(block)] = np.nan
+    with np.errstate(all='ignore'):
+        lo, hi = np.nanmin(block, axis=0), np.nanmax(block, axis=0)
+    # constant columns get a unit wide range around the value, like np.histogram
+    flat = hi <= lo
+    lo, hi = np.where(flat, lo - 0.5, lo), np.where(flat, hi + 0.5, hi)
+    width = (hi - lo) / bins
+
+    with np.errstate(all='ignore'):
+        idx = np.clip(np.floor((block - lo) / width), 0, bins - 1)
+    valid = ~np.isnan(block)
+    # offset every column into its own range of bins so one bincount covers all
+    offsets = (idx + np.arange(len(numeric_cols)) * bins)[valid].astype(np.int64)
+    counts = np.bincount(offsets, minlength=len(numeric_cols) * bins).reshape(len(numeric_cols), bins)
+    edges = lo[:, None] + width[:, None] * np.arange(bins + 1)
+
+    return {
+        col: (edges[i], counts[i])
+        for i, col in enumerate(numeric_cols) if np.isfinite(lo[i])
+    }
+
+
+def rebin(edges, counts, bins, lo=None, hi=None):
+    """
+    Re-bin a fine histogram onto equal-width bins over [lo, hi] (clamped to the
+    histogram's own range) by interpolating its cumulative counts.
+    """
+    edges = np.asarray(edges, dtype=float)
+    cum = np.concatenate([[0], np.cumsum(counts)])
+    lo = edges[0] if lo is None else min(max(lo, edges[0]), edges[-1])
+    hi = edges[-1] if hi is None else max(min(hi, edges[-1]), lo)
+    new_edges = np.linspace(lo, hi, bins + 1)
+    return new_edges, np.diff(np.interp(new_edges, edges, cum)).round().astype(int)
+
+
+def histogram_key(col, edges):
+    """
+    Cache key of a rendered histogram: the column and its bin spec.
+    """
+    spec = f"{col}|{len(edges) - 1}|{edges[0]!r}|{edges[-1]!r}"
+    return hashlib.sha1(spec.encode()).hexdigest()[:16]
+
+
+def _render_batch(jobs):
+    # runs in a pool process, so only the object oriented Agg API is used
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    for col, edges, counts, img_path in jobs:
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        ax.stairs(counts, edges, fill=True)
+        ax.grid(True)
+        ax.set_title(f'Distribution of {col}')
+        fig.savefig(img_path, bbox_inches='tight')
+
+
+def _get_render_pool(workers):
+    global _render_pool
+    if _render_pool is None:
+        # spawn avoids forking a process that is running job threads
+        _render_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return _render_pool
+
+
+def render_histograms(binned, out_dir, workers=None):
     """
-    Save histograms for each numeric column to static/analysis and return their URLs.
+    Render {column: (edges, counts)} histograms as PNG files in out_dir.
+    A PNG whose (column, bin spec) key already exists is reused instead of redrawn;
+    wide tables are rendered in a process pool. Returns {column: file name}.
     """
-    analysis_dir = os.path.join(current_app.static_folder, 'analysis', str(record_id))
-    os.makedirs(analysis_dir, exist_ok=True)
-    paths = []
-    for col in numeric_cols:
-        plt.figure()
-        df[col].dropna().hist()
-        plt.title(f'Distribution of {col}')
-        img_name = f"{col}.png"
-        plt.savefig(os.path.join(analysis_dir, img_name), bbox_inches='tight')
-        plt.close()
-        paths.append(url_for('static', filename=f'analysis/{record_id}/{img_name}'))
-    return paths
+    os.makedirs(out_dir, exist_ok=True)
+    names, jobs = {}, []
+    for col, (edges, counts) in binned.items():
+        names[col] = f"{histogram_key(col, edges)}.png"
+        img_path = os.path.join(out_dir, names[col])
+        if not os.path.exists(img_path):
+            jobs.append((col, edges, counts, img_path))
+
+    workers = workers or os.cpu_count() or 1
+    if len(jobs) < PARALLEL_MIN_COLUMNS or workers == 1:
+        _render_batch(jobs)
+    else:
+        pool = _get_render_pool(workers)
+        batches = [jobs[i:i + COLUMNS_PER_TASK] for i in range(0, len(jobs), COLUMNS_PER_TASK)]
+        for future in [pool.submit(_render_batch, batch) for batch in batches]:
+            future.result()
+    return names
 
 
-def create_numeric_plot(df):
+def save_histograms(binned, content_hash):
     """
-    Generate a histogram for the first numeric column.
+    Save histograms for precomputed {column: (edges, counts)} bins to the artifact
+    store under analysis/<content_hash>/ and return their keys, twice: as the
+    paths the page links to and as the artifacts a cached profile depends on.
+    Images already in the store are not drawn again.
+    """
+    store = get_artifact_store()
+    keys = {col: f"analysis/{content_hash}/{histogram_key(col, edges)}.png" for col, (edges, _) in binned.items()}
+    missing = {col: binned[col] for col, key in keys.items() if not store.exists(key)}
+    if missing:
+        #drawn locally, then stored whole, so no reader sees a half written image
+        with tempfile.TemporaryDirectory() as tmp:
+            for col, name in render_histograms(missing, tmp, current_app.config.get('HIST_RENDER_WORKERS')).items():
+                store.put_file(keys[col], os.path.join(tmp, name))
+    paths = list(keys.values())
+    return paths, paths
+
+
+def _figure(figsize):
+    # the object oriented API keeps no global state, so figures can be drawn in threads;
+    # matplotlib is imported on first use so workers that never draw do not pay for it
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig, fig.add_subplot()
+
+
+def _png(fig):
+    buf = io.BytesIO()
+    fig.tight_layout()
+    fig.savefig(buf, format='png')
+    buf.seek(0)
+    return buf
+
+
+def create_numeric_plot(df, fine_bins=None):
+    """
+    Generate a histogram for the first numeric column, re-binned from the
+    profile's fine histogram when one is given.
     Returns buffer, filename, and explanation.
     """
     num_cols = df.select_dtypes(include='number').columns.tolist()
     if not num_cols:
         return None, None, None
     col = num_cols[0]
-    buf = io.BytesIO()
-    plt.figure(figsize=(6, 4))
-    df[col].dropna().hist(bins=20)
-    plt.title(f"Distribution of {col}")
-    plt.xlabel(col)
-    plt.ylabel("Frequency")
-    plt.tight_layout()
-    plt.savefig(buf, format='png')
-    plt.close()
-    buf.seek(0)
+    fig, ax = _figure((6, 4))
+    if fine_bins and col in fine_bins:
+        edges, counts = rebin(*fine_bins[col], 20)
+        ax.stairs(counts, edges, fill=True)
+    else:
+        ax.hist(df[col].dropna(), bins=20)
+    ax.grid(True)
+    ax.set_title(f"Distribution of {col}")
+    ax.set_xlabel(col)
+    ax.set_ylabel("Frequency")
     explanation = f"This histogram shows the distribution of the numeric column '{col}'."
     filename = f"plot_numeric_{col}.png"
-    return buf, filename, explanation
+    return _png(fig), filename, explanation
 
 
-def create_category_plot(df):
+def create_category_plot(df, top_values=None):
     """
-    Generate a bar chart for top 10 values of the first categorical column.
+    Generate a bar chart for top 10 values of the first categorical column,
+    taken from the profile's top values when given.
     Returns buffer, filename, and explanation.
     """
-    cat_cols = df.select_dtypes(include='object').columns.tolist()
+    cat_cols = df.select_dtypes(include=['object', 'string', 'category']).columns.tolist()
     if not cat_cols:
         return None, None, None
     col = cat_cols[0]
-    buf = io.BytesIO()
-    plt.figure(figsize=(6, 4))
-    df[col].value_counts().head(10).plot(kind='bar')
-    plt.title(f"Top 10 values in {col}")
-    plt.xlabel(col)
-    plt.ylabel("Count")
-    plt.tight_layout()
-    plt.savefig(buf, format='png')
-    plt.close()
-    buf.seek(0)
+    if top_values and col in top_values:
+        labels, counts = zip(*top_values[col][:10]) if top_values[col] else ((), ())
+    else:
+        top = df[col].value_counts().head(10)
+        labels, counts = top.index.astype(str).tolist(), top.tolist()
+    fig, ax = _figure((6, 4))
+    ax.bar(range(len(labels)), counts)
+    ax.set_xticks(range(len(labels)), labels, rotation=90)
+    ax.set_title(f"Top 10 values in {col}")
+    ax.set_xlabel(col)
+    ax.set_ylabel("Count")
     explanation = f"This bar chart shows the top 10 values in the categorical column '{col}'."
     filename = f"plot_categorical_{col}.png"
-    return buf, filename, explanation
+    return _png(fig), filename, explanation
 
 
-def create_correlation_heatmap(df):
+def create_correlation_heatmap(df, corr=None):
     """
-    Generate a heatmap of correlations for numeric columns.
+    Generate a heatmap of correlations for numeric columns, drawing a
+    precomputed correlation matrix when given. Wide tables are reduced to their
+    most correlated columns and columns are clustered (see heatmap_columns).
     Returns buffer, filename, and explanation.
     """
-    num_df = df.select_dtypes(include='number')
-    if num_df.shape[1] < 2:
+    if corr is None:
+        corr = correlation_matrix(df)
+    if corr.shape[1] < 2:
         return None, None, None
-    buf = io.BytesIO()
-    plt.figure(figsize=(6, 5))
-    sns.heatmap(num_df.corr(), annot=True, fmt=".2f", cmap="coolwarm")
-    plt.title("Correlation Matrix")
-    plt.tight_layout()
-    plt.savefig(buf, format='png')
-    plt.close()
-    buf.seek(0)
-    explanation = "This heatmap shows pairwise correlations of numeric columns."
-    return buf, 'correlation_heatmap.png', explanation
\ No newline at end of file
+    columns = heatmap_columns(corr)
+    import seaborn as sns
+    fig, ax = _figure((6, 5) if len(columns) <= HEATMAP_ANNOTATE_MAX_COLUMNS else (9, 8))
+    sns.heatmap(corr.loc[columns, columns], annot=len(columns) <= HEATMAP_ANNOTATE_MAX_COLUMNS, fmt=".2f",
+                cmap="coolwarm", vmin=-1, vmax=1, ax=ax)
+    ax.set_title("Correlation Matrix")
+    if len(columns) < len(corr):
+        explanation = (f"This heatmap shows pairwise correlations of the {len(columns)} of {len(corr)} numeric "
+                       f"columns with the strongest correlations, grouped so related columns sit together.")
+    else:
+        explanation = "This heatmap shows pairwise correlations of numeric columns, grouped so related columns sit together."
+    return _png(fig), 'correlation_heatmap.png', explanation
@@ -0,0 +1,559 @@
+import os
+import re
+import time
+import uuid
+import fcntl
+import pickle
+import shutil
+import hashlib
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from flask import current_app
+from datetime import datetime, timedelta
+from models import db, CSVFile, Upload
+from utils.cache import file_hash, get_profile_cache, get_export_cache, HASH_CHUNK_SIZE, ANALYSIS_VERSION
+from utils.storage import read_frame, data_path, append_columnar, append_csv_rows, read_csv_block, ensure_columnar, \
+    iter_frames, remove_columnar
+from utils.stats import StreamingProfiler, compute_basic_stats, stream_profile, top_values
+from utils.correlation import correlation_matrix
+from utils.memory import load_analysis_frame
+from utils.sampling import sample_csv, sample_profile
+from utils.ingest import try_infer_csv_schema, same_dialect, record_ends
+from utils.jobs import JobError
+from utils.uploads import detach
+from utils.exports import EXPORT_KINDS
+from utils.dedup import row_hashes, duplicate_mask, dedup_frames, bucket_hashes, write_row_set
+from utils.plotting import HIST_BINS, FINE_BINS, compute_bins, save_histograms
+from utils.metrics import metrics
+from utils.artifacts import get_artifact_store
+from utils.locks import single_flight
+
+# number of most frequent values kept per categorical column for charts
+TOP_VALUES = 20
+# bytes of a growing upload parsed and folded into its profile at a time
+INGEST_BLOCK_BYTES = 16 * 1024 * 1024
+EMPTY_CSV_MESSAGE = "Uploaded CSV is empty."
+
+
+def build_profile(df, content_hash, filename):
+    """
+    Run the full analysis of a dataframe and return it as a cacheable profile.
+    Besides the values shown on the analysis page, the profile records the paths
+    of every artifact it stored so a cache hit can verify they still exist.
+    The cleaned and missing exports are only named here, download_file builds them.
+    """
+    numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
+    rows = len(df)
+
+    # Count duplicates and rows with missing values, from one missing-value mask
+    with metrics.span('stats.duplicates', rows):
+        hashes = row_hashes(df)
+        dup_count = int(duplicate_mask(hashes).sum())
+    with metrics.span('stats.row_set', rows):
+        row_set = save_row_set(content_hash, bucket_hashes(hashes))
+        del hashes
+    with metrics.span('stats.missing', rows):
+        na = df.isna()
+        missing_counts = na.sum()
+        missing_rows_count = int(na.any(axis=1).sum())
+        del na
+
+    #make graphs, stored per content hash so identical uploads share them
+    with metrics.span('stats.histograms', rows):
+        hist_paths, hist_files = render_pngs(compute_bins(df, numeric_cols), content_hash)
+        fine_bins = compute_bins(df, numeric_cols, FINE_BINS)
+    categorical_cols = [col for col in df.columns if col not in numeric_cols]
+    with metrics.span('stats.basic', rows):
+        basic_stats = compute_basic_stats(df, missing_counts)
+        top = top_values(df, categorical_cols, TOP_VALUES)
+    with metrics.span('stats.correlation', rows):
+        corr = correlation_matrix(df[numeric_cols])
+        corr_spearman = correlation_matrix(df[numeric_cols], 'spearman')
+
+    return {
+        #compacted frames report the types they were loaded with
+        'dtypes': df.attrs.get('source_dtypes') or df.dtypes.astype(str).to_dict(),
+        'basic_stats': basic_stats,
+        'corr': corr,
+        'corr_spearman': corr_spearman,
+        'total_rows': rows,
+        'dup_count': dup_count,
+        'missing_stats': {col: int(n) for col, n in missing_counts.items()},
+        'missing_rows_count': missing_rows_count,
+        'cleaned_filename': f"cleaned_{filename}",
+        'missing_filename': f"missing_{filename}",
+        'numeric_cols': numeric_cols,
+        'fine_bins': fine_bins,
+        'top_values': top,
+        'hist_paths': hist_paths,
+        'artifacts': hist_files,
+        'row_set': row_set,
+        'accuracy': None,
+    }
+
+
+def build_profile_streaming(path, content_hash, filename, chunksize, profiler=None, schema=None):
+    """
+    Profile an upload that may not fit in memory in one streaming pass.
+    Histograms are estimated from the quantile sketches.
+    """
+    if profiler is None:
+        profiler = StreamingProfiler()
+    with metrics.span('stats.streaming', nbytes=os.path.getsize(path)) as span:
+        profile = stream_profile(path, chunksize=chunksize, profiler=profiler, schema=schema)
+        span.rows = profile['total_rows'] if profile else 0
+    if profile is None:
+        #no data rows at all, the in-memory path handles that trivially
+        return build_profile(read_frame(path, schema=schema), content_hash, filename)
+    return finish_streaming_profile(profile, content_hash, filename, profiler.seen_rows)
+
+
+def finish_streaming_profile(profile, content_hash, filename, seen_rows):
+    """
+    Complete a StreamingProfiler result with charts, top values and export names,
+    and store the profiler's row hashes, seen_rows, as the file's row set.
+    """
+    sketches = profile['sketches']
+    with metrics.span('stats.histograms'):
+        binned = sketch_bins(sketches, profile['numeric_cols'], HIST_BINS)
+        hist_paths, hist_files = render_pngs(binned, content_hash)
+    with metrics.span('stats.row_set', seen_rows.size):
+        row_set = save_row_set(content_hash, seen_rows.sorted_buckets())
+
+    profile.update({
+        'fine_bins': sketch_bins(sketches, profile['numeric_cols'], FINE_BINS),
+        'top_values': {
+            col: [[str(value), int(count)] for value, count in summary.top(TOP_VALUES).items()]
+            for col, summary in sketches['frequent'].items() if col not in profile['numeric_cols']
+        },
+        'cleaned_filename': f"cleaned_{filename}",
+        'missing_filename': f"missing_{filename}",
+        'hist_paths': hist_paths,
+        'artifacts': hist_files,
+        'row_set': row_set,
+    })
+    return profile
+
+
+def sketch_bins(sketches, numeric_cols, bins):
+    """
+    Estimate {column: (edges, counts)} histograms from the streaming quantile sketches.
+    """
+    binned = {}
+    for col in numeric_cols:
+        lo, hi = sketches['min'][col], sketches['max'][col]
+        if not np.isfinite(lo) or not np.isfinite(hi):
+            continue
+        edges = np.linspace(lo, hi, bins + 1) if hi > lo else np.linspace(lo - 0.5, hi + 0.5, bins + 1)
+        binned[col] = (edges, sketches['quantiles'][col].histogram(edges))
+    return binned
+
+
+def save_row_set(content_hash, buckets):
+    """
+    Store the sorted distinct row hashes of a file, bucket by bucket, as the row
+    set comparisons count changed rows from. Returns its artifact key, or None
+    when STORE_ROW_SETS is off.
+    """
+    config = current_app.config
+    if not config['STORE_ROW_SETS']:
+        return None
+    key = f"analysis/{content_hash}/rows.npz"
+    os.makedirs(config['DEDUP_SPILL_DIR'], exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=config['DEDUP_SPILL_DIR']) as tmp:
+        path = os.path.join(tmp, 'rows.npz')
+        write_row_set(path, buckets)
+        get_artifact_store().put_file(key, path)
+    return key
+
+
+def render_pngs(binned, content_hash):
+    """
+    Render histogram PNGs when RENDER_HISTOGRAM_PNGS is on. The analysis page
+    draws its charts in the browser from the JSON API, so by default nothing is written.
+    """
+    if not current_app.config['RENDER_HISTOGRAM_PNGS']:
+        return [], []
+    return save_histograms(binned, content_hash)
+
+
+def artifacts_exist(profile):
+    """
+    Check that every artifact referenced by a cached profile is still stored.
+    """
+    store = get_artifact_store()
+    return all(store.exists(key) for key in profile.get('artifacts', []))
+
+
+def _noop_progress(percent, message):
+    pass
+
+
+def cached_profile(record):
+    """
+    Return the cached profile of a CSV record, or None if it has to be computed.
+    """
+    if not record.content_hash:
+        #records uploaded before hashing was introduced get their hash on first view
+        record.content_hash = file_hash(record.filepath)
+        db.session.commit()
+
+    profile = get_profile_cache().get(record.content_hash)
+    hit = profile is not None and artifacts_exist(profile)
+    metrics.cache_lookup('profile', hit)
+    return profile if hit else None
+
+
+def quick_profile(record):
+    """
+    Return a profile of a CSV record estimated from a stratified sample, for the
+    analysis page to show while the exact profile is computed, or None when the
+    file is too small to need one or cannot be sampled. Sampling is seeded by the
+    content hash, so a file always gets the same estimates.
+    """
+    config = current_app.config
+    if record.csv_schema is None or os.path.getsize(record.filepath) < config['QUICK_LOOK_MIN_BYTES']:
+        return None
+    key = f"{record.content_hash}-sample"
+    cache = get_profile_cache()
+    profile = cache.get(key)
+    metrics.cache_lookup('quick_look', profile is not None)
+    if profile is not None:
+        return profile
+
+    def estimate():
+        with metrics.span('quick_look') as span:
+            sample = sample_csv(record.filepath, record.csv_schema, config['QUICK_LOOK_BLOCKS'],
+                                config['QUICK_LOOK_BLOCK_BYTES'], seed=int(record.content_hash[:16], 16))
+            if sample is None:
+                return None
+            span.rows, span.nbytes = len(sample[0]), sum(nbytes for _, nbytes in sample[2])
+            sampled = sample_profile(*sample, record.filename, TOP_VALUES)
+        cache.set(key, sampled)
+        return sampled
+
+    #tabs opening the same file at once share one sample
+    return single_flight(f"quick_look:{record.content_hash}", lambda: cache.get(key), estimate)
+
+
+def load_profile(record, progress=_noop_progress):
+    """
+    Return the analysis profile of a CSV record, computing and caching it on a miss.
+    Files above STREAMING_THRESHOLD_BYTES are profiled chunk by chunk. Jobs of
+    identical files, on any worker, compute it once and the others wait for it.
+    """
+    return single_flight(f"profile:{record.content_hash}", lambda: cached_profile(record),
+                         lambda: _compute_profile(record, progress),
+                         on_wait=lambda: progress(5, "Waiting for the same file's analysis in another job"))
+
+
+def _compute_profile(record, progress):
+    path = data_path(record)
+    try:
+        profile = _build_record_profile(record, path, progress)
+    except pd.errors.EmptyDataError:
+        #a file without even a header line
+        raise JobError(EMPTY_CSV_MESSAGE)
+    except pd.errors.ParserError as e:
+        raise JobError(f"Could not parse the CSV: {e}")
+    #a header without rows is not worth caching, its analysis page would be blank
+    if profile['total_rows'] == 0:
+        raise JobError(EMPTY_CSV_MESSAGE)
+    get_profile_cache().set(record.content_hash, profile)
+    return profile
+
+
+def _build_record_profile(record, path, progress):
+    if os.path.getsize(record.filepath) >= current_app.config['STREAMING_THRESHOLD_BYTES']:
+        progress(10, "Profiling the file in a streaming pass")
+        spill_root = current_app.config['DEDUP_SPILL_DIR']
+        os.makedirs(spill_root, exist_ok=True)
+        #row hashes beyond memory go to a scratch directory that only lives for this pass
+        with tempfile.TemporaryDirectory(dir=spill_root) as spill_dir:
+            profile = build_profile_streaming(path, record.content_hash, record.filename,
+                                              current_app.config['STREAM_CHUNK_ROWS'],
+                                              profiler=StreamingProfiler(spill_dir=spill_dir),
+                                              schema=record.csv_schema)
+    else:
+        progress(10, "Reading the file")
+        with metrics.span('parse', nbytes=os.path.getsize(path)) as span:
+            df = load_analysis_frame(record)
+            span.rows = len(df)
+        progress(40, "Computing statistics and charts")
+        profile = build_profile(df, record.content_hash, record.filename)
+    return profile
+
+
+def profile_upload(upload_id, progress):
+    """
+    Profile a chunked upload while it is received: whole records are folded into
+    a StreamingProfiler as chunks arrive, so once the last one lands only the
+    tail is left. The finished profile is cached for the dataset, as load_profile
+    would for a file of this size.
+    """
+    config = current_app.config
+    spill_root = config['DEDUP_SPILL_DIR']
+    os.makedirs(spill_root, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=spill_root) as spill_dir:
+        profiler = StreamingProfiler(spill_dir=spill_dir)
+        processed = None
+        while True:
+            #chunks are committed by other requests, possibly in other processes
+            db.session.expire_all()
+            upload = db.session.get(Upload, upload_id)
+            if upload is None:
+                raise JobError("The upload was cancelled.")
+            schema, complete = upload.csv_schema, upload.status == 'complete'
+            record = db.session.get(CSVFile, upload.csv_id) if complete else None
+            if record is not None and get_profile_cache().get(record.content_hash) is not None:
+                #an identical file was analysed while this one arrived, it may still need its columnar copy
+                _store_columnar(record, progress)
+                return
+            try:
+                with open(upload.path, 'rb') as f:
+                    if processed is None:
+                        processed = record_ends(f.read(HASH_CHUNK_SIZE), schema['quotechar'])[0] if schema['header'] else 0
+                    f.seek(processed)
+                    raw = f.read(min(upload.received - processed, INGEST_BLOCK_BYTES))
+            except FileNotFoundError:
+                #moved to its content address since the row was read
+                continue
+            last = complete and processed + len(raw) == upload.size
+            ends = record_ends(raw, schema['quotechar'])
+            end = len(raw) if last else (ends[-1] if len(ends) else 0)
+            if end:
+                with metrics.span('ingest.block', nbytes=end) as span:
+                    try:
+                        block = read_csv_block(raw[:end], schema)
+                    except ValueError as e:
+                        #whole records only, so this is a malformed row or bad encoding rather than a cut one
+                        raise JobError(f"Could not parse the CSV after byte {processed}: {e}")
+                    span.rows = len(block)
+                    profiler.update(block)
+                processed += end
+                progress(min(int(90 * processed / upload.size), 90),
+                         f"Analysed {processed // 2 ** 20} MB of {upload.size // 2 ** 20} MB")
+            if last:
+                break
+            if not end:
+                if len(raw) == INGEST_BLOCK_BYTES:
+                    raise JobError(f"A row of the file is longer than {INGEST_BLOCK_BYTES // 2 ** 20} MB.")
+                if upload.updated_at < datetime.utcnow() - timedelta(seconds=config['UPLOAD_EXPIRY_SECONDS']):
+                    raise JobError("The upload stopped before it was complete.")
+                progress(min(int(90 * processed / upload.size), 90), "Waiting for more of the file")
+                time.sleep(config['INGEST_POLL_SECONDS'])
+
+        profile = profiler.result()
+        if profile is None or profile['total_rows'] == 0:
+            raise JobError(EMPTY_CSV_MESSAGE)
+        progress(92, "Rendering charts")
+        get_profile_cache().set(record.content_hash, finish_streaming_profile(
+            profile, record.content_hash, record.filename, profiler.seen_rows))
+    _store_columnar(record, progress)
+
+
+def _store_columnar(record, progress):
+    progress(95, "Converting to columnar format")
+    ensure_columnar(record)
+    db.session.commit()
+
+
+def state_path(record):
+    return os.path.join(current_app.config['DATASET_STATE_DIR'], f"{record.id}.pkl")
+
+
+def hashes_dir(record):
+    #spilled duplicate-detection hashes referenced by the pickled state
+    return os.path.join(current_app.config['DATASET_STATE_DIR'], f"{record.id}-hashes")
+
+
+@contextmanager
+def dataset_lock(record):
+    """
+    Hold an exclusive lock on a dataset across processes while its rows change.
+    """
+    directory = current_app.config['DATASET_STATE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f"{record.id}.lock"), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_state(record):
+    """
+    Return the persisted StreamingProfiler of a dataset, or None if it has none
+    or it was written for a different content hash or analysis version.
+    """
+    try:
+        with open(state_path(record), 'rb') as f:
+            content_hash, version, profiler = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        #ValueError also covers spilled hash runs that no longer exist and states from
+        #before the version was stored
+        return None
+    if content_hash != record.content_hash or version != ANALYSIS_VERSION:
+        return None
+    return profiler
+
+
+def save_state(record, profiler):
+    path = state_path(record)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump((record.content_hash, ANALYSIS_VERSION, profiler), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def remove_state(record):
+    for path in (state_path(record), f"{os.path.splitext(state_path(record))[0]}.lock"):
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(hashes_dir(record), ignore_errors=True)
+
+
+def check_append_schema(record, delta_path, sample_rows=1000):
+    """
+    Compare the first rows of a delta file against a stored dataset.
+    Returns an error message, or None when the delta can be appended.
+    """
+    schema = record.csv_schema
+    if schema is not None:
+        delta_schema = try_infer_csv_schema(delta_path)
+        #the rows are appended to the original file byte for byte
+        if delta_schema is None or not same_dialect(schema, delta_schema):
+            return "The new file's encoding, delimiter or header does not match the dataset's."
+    current = read_frame(data_path(record), nrows=sample_rows, schema=schema)
+    try:
+        delta = read_frame(delta_path, nrows=sample_rows, schema=schema)
+    except Exception as e:
+        return f"Could not read the new file: {e}"
+    if list(delta.columns) != list(current.columns):
+        return "The new file's columns do not match the dataset's columns."
+    for col in current.select_dtypes(include=[np.number]).columns:
+        if not (np.issubdtype(delta[col].dtype, np.number) or delta[col].isna().all()):
+            return f"Column '{col}' is numeric in the dataset but not in the new file."
+    return None
+
+
+def append_to_dataset(record, delta_path, progress=_noop_progress):
+    """
+    Append the rows of a CSV to a dataset and update its profile by folding only
+    those rows into the dataset's persisted profiler state, so the cost follows the
+    size of the delta. The first append builds that state with one full pass.
+    When anything fails the dataset is put back as it was before the append.
+    """
+    chunksize = current_app.config['STREAM_CHUNK_ROWS']
+
+    with dataset_lock(record):
+        if not record.content_hash:
+            record.content_hash = file_hash(record.filepath)
+        #the stored object may be shared with identical uploads, which must not change
+        detach(record)
+        db.session.commit()
+        csv_size, columnar_path, part_path = os.path.getsize(record.filepath), record.columnar_path, None
+        try:
+            profiler = load_state(record)
+            if profiler is None:
+                progress(10, "Building the dataset's incremental state (first append only)")
+                shutil.rmtree(hashes_dir(record), ignore_errors=True)
+                profiler = StreamingProfiler(spill_dir=hashes_dir(record))
+                stream_profile(data_path(record), chunksize, profiler=profiler, schema=record.csv_schema)
+
+            progress(50, "Storing the new rows")
+            new_rows = delta_path
+            if record.columnar_path:
+                #the new part is typed like the existing rows, so the profiler sees the same values
+                part_path = append_columnar(record.columnar_path, delta_path, record.csv_schema)
+                record.columnar_path = os.path.dirname(part_path) if part_path else None
+                new_rows = part_path or delta_path
+            append_csv_rows(record.filepath, delta_path, header=(record.csv_schema or {}).get('header', True))
+
+            progress(70, "Folding in the new rows")
+            with metrics.span('append', nbytes=os.path.getsize(delta_path)) as span:
+                rows_before = profiler.total_rows
+                profile = stream_profile(new_rows, chunksize, profiler=profiler, schema=record.csv_schema)
+                span.rows = profiler.total_rows - rows_before
+
+            progress(90, "Hashing the dataset")
+            record.content_hash = file_hash(record.filepath)
+
+            profile = finish_streaming_profile(profile, record.content_hash, record.filename, profiler.seen_rows)
+            save_state(record, profiler)
+            get_profile_cache().set(record.content_hash, profile)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            undo_append(record, csv_size, columnar_path, part_path)
+            raise
+    return profile
+
+
+def undo_append(record, csv_size, columnar_path, part_path):
+    """
+    Cut the CSV of a dataset back to csv_size bytes after a failed append. The
+    columnar copy and the profiler state may hold part of the new rows, so they are
+    dropped and rebuilt when next needed.
+    """
+    os.truncate(record.filepath, csv_size)
+    remove_columnar(columnar_path)
+    if part_path:
+        remove_columnar(os.path.dirname(part_path))
+    if os.path.exists(state_path(record)):
+        os.remove(state_path(record))
+    shutil.rmtree(hashes_dir(record), ignore_errors=True)
+    if record.columnar_path:
+        record.columnar_path = None
+        db.session.commit()
+
+
+def export_unique_rows(record, subset=None, normalize=False, progress=_noop_progress):
+    """
+    Write a CSV of a record's rows without duplicates by the key columns in subset
+    (all columns when empty), optionally ignoring case and spacing in text.
+    Exports go to the export cache under the content hash and a key of the options,
+    so repeats are reused and deleting the file drops them.
+    Returns the export kind, unique-<key>.
+    """
+    key = hashlib.sha256(f"{sorted(subset or [])}:{normalize}".encode()).hexdigest()[:12]
+    cache = get_export_cache()
+    kind = unique_export_kind(key)
+
+    def write(out):
+        spill_root = current_app.config['DEDUP_SPILL_DIR']
+        os.makedirs(spill_root, exist_ok=True)
+        with metrics.span('dedup.export') as span, tempfile.TemporaryDirectory(dir=spill_root) as spill_dir:
+            frames = iter_frames(data_path(record), current_app.config['STREAM_CHUNK_ROWS'], record.csv_schema)
+            span.rows, _ = dedup_frames(frames, out, subset=subset, normalize=normalize, spill_dir=spill_dir)
+
+    def export():
+        progress(10, "Removing duplicate rows")
+        cache.write(record.content_hash, kind, write)
+        return kind
+
+    return single_flight(f"dedup:{record.content_hash}:{key}",
+                         lambda: kind if cache.get(record.content_hash, kind) else None, export)
+
+
+def unique_export_kind(key):
+    """
+    Export cache kind of a unique rows export, from the key of its options.
+    """
+    return f"unique-{key}"
+
+
+def is_export_kind(kind):
+    return kind in EXPORT_KINDS or re.fullmatch(r'unique-[0-9a-f]{12}', kind) is not None
+
+
+def export_filename(kind, filename):
+    """
+    Download name of an export of the CSV filename: cleaned_<name>, missing_<name>
+    or unique_<key>_<name>.
+    """
+    return f"{kind.replace('-', '_')}_{filename}"
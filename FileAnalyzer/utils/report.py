@@ -0,0 +1,123 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.utils import secure_filename
+from models import db, PDFReport
+from utils.text import clean_text
+from utils.memory import load_analysis_frame
+from utils.profile import load_profile
+from utils.plotting import create_numeric_plot, create_category_plot, create_correlation_heatmap
+from utils.ai_insights import iter_ai_insight
+from utils.metrics import metrics
+from utils.artifacts import get_artifact_store
+from utils.locks import lease_lock
+
+# move to the start of the next line after a cell, like ln=True did in the old fpdf
+# (fpdf's XPos.LMARGIN and YPos.NEXT; the names are accepted as strings so fpdf is
+# only imported when a report is built)
+NEXT_LINE = {'new_x': 'LMARGIN', 'new_y': 'NEXT'}
+
+
+def _noop_progress(percent, message):
+    pass
+
+
+def build_pdf_report(csv_record, user_prompt="", progress=_noop_progress):
+    """
+    Generate the PDF report for a CSV record, store it in the artifact store and
+    register it in the database. Returns the report filename.
+    """
+    progress(5, "Reading data")
+    #large files are summarised from their first rows so the worker never holds the whole file
+    with metrics.span('report.read') as span:
+        if os.path.getsize(csv_record.filepath) >= current_app.config['STREAMING_THRESHOLD_BYTES']:
+            df = load_analysis_frame(csv_record, nrows=current_app.config['REPORT_SAMPLE_ROWS'])
+        else:
+            df = load_analysis_frame(csv_record)
+        span.rows = len(df)
+    #the analysis profile covers every row: it supplies the statistics, correlations,
+    #histograms and top values, and the frame above only the first rows and the figures' data
+    profile = load_profile(csv_record, lambda percent, message: progress(5, message))
+
+    from fpdf import FPDF
+    #the pdf is started first so the AI text is laid out line by line while it streams in
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Helvetica", "B", 14)
+    pdf.cell(0, 10, clean_text(f"CSV Analysis Report for {csv_record.filename}"), **NEXT_LINE)
+    pdf.set_font("Helvetica", "B", 12)
+    pdf.ln(5)
+    pdf.cell(0, 10, clean_text("AI Analysis:"), **NEXT_LINE)
+    pdf.set_font("Helvetica", size=10)
+
+    # generate graphs via matplotlib while the AI answers
+    plots = [
+        (create_numeric_plot, profile.get('fine_bins')),
+        (create_category_plot, profile.get('top_values')),
+        (create_correlation_heatmap, profile.get('corr')),
+    ]
+    with ThreadPoolExecutor(max_workers=len(plots)) as pool:
+        futures = [pool.submit(func, df, precomputed) for func, precomputed in plots]
+
+        progress(15, "Asking the AI for insights")
+        pending = ""
+        with metrics.span('report.ai') as span:
+            for piece in iter_ai_insight(df, user_prompt, csv_record.content_hash, profile=profile):
+                *lines, pending = (pending + piece).split("\n")
+                for line in lines:
+                    pdf.multi_cell(0, 7, clean_text(line), **NEXT_LINE)
+            pdf.multi_cell(0, 7, clean_text(pending), **NEXT_LINE)
+            pdf.ln(5)
+
+        progress(70, "Rendering figures")
+        #the figures render during the AI answer, this is only what is left after it
+        with metrics.span('report.figures'):
+            plot_infos = [future.result() for future in futures]
+
+    #add the graphs at the end of the pdf, straight from their buffers
+    progress(85, "Laying out the PDF")
+    with metrics.span('report.pdf') as span:
+        for i, (buf, fname, explanation) in enumerate(info for info in plot_infos if info[0]):
+            pdf.add_page()
+            pdf.set_font("Helvetica", "B", 12)
+            pdf.cell(0, 10, clean_text(f"Figure {i + 1}"), **NEXT_LINE)
+            pdf.set_font("Helvetica", size=10)
+            if explanation:
+                pdf.multi_cell(0, 7, clean_text(explanation), **NEXT_LINE)
+                pdf.ln(3)
+            pdf.image(buf, x=10, w=pdf.w - 20)
+
+        #save pdf in the store, one per user and file name; a rebuilt report replaces it whole
+        pdf_filename = f"{os.path.splitext(csv_record.filename)[0]}_analysis_report.pdf"
+        key = f"reports/{secure_filename(csv_record.user_sub)}/{pdf_filename}"
+        output = bytes(pdf.output())
+        get_artifact_store().put_bytes(key, output)
+        span.nbytes = len(output)
+
+    #save pdf in db, once even when reports of the file finish together
+    with lease_lock(f"report:{key}"):
+        report = PDFReport.query.filter_by(filename=pdf_filename, user_sub=csv_record.user_sub).first()
+        if report is None:
+            db.session.add(PDFReport(
+                filename=pdf_filename,
+                user_sub=csv_record.user_sub,
+                csv_id=csv_record.id,
+                filepath=key))
+        else:
+            report.csv_id = csv_record.id
+            report.filepath = key
+        db.session.commit()
+
+    return pdf_filename
+
+
+def remove_report(report):
+    """
+    Delete the stored PDF of a report. Reports from before the artifact store
+    have an absolute path on this host instead of a key.
+    """
+    if os.path.isabs(report.filepath):
+        if os.path.exists(report.filepath):
+            os.remove(report.filepath)
+    else:
+        get_artifact_store().delete(report.filepath)
@@ -0,0 +1,180 @@
+import os
+import warnings
+import numpy as np
+import pandas as pd
+from utils.storage import read_csv_block
+from utils.correlation import correlation_matrix
+from utils.stats import top_values
+
+# two-sided 95% normal quantile used for every confidence interval
+Z_95 = 1.959964
+
+
+def sample_csv(path, schema, blocks, block_bytes, seed=0):
+    """
+    Stratified sample of a CSV for a quick look: the data is split into `blocks`
+    equal byte ranges and a block of whole lines is read at a random offset in
+    each, so the sample covers the whole file whatever its row order. A block with
+    a line that does not parse is left out with a warning. Returns
+    (frame, block ids per row, [(rows, bytes) per block], data bytes in the file).
+    """
+    rng = np.random.default_rng(seed)
+    size = os.path.getsize(path)
+    frames, block_ids, sizes = [], [], []
+    with open(path, 'rb') as f:
+        if schema['header']:
+            f.readline()
+        data_start = f.tell()
+        edges = np.linspace(data_start, size, blocks + 1).astype(np.int64)
+        for i, (lo, hi) in enumerate(zip(edges[:-1], edges[1:])):
+            offset = lo + int(rng.integers(0, max(hi - lo - block_bytes, 0) + 1))
+            f.seek(offset)
+            if offset > data_start:
+                #skip the rest of the line the offset fell into
+                f.readline()
+            start = f.tell()
+            raw = f.read(block_bytes) + f.readline()
+            if not raw:
+                continue
+            try:
+                df = read_csv_block(raw, schema)
+            except (ValueError, pd.errors.ParserError, UnicodeDecodeError) as e:
+                warnings.warn(f"Skipping sample block at byte {start} of {path}: {e}")
+                continue
+            frames.append(df)
+            block_ids.append(np.full(len(df), i))
+            sizes.append((len(df), len(raw)))
+    if not frames:
+        return None
+    df = pd.concat(frames, ignore_index=True)
+    #each block has its own categories, which concat turns back into text
+    for col in schema['columns']:
+        if col['type'] == 'category' and col['name'] in df:
+            df[col['name']] = df[col['name']].astype('category')
+    return df, np.concatenate(block_ids), sizes, size - data_start
+
+
+def ratio_estimate(y, x):
+    """
+    Ratio estimate sum(y) / sum(x) over sampled blocks with its 95% interval. The
+    variance comes from the spread between blocks, so rows that are alike within
+    a block, as in sorted files, widen the interval as they should.
+    """
+    y, x = np.asarray(y, dtype=float), np.asarray(x, dtype=float)
+    total = x.sum()
+    if total == 0:
+        return np.nan, (np.nan, np.nan)
+    ratio = y.sum() / total
+    m = len(x)
+    if m < 2:
+        return ratio, (np.nan, np.nan)
+    se = np.sqrt(m / (m - 1) * ((y - ratio * x) ** 2).sum()) / total
+    return ratio, (ratio - Z_95 * se, ratio + Z_95 * se)
+
+
+def median_interval(values, block_ids, blocks):
+    """
+    Sample median with a 95% Woodruff interval: the share of values at or below
+    the median gets a ratio-estimate interval across blocks, and its bounds are
+    read back as quantiles of the sample.
+    """
+    valid = ~np.isnan(values)
+    values, block_ids = values[valid], block_ids[valid]
+    if len(values) == 0:
+        return np.nan, (np.nan, np.nan)
+    median = float(np.median(values))
+    below = np.bincount(block_ids, weights=values <= median, minlength=blocks)
+    counts = np.bincount(block_ids, minlength=blocks)
+    _, (lo, hi) = ratio_estimate(below, counts)
+    if np.isnan(lo):
+        return median, (np.nan, np.nan)
+    return median, tuple(np.quantile(values, np.clip([lo, hi], 0.0, 1.0)))
+
+
+def _interval(ci):
+    return [float(ci[0]), float(ci[1])]
+
+
+def sample_profile(df, block_ids, sizes, data_bytes, filename, top_k=20):
+    """
+    Estimate the analysis profile of a whole file from a stratified sample, each
+    estimate with a 95% confidence interval. Duplicates cannot be estimated from a
+    sample, so dup_count is None until the exact profile arrives.
+    """
+    rows, nbytes = np.array(sizes, dtype=float).T
+    rows_per_byte, rows_ci = ratio_estimate(rows, nbytes)
+    total_rows = data_bytes * rows_per_byte
+    rows_ci = (data_bytes * rows_ci[0], data_bytes * rows_ci[1])
+
+    def estimated_count(per_block):
+        #a share of the rows, scaled to the estimated row count
+        share, ci = ratio_estimate(per_block, rows)
+        return int(round(share * total_rows)), [max(int(ci[0] * total_rows), 0), int(ci[1] * total_rows)]
+
+    blocks = np.arange(len(sizes))
+    na = df.isna()
+    missing_by_block = na.groupby(block_ids).sum().reindex(blocks, fill_value=0)
+    missing_stats, missing_ci = {}, {}
+    for col in df.columns:
+        missing_stats[col], missing_ci[col] = estimated_count(missing_by_block[col].to_numpy())
+    missing_rows = pd.Series(na.any(axis=1).to_numpy()).groupby(block_ids).sum().reindex(blocks, fill_value=0)
+    missing_rows_count, missing_rows_ci = estimated_count(missing_rows.to_numpy())
+    del na
+
+    numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
+    numeric = df[numeric_cols].astype(float)
+    sums = numeric.groupby(block_ids).sum().reindex(blocks, fill_value=0)
+    counts = numeric.groupby(block_ids).count().reindex(blocks, fill_value=0)
+
+    basic_stats = []
+    for col in df.columns:
+        if col in numeric_cols:
+            mean, mean_ci = ratio_estimate(sums[col], counts[col])
+            median, median_ci = median_interval(numeric[col].to_numpy(), block_ids, len(sizes))
+            mode = numeric[col].mode()
+            basic_stats.append({
+                'column': col,
+                'mean': float(mean),
+                'median': median,
+                'mode': float(mode.iloc[0]) if not mode.empty else 'N/A',
+                'missing': missing_stats[col],
+                'mean_ci': _interval(mean_ci),
+                'median_ci': _interval(median_ci),
+                'missing_ci': missing_ci[col],
+            })
+        else:
+            mode = df[col].mode()
+            basic_stats.append({
+                'column': col,
+                'mean': 'N/A',
+                'median': 'N/A',
+                'mode': mode.iloc[0] if not mode.empty else 'N/A',
+                'missing': missing_stats[col],
+                'missing_ci': missing_ci[col],
+            })
+
+    return {
+        'dtypes': df.dtypes.astype(str).to_dict(),
+        'basic_stats': basic_stats,
+        'corr': correlation_matrix(numeric),
+        'corr_spearman': None,
+        'total_rows': int(round(total_rows)),
+        'dup_count': None,
+        'missing_stats': missing_stats,
+        'missing_rows_count': missing_rows_count,
+        'cleaned_filename': f"cleaned_{filename}",
+        'missing_filename': f"missing_{filename}",
+        'numeric_cols': numeric_cols,
+        'top_values': top_values(df, [col for col in df.columns if col not in numeric_cols], top_k),
+        'hist_paths': [],
+        'artifacts': [],
+        'accuracy': None,
+        'sample': {
+            'rows': len(df),
+            'blocks': len(sizes),
+            'confidence': 0.95,
+            'total_rows_ci': [int(rows_ci[0]), int(rows_ci[1])],
+            'missing_ci': missing_ci,
+            'missing_rows_ci': missing_rows_ci,
+        },
+    }
@@ -0,0 +1,235 @@
+import math
+import numpy as np
+import pandas as pd
+
+
+class KLLSketch:
+    """
+    Mergeable quantile sketch (Karnin, Lang & Liberty). Keeps O(k log(n/k)) values
+    in weighted levels, so memory does not grow with the number of rows.
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, values):
+        """
+        Add an array of values; NaNs are ignored.
+        """
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if not values.size:
+            return
+        self.n += values.size
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other):
+        """
+        Fold another sketch into this one.
+        """
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                items = np.sort(items)
+                # an odd leftover stays behind so total weight is preserved exactly
+                keep = items[-1:] if len(items) % 2 else items[:0]
+                pairs = items[:len(items) - len(keep)]
+                promoted = pairs[self._rng.integers(2)::2]
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+                self.levels[level] = keep
+            level += 1
+
+    def _weighted(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(l), 2 ** h, dtype=float) for h, l in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        return items[order], np.cumsum(weights[order])
+
+    def quantiles(self, qs):
+        """
+        Return approximate values at the given quantiles (0..1).
+        """
+        qs = np.atleast_1d(np.asarray(qs, dtype=float))
+        if not self.n:
+            return np.full(qs.shape, np.nan)
+        items, cum = self._weighted()
+        idx = np.searchsorted(cum, qs * cum[-1], side='left')
+        return items[np.minimum(idx, len(items) - 1)]
+
+    def cdf(self, points):
+        """
+        Return the approximate fraction of values <= each point.
+        """
+        points = np.asarray(points, dtype=float)
+        if not self.n:
+            return np.zeros(points.shape)
+        items, cum = self._weighted()
+        idx = np.searchsorted(items, points, side='right')
+        return np.where(idx > 0, cum[np.maximum(idx - 1, 0)], 0.0) / cum[-1]
+
+    def histogram(self, edges):
+        """
+        Estimate bin counts for the given bin edges from the sketch.
+        """
+        edges = np.asarray(edges, dtype=float)
+        # bins are closed on the left and the last on both sides, like np.histogram,
+        # so values on an edge land in the same bin as in the in-memory histograms
+        below = np.concatenate([np.nextafter(edges[:-1], -np.inf), edges[-1:]])
+        return np.diff(self.cdf(below) * self.n).round().astype(int)
+
+    def normalized_rank_error(self):
+        """
+        Approximate rank error of a single quantile query (99% confidence).
+        """
+        return 2.296 / self.k ** 0.9723
+
+
+class MisraGries:
+    """
+    Mergeable frequent-items summary with at most k counters. Every reported count
+    underestimates the true count by at most max_error.
+    """
+
+    def __init__(self, k=64):
+        self.k = k
+        self.n = 0
+        self.max_error = 0
+        self.counts = pd.Series(dtype='int64')
+
+    def update(self, values):
+        """
+        Add a pandas Series of values; missing values are ignored.
+        """
+        vc = values.value_counts(dropna=True)
+        self.n += int(vc.sum())
+        self._fold(vc)
+
+    def merge(self, other):
+        self.n += other.n
+        self.max_error += other.max_error
+        self._fold(other.counts)
+
+    def _fold(self, counts):
+        merged = self.counts.add(counts, fill_value=0).astype('int64')
+        if len(merged) > self.k:
+            threshold = int(merged.nlargest(self.k + 1).iloc[-1])
+            merged = merged - threshold
+            merged = merged[merged > 0]
+            self.max_error += threshold
+        self.counts = merged
+
+    def top(self, n=None):
+        """
+        Return the heaviest items as a Series sorted by descending count.
+        """
+        top = self.counts.sort_values(ascending=False, kind='stable')
+        return top if n is None else top.head(n)
+
+
+class PairwiseMoments:
+    """
+    Mergeable sums over pairs of numeric columns, enough to derive per-column mean
+    and variance and the pairwise-complete Pearson correlation that df.corr() gives.
+    Values are shifted by a per-column constant to limit cancellation error. The
+    products of each block run in dtype (float32 halves their cost) and are added
+    to float64 sums.
+    """
+    # pickles from before dtype was configurable keep computing in float64
+    dtype = np.float64
+
+    def __init__(self, columns, dtype=np.float64):
+        p = len(columns)
+        self.columns = list(columns)
+        self.dtype = dtype
+        self.shift = None
+        self.n = np.zeros((p, p))
+        self.sx = np.zeros((p, p))
+        self.sxx = np.zeros((p, p))
+        self.sxy = np.zeros((p, p))
+
+    def update(self, block):
+        """
+        Add a 2D float array (rows x columns) where NaN marks a missing value.
+        """
+        block = np.asarray(block, dtype=float)
+        if self.shift is None:
+            with np.errstate(all='ignore'):
+                self.shift = np.nan_to_num(np.nanmean(block, axis=0)) if len(block) else np.zeros(block.shape[1])
+        x = block - self.shift
+        present = ~np.isnan(x)
+        if present.all():
+            #without missing values every pair sees every row, so the mask products are column sums
+            x = x.astype(self.dtype)
+            self.n += len(x)
+            self.sx += x.sum(axis=0, dtype=float)[:, None]
+            self.sxx += (x * x).sum(axis=0, dtype=float)[:, None]
+            self.sxy += x.T @ x
+            return
+        x0 = np.where(present, x, 0.0).astype(self.dtype)
+        mask = present.astype(self.dtype)
+        self.n += mask.T @ mask
+        self.sx += x0.T @ mask
+        self.sxx += (x0 * x0).T @ mask
+        self.sxy += x0.T @ x0
+
+    def merge(self, other):
+        """
+        Fold another set of moments over the same columns into this one.
+        """
+        if other.shift is None:
+            return
+        if self.shift is None:
+            self.shift = other.shift.copy()
+        # re-express the other sums relative to this shift: x = x_other + d
+        d = other.shift - self.shift
+        di, dj = d[:, None], d[None, :]
+        self.n += other.n
+        self.sxy += other.sxy + dj * other.sx + di * other.sx.T + di * dj * other.n
+        self.sxx += other.sxx + 2 * di * other.sx + di * di * other.n
+        self.sx += other.sx + di * other.n
+
+    def count(self):
+        return np.diag(self.n).astype(int)
+
+    def mean(self):
+        n = np.diag(self.n)
+        if self.shift is None:
+            return np.full(len(self.columns), np.nan)
+        with np.errstate(all='ignore'):
+            return np.where(n > 0, self.shift + np.diag(self.sx) / n, np.nan)
+
+    def var(self):
+        n, sx, sxx = np.diag(self.n), np.diag(self.sx), np.diag(self.sxx)
+        with np.errstate(all='ignore'):
+            return np.where(n > 1, (sxx - sx * sx / n) / (n - 1), np.nan)
+
+    def corr(self):
+        """
+        Return the pairwise-complete correlation matrix as a DataFrame.
+        """
+        n, sx, sxx = self.n, self.sx, self.sxx
+        with np.errstate(all='ignore'):
+            cov = n * self.sxy - sx * sx.T
+            var_x = n * sxx - sx * sx
+            r = cov / np.sqrt(var_x * var_x.T)
+        r = np.where(n < 2, np.nan, np.clip(r, -1.0, 1.0))
+        return pd.DataFrame(r, index=self.columns, columns=self.columns)
@@ -1,33 +1,281 @@
+import warnings
 import pandas as pd
 import numpy as np
+from utils.sketches import KLLSketch, MisraGries, PairwiseMoments
+from utils.correlation import correlation_matrix
+from utils.storage import iter_frames
+from utils.dedup import HashStore, row_hashes
 
 
-def compute_basic_stats(df):
+# object columns longer than this are first checked for cardinality on a sample
+MODE_SAMPLE_ROWS = 100_000
+# above this distinct ratio in the sample, the mode is taken from the sample only
+MODE_DISTINCT_RATIO = 0.5
+# equal-width ranges a streamed numeric column without a frequent value takes its mode from
+DENSITY_MODE_BINS = 50
+
+
+def _mode(col_data):
+    """
+    Most frequent value using hash-based counting instead of Series.mode's sort.
+    Ties resolve to the smallest value, as Series.mode does.
+    """
+    counts = col_data.value_counts(sort=False)
+    if counts.empty:
+        return None
+    best = counts.index[counts.to_numpy() == counts.max()]
+    try:
+        return best.min()
+    except TypeError:
+        return best[0]
+
+
+def _numeric_medians_and_modes(block):
+    """
+    Medians and modes of every column of a float block from one sort along the
+    rows. NaNs sort last, so each column's valid values form a prefix.
+    """
+    ordered = np.sort(block, axis=0)
+    n_valid = (~np.isnan(block)).sum(axis=0)
+
+    lower = np.take_along_axis(ordered, np.maximum((n_valid - 1) // 2, 0)[None, :], axis=0)[0]
+    upper = np.take_along_axis(ordered, np.maximum(n_valid // 2, 0)[None, :], axis=0)[0]
+    medians = np.where(n_valid > 0, (lower + upper) / 2, np.nan)
+
+    modes = np.full(block.shape[1], np.nan)
+    for j, n in enumerate(n_valid):
+        if not n:
+            continue
+        values = ordered[:n, j]
+        starts = np.flatnonzero(np.concatenate([[True], values[1:] != values[:-1]]))
+        runs = np.diff(np.append(starts, n))
+        # argmax takes the first longest run, i.e. the smallest of tied values
+        modes[j] = values[starts[runs.argmax()]]
+    return medians, modes
+
+
+def _object_mode(col_data):
+    if len(col_data) <= MODE_SAMPLE_ROWS:
+        return _mode(col_data)
+    sample = col_data.sample(MODE_SAMPLE_ROWS, random_state=0)
+    # a mostly unique column has no meaningful exact mode, so the sample's is enough
+    if sample.nunique() > MODE_DISTINCT_RATIO * MODE_SAMPLE_ROWS:
+        return _mode(sample)
+    return _mode(col_data)
+
+
+def compute_basic_stats(df, missing=None):
     """
-    Compute mean, median, mode, and missing count for each column.
+    Compute mean, median, mode, and missing count for each column, and the standard
+    deviation and range of numeric ones, like the streaming profile.
+    Numeric columns are handled as one float block: means in one vectorized pass,
+    medians and modes from a single sort. Other columns use hash-based modes.
+    missing takes per-column missing counts the caller already has.
     """
+    numeric_cols = [col for col in df.columns if pd.api.types.is_numeric_dtype(df[col])]
+    block = df[numeric_cols].to_numpy(dtype=float, na_value=np.nan)
+    with warnings.catch_warnings():
+        # all-missing columns give NaN, like Series.mean does
+        warnings.simplefilter('ignore', RuntimeWarning)
+        means = dict(zip(numeric_cols, np.nanmean(block, axis=0)))
+        stds = dict(zip(numeric_cols, np.nanstd(block, axis=0, ddof=1)))
+        mins = dict(zip(numeric_cols, np.nanmin(block, axis=0, initial=np.inf)))
+        maxs = dict(zip(numeric_cols, np.nanmax(block, axis=0, initial=-np.inf)))
+    medians, modes = _numeric_medians_and_modes(block)
+    medians, modes = dict(zip(numeric_cols, medians)), dict(zip(numeric_cols, modes))
+    if missing is None:
+        missing = df.isna().sum()
+
     stats = []
     for col in df.columns:
-        col_data = df[col]
-        modes = col_data.mode()
-        mode_val = (
-            float(modes.iloc[0]) if pd.api.types.is_numeric_dtype(col_data) and not modes.empty
-            else modes.iloc[0] if not modes.empty
-            else 'N/A'
-        )
-        stats.append({
-            'column': col,
-            'mean': float(col_data.mean()) if pd.api.types.is_numeric_dtype(col_data) else 'N/A',
-            'median': float(col_data.median()) if pd.api.types.is_numeric_dtype(col_data) else 'N/A',
-            'mode': mode_val,
-            'missing': int(col_data.isna().sum())
-        })
+        if col in means:
+            stats.append({
+                'column': col,
+                'mean': float(means[col]),
+                'median': float(medians[col]),
+                'mode': float(modes[col]) if not np.isnan(modes[col]) else 'N/A',
+                'std': float(stds[col]),
+                'min': float(mins[col]),
+                'max': float(maxs[col]),
+                'missing': int(missing[col])
+            })
+        else:
+            mode = _object_mode(df[col])
+            stats.append({
+                'column': col,
+                'mean': 'N/A',
+                'median': 'N/A',
+                'mode': mode if mode is not None else 'N/A',
+                'missing': int(missing[col])
+            })
     return stats
 
 
+def top_values(df, columns, k=20):
+    """
+    Return the k most frequent values of each column as {column: [[label, count], ...]}.
+    """
+    return {
+        col: [[str(value), int(count)] for value, count in df[col].value_counts().head(k).items()]
+        for col in columns
+    }
+
+
 def make_corr_html(df):
     """
     Generate HTML table for correlation matrix of numeric columns.
     """
-    corr = df.select_dtypes(include=[np.number]).corr()
+    return corr_to_html(correlation_matrix(df))
+
+
+def corr_to_html(corr):
+    """
+    Render an already computed correlation matrix as an HTML table.
+    """
     return corr.to_html(classes='table table-bordered text-black', border=0) if not corr.empty else ''
+
+
+class StreamingProfiler:
+    """
+    Single-pass profile state that chunks are folded into one at a time. Memory
+    depends on the column count, not the row count, except for the 64-bit hashes
+    of distinct rows used to count duplicates, which spill to spill_dir when given.
+    The state pickles, so a dataset can keep it and later fold in only newly
+    appended rows.
+    Medians come from KLL sketches and modes from Misra-Gries summaries; the
+    'accuracy' entry of result() reports how far those may be off. A numeric column
+    whose values rarely repeat leaves its summary empty, and its mode is then the
+    centre of the densest range of its quantile sketch.
+    """
+
+    def __init__(self, quantile_k=200, top_k=64, spill_dir=None):
+        self.quantile_k = quantile_k
+        self.top_k = top_k
+        self.total_rows = self.missing_rows = self.dup_count = 0
+        self.dtypes, self.numeric_cols, self.missing = None, [], {}
+        self.moments, self.quantiles, self.mins, self.maxs, self.frequent = None, {}, {}, {}, {}
+        self.seen_rows = HashStore(spill_dir)
+
+    def _init_schema(self, chunk):
+        # the first chunk fixes the schema; later chunks are coerced to it
+        self.dtypes = chunk.dtypes.astype(str).to_dict()
+        self.numeric_cols = chunk.select_dtypes(include=[np.number]).columns.tolist()
+        self.moments = PairwiseMoments(self.numeric_cols)
+        self.missing = {col: 0 for col in chunk.columns}
+        for col in self.numeric_cols:
+            self.quantiles[col] = KLLSketch(k=self.quantile_k)
+            self.mins[col], self.maxs[col] = np.inf, -np.inf
+        self.frequent = {col: MisraGries(k=self.top_k) for col in chunk.columns}
+
+    def update(self, chunk):
+        """
+        Fold a DataFrame chunk into the state. Returns the chunk's (missing rows,
+        duplicate rows) boolean masks; numeric columns are coerced in place.
+        """
+        if self.dtypes is None:
+            self._init_schema(chunk)
+
+        numeric_cols = self.numeric_cols
+        for col in numeric_cols:
+            if not pd.api.types.is_numeric_dtype(chunk[col]):
+                chunk[col] = pd.to_numeric(chunk[col], errors='coerce')
+        block = chunk[numeric_cols].to_numpy(dtype=float, na_value=np.nan)
+        self.moments.update(block)
+        if len(block):
+            with np.errstate(all='ignore'):
+                chunk_min, chunk_max = np.nanmin(block, axis=0), np.nanmax(block, axis=0)
+            for i, col in enumerate(numeric_cols):
+                self.quantiles[col].update(block[:, i])
+                self.mins[col] = np.fmin(self.mins[col], chunk_min[i])
+                self.maxs[col] = np.fmax(self.maxs[col], chunk_max[i])
+        for col, summary in self.frequent.items():
+            summary.update(chunk[col])
+
+        missing_mask = chunk.isna()
+        for col, n in missing_mask.sum().items():
+            self.missing[col] += int(n)
+        missing_mask = missing_mask.any(axis=1).to_numpy()
+        self.missing_rows += int(missing_mask.sum())
+
+        dup_mask = self.seen_rows.add(row_hashes(chunk))
+        self.dup_count += int(dup_mask.sum())
+        self.total_rows += len(chunk)
+        return missing_mask, dup_mask
+
+    def result(self):
+        """
+        Return the profile described by the current state, or None before any chunk.
+        """
+        if self.dtypes is None:
+            return None
+        means, stds = self.moments.mean(), np.sqrt(self.moments.var())
+        basic_stats, density_modes = [], []
+        for col in self.dtypes:
+            top = self.frequent[col].top(1)
+            if col in self.quantiles:
+                i = self.numeric_cols.index(col)
+                if top.empty and self.quantiles[col].n:
+                    density_modes.append(col)
+                    mode = self._density_mode(col)
+                else:
+                    mode = float(top.index[0]) if not top.empty else 'N/A'
+                basic_stats.append({
+                    'column': col,
+                    'mean': float(means[i]),
+                    'median': float(self.quantiles[col].quantiles(0.5)[0]),
+                    'mode': mode,
+                    'std': float(stds[i]),
+                    'min': float(self.mins[col]),
+                    'max': float(self.maxs[col]),
+                    'missing': self.missing[col]
+                })
+            else:
+                basic_stats.append({
+                    'column': col,
+                    'mean': 'N/A',
+                    'median': 'N/A',
+                    'mode': top.index[0] if not top.empty else 'N/A',
+                    'missing': self.missing[col]
+                })
+
+        return {
+            'dtypes': dict(self.dtypes),
+            'basic_stats': basic_stats,
+            'corr': self.moments.corr(),
+            #ranks need the whole column, which a single pass does not keep
+            'corr_spearman': None,
+            'total_rows': self.total_rows,
+            'dup_count': self.dup_count,
+            'missing_stats': dict(self.missing),
+            'missing_rows_count': self.missing_rows,
+            'numeric_cols': list(self.numeric_cols),
+            'sketches': {'quantiles': self.quantiles, 'frequent': self.frequent, 'min': self.mins, 'max': self.maxs},
+            'accuracy': {
+                'median_rank_error': KLLSketch(k=self.quantile_k).normalized_rank_error() if self.quantiles else 0.0,
+                'mode_max_undercount': {col: s.max_error for col, s in self.frequent.items()},
+                'density_modes': density_modes,
+            },
+        }
+
+    def _density_mode(self, col):
+        lo, hi = self.mins[col], self.maxs[col]
+        if lo == hi:
+            return float(lo)
+        edges = np.linspace(lo, hi, DENSITY_MODE_BINS + 1)
+        i = int(np.argmax(self.quantiles[col].histogram(edges)))
+        return float((edges[i] + edges[i + 1]) / 2)
+
+
+def stream_profile(path, chunksize=100_000, on_chunk=None, profiler=None, schema=None):
+    """
+    Profile a stored upload (CSV or Parquet) in a single pass over fixed-size
+    chunks. Pass a StreamingProfiler to keep (or continue) its state.
+    on_chunk(chunk, missing_mask, dup_mask) is called for every chunk so callers
+    can write exports during the same pass. schema is the CSV's ingestion schema.
+    """
+    profiler = profiler or StreamingProfiler()
+    for chunk in iter_frames(path, chunksize, schema):
+        missing_mask, dup_mask = profiler.update(chunk)
+        if on_chunk is not None:
+            on_chunk(chunk, missing_mask, dup_mask)
+    return profiler.result()
@@ -0,0 +1,286 @@
+import io
+import os
+import uuid
+import shutil
+import warnings
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as pa_ds
+import pyarrow.parquet as pq
+
+PARQUET_COMPRESSION = 'zstd'
+CSV_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+def _convert_options(**kwargs):
+    #empty fields are missing values, as in pandas.read_csv
+    return pa_csv.ConvertOptions(strings_can_be_null=True, **kwargs)
+
+
+def _arrow_type(col_type):
+    return {
+        'int64': pa.int64(), 'float64': pa.float64(), 'bool': pa.bool_(), 'string': pa.string(),
+        'category': pa.dictionary(pa.int32(), pa.string()), 'datetime': pa.timestamp('ns'),
+    }[col_type]
+
+
+def _arrow_options(schema=None, column_types=None, typed=True, include_columns=None):
+    """
+    pyarrow read, parse and convert options for a CSV described by an ingestion
+    schema (see utils.ingest), or pyarrow's own inference without one. column_types
+    overrides the schema's types; typed=False keeps only the dialect.
+    """
+    read, parse, convert = {'block_size': CSV_BLOCK_SIZE}, {}, {}
+    if include_columns is not None:
+        convert['include_columns'] = list(include_columns)
+    if schema:
+        #pyarrow skips a byte order mark itself and only transcodes other encodings
+        read['encoding'] = 'utf8' if schema['encoding'] in ('utf-8', 'utf-8-sig') else schema['encoding']
+        if not schema['header']:
+            read['column_names'] = [col['name'] for col in schema['columns']]
+        parse['delimiter'], parse['quote_char'] = schema['delimiter'], schema['quotechar']
+        if typed and column_types is None:
+            column_types = {col['name']: _arrow_type(col['type']) for col in schema['columns']}
+        formats = [col['format'] for col in schema['columns'] if col['type'] == 'datetime']
+        if typed and formats:
+            convert['timestamp_parsers'] = [pa_csv.ISO8601, *dict.fromkeys(formats)]
+    if column_types:
+        convert['column_types'] = column_types
+    return pa_csv.ReadOptions(**read), pa_csv.ParseOptions(**parse), _convert_options(**convert)
+
+
+def _pandas_options(schema):
+    """
+    pandas.read_csv arguments for a CSV described by an ingestion schema. Numeric
+    and boolean columns are left to the parser, since a later chunk may hold missing
+    values or text the sampled rows did not; numbers and dates are converted
+    afterwards by _convert_columns.
+    """
+    if not schema:
+        return {}
+    dtypes = {'string': 'str', 'category': 'category', 'datetime': 'str'}
+    return {
+        'sep': schema['delimiter'], 'quotechar': schema['quotechar'], 'encoding': schema['encoding'],
+        'header': 0 if schema['header'] else None,
+        'names': None if schema['header'] else [col['name'] for col in schema['columns']],
+        'dtype': {col['name']: dtypes[col['type']] for col in schema['columns'] if col['type'] in dtypes},
+    }
+
+
+def _convert_columns(df, schema, source):
+    """
+    Give the numeric and date columns of a frame parsed by pandas the types of the
+    ingestion schema. Values that are not numbers become missing, with a warning,
+    and float columns stay float64 in chunks that happen to hold only integers.
+    """
+    for col in (schema or {}).get('columns', []):
+        name = col['name']
+        if name not in df:
+            continue
+        if col['type'] == 'datetime':
+            df[name] = pd.to_datetime(df[name], format=col['format'], errors='coerce')
+        elif col['type'] in ('int64', 'float64'):
+            if not pd.api.types.is_numeric_dtype(df[name]):
+                numbers = pd.to_numeric(df[name], errors='coerce')
+                bad = int((numbers.isna() & df[name].notna()).sum())
+                warnings.warn(f"{bad} values of column {name} in {source} are not numbers, reading them as missing")
+                df[name] = numbers
+            if col['type'] == 'float64' and df[name].dtype != 'float64':
+                df[name] = df[name].astype('float64')
+    return df
+
+
+def convert_to_columnar(csv_path, parquet_path, schema=None):
+    """
+    Convert a CSV to a compressed Parquet file in a streaming pass, so the file is
+    parsed and typed once. With an ingestion schema the columns get its types,
+    low-cardinality text becoming dictionary columns; when a later row does not
+    fit them, the conversion is redone with pyarrow's own inference. Returns the
+    Parquet path, or None when the file does not parse, or a later block does not
+    match the inferred types.
+    """
+    tmp_path = f"{parquet_path}.{uuid.uuid4().hex}.tmp"
+    for typed in ([True, False] if schema else [False]):
+        writer = None
+        try:
+            reader = pa_csv.open_csv(csv_path, *_arrow_options(schema, typed=typed))
+            for batch in reader:
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_path, reader.schema, compression=PARQUET_COMPRESSION)
+                writer.write_batch(batch)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, reader.schema, compression=PARQUET_COMPRESSION)
+            writer.close()
+            os.replace(tmp_path, parquet_path)
+            return parquet_path
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, OSError) as e:
+            if writer is not None:
+                writer.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if typed:
+                warnings.warn(f"{csv_path} does not fit its inferred schema, converting with inferred types: {e}")
+            else:
+                warnings.warn(f"Keeping {csv_path} as CSV only, columnar conversion failed: {e}")
+    return None
+
+
+def append_columnar(columnar_path, csv_path, schema=None):
+    """
+    Add the rows of a CSV as a new part of a columnar copy, parsed with the copy's
+    column types and the dialect of the ingestion schema. A single Parquet file is first moved into a directory of parts,
+    which then becomes the copy's path. Returns the new part's path, or None after
+    removing the copy when the rows do not fit its schema, so reads fall back to the CSV.
+    """
+    if not columnar_path or not os.path.exists(columnar_path):
+        return None
+    if not os.path.isdir(columnar_path):
+        parts_dir = f"{os.path.splitext(columnar_path)[0]}_parts"
+        os.makedirs(parts_dir, exist_ok=True)
+        os.replace(columnar_path, os.path.join(parts_dir, 'part-00000.parquet'))
+        columnar_path = parts_dir
+
+    part_schema = pa_ds.dataset(columnar_path, format='parquet').schema
+    part_path = os.path.join(columnar_path, f"part-{len(os.listdir(columnar_path)):05d}.parquet")
+    try:
+        reader = pa_csv.open_csv(csv_path, *_arrow_options(
+            schema, column_types=dict(zip(part_schema.names, part_schema.types))))
+        if reader.schema.names != part_schema.names:
+            raise pa.ArrowInvalid(f"columns {reader.schema.names} do not match {part_schema.names}")
+        with pq.ParquetWriter(part_path, part_schema, compression=PARQUET_COMPRESSION) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+        return part_path
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, OSError) as e:
+        warnings.warn(f"Dropping columnar copy {columnar_path}, appended rows do not fit it: {e}")
+        shutil.rmtree(columnar_path, ignore_errors=True)
+        return None
+
+
+def append_csv_rows(csv_path, delta_path, header=True):
+    """
+    Append the data rows of delta_path (everything after its header line, if it
+    has one) to csv_path.
+    """
+    with open(csv_path, 'rb+') as target, open(delta_path, 'rb') as delta:
+        target.seek(0, os.SEEK_END)
+        if target.tell():
+            target.seek(-1, os.SEEK_END)
+            if target.read(1) != b'\n':
+                target.write(b'\n')
+        if header:
+            delta.readline()
+        shutil.copyfileobj(delta, target)
+
+
+def remove_columnar(columnar_path):
+    """
+    Delete a columnar copy, whether a single file or a directory of parts.
+    """
+    if not columnar_path or not os.path.exists(columnar_path):
+        return
+    if os.path.isdir(columnar_path):
+        shutil.rmtree(columnar_path)
+    else:
+        os.remove(columnar_path)
+
+
+def _is_parquet(path):
+    return path.lower().endswith('.parquet') or os.path.isdir(path)
+
+
+def _read_csv(path, columns=None, nrows=None, schema=None):
+    """
+    Parse a CSV with pyarrow's multithreaded reader, typed by the ingestion schema,
+    falling back to pandas when the data does not fit.
+    """
+    try:
+        options = _arrow_options(schema, include_columns=columns)
+        if nrows is None:
+            return pa_csv.read_csv(path, *options).to_pandas()
+        reader = pa_csv.open_csv(path, *options)
+        batches, rows = [], 0
+        for batch in reader:
+            batches.append(batch)
+            rows += len(batch)
+            if rows >= nrows:
+                break
+        return pa.Table.from_batches(batches, schema=reader.schema).slice(0, nrows).to_pandas()
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+        warnings.warn(f"Parsing {path} with pandas, pyarrow could not: {e}")
+    df = pd.read_csv(path, usecols=columns, nrows=nrows, **_pandas_options(schema))
+    return _convert_columns(df, schema, path)
+
+
+def read_frame(path, columns=None, nrows=None, schema=None):
+    """
+    Load a stored upload as a DataFrame. Parquet files are memory-mapped and only
+    the requested columns are read; CSV files are parsed with the types of their
+    ingestion schema when one is given.
+    """
+    if _is_parquet(path) and os.path.isdir(path):
+        dataset = pa_ds.dataset(path, format='parquet')
+        table = dataset.head(nrows, columns=columns) if nrows is not None else dataset.to_table(columns=columns)
+        return table.to_pandas()
+    if _is_parquet(path):
+        if nrows is not None:
+            batches = pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=nrows, columns=columns)
+            batch = next(batches, None)
+            if batch is None:
+                return pq.read_schema(path).empty_table().to_pandas()
+            return batch.to_pandas()
+        return pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+    return _read_csv(path, columns, nrows, schema)
+
+
+def read_csv_block(raw, schema):
+    """
+    Parse bytes holding whole data lines of a CSV, without its header, with the
+    dialect, column names and types of its ingestion schema. As with read_frame, a
+    line that does not parse, as when a block starts inside a quoted field, raises
+    pandas.errors.ParserError rather than being dropped.
+    """
+    options = _pandas_options(schema)
+    options.update(header=None, names=[col['name'] for col in schema['columns']])
+    df = pd.read_csv(io.BytesIO(raw), **options)
+    return _convert_columns(df, schema, 'a block of the upload')
+
+
+def iter_frames(path, chunksize, schema=None):
+    """
+    Yield a stored upload as DataFrames of at most chunksize rows. CSV chunks are
+    parsed by pandas with the ingestion schema's types, which keeps a column's
+    dtype the same in every chunk.
+    """
+    if _is_parquet(path):
+        if os.path.isdir(path):
+            batches = pa_ds.dataset(path, format='parquet').to_batches(batch_size=chunksize)
+        else:
+            batches = pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=chunksize)
+        for batch in batches:
+            yield batch.to_pandas()
+        return
+    for chunk in pd.read_csv(path, chunksize=chunksize, **_pandas_options(schema)):
+        yield _convert_columns(chunk, schema, path)
+
+
+def data_path(record):
+    """
+    Return the best file to read a CSV record's data from: its columnar copy when
+    one exists, otherwise the original CSV.
+    """
+    if record.columnar_path and os.path.exists(record.columnar_path):
+        return record.columnar_path
+    return record.filepath
+
+
+def ensure_columnar(record):
+    """
+    Create the columnar copy of a CSV record if it has none yet.
+    The caller is responsible for committing the record.
+    """
+    if record.columnar_path and os.path.exists(record.columnar_path):
+        return
+    parquet_path = f"{os.path.splitext(record.filepath)[0]}.parquet"
+    record.columnar_path = convert_to_columnar(record.filepath, parquet_path, record.csv_schema)
@@ -0,0 +1,229 @@
+import os
+import uuid
+import fcntl
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask import current_app
+from models import db, CSVFile, Upload, Job
+from utils.cache import HASH_CHUNK_SIZE, get_profile_cache
+from utils.ingest import try_infer_csv_schema
+from utils.jobs import job_queue
+
+# running whole-file hashes of uploads in progress, so each chunk is hashed once
+MAX_HASHERS = 64
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+
+
+class ChunkError(Exception):
+    """
+    Raised when a chunk is refused; status is the HTTP status to answer with.
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def object_path(content_hash):
+    """
+    Content-addressed location of an upload, so identical files share one object.
+    """
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'objects', content_hash[:2], f"{content_hash}.csv")
+
+
+def is_object(path):
+    return os.path.dirname(os.path.dirname(path)) == os.path.join(current_app.config['UPLOAD_FOLDER'], 'objects')
+
+
+def incoming_path(name):
+    directory = os.path.join(current_app.config['UPLOAD_FOLDER'], 'incoming')
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+def save_hashed(stream, path):
+    """
+    Write a stream to path and return the sha256 hex digest of what was written.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'wb') as f:
+        for piece in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+            digest.update(piece)
+            f.write(piece)
+    return digest.hexdigest()
+
+
+def store_object(path, content_hash):
+    """
+    Move a completely received file to its content address and return that path.
+    When an identical file is stored already the new copy is dropped.
+    """
+    target = object_path(content_hash)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.exists(target):
+        os.remove(path)
+    else:
+        os.replace(path, target)
+    return target
+
+
+def add_dataset(user_sub, filename, path, content_hash, csv_schema=None):
+    """
+    Store a received file and create its CSV record, sharing the columnar copy of
+    an identical dataset when there is one. The caller commits.
+    """
+    filepath = store_object(path, content_hash)
+    twin = CSVFile.query.filter(CSVFile.filepath == filepath, CSVFile.columnar_path.isnot(None)).first()
+    record = CSVFile(user_sub=user_sub, filename=filename, filepath=filepath, content_hash=content_hash,
+                     csv_schema=csv_schema if csv_schema is not None else try_infer_csv_schema(filepath),
+                     columnar_path=twin.columnar_path if twin and os.path.exists(twin.columnar_path) else None)
+    db.session.add(record)
+    db.session.flush()
+    return record
+
+
+def shares_files(record):
+    """
+    Whether another record reads the same stored files as this one.
+    """
+    return CSVFile.query.filter(CSVFile.filepath == record.filepath, CSVFile.id != record.id).first() is not None
+
+
+def detach(record):
+    """
+    Give a record private copies of its content-addressed files before its rows
+    change, since other records may share them. The caller commits.
+    """
+    if not is_object(record.filepath):
+        return
+    directory = os.path.join(current_app.config['UPLOAD_FOLDER'], 'datasets')
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, f"{record.id}_{uuid.uuid4().hex[:8]}")
+    shutil.copyfile(record.filepath, f"{base}.csv")
+    if record.columnar_path and os.path.isfile(record.columnar_path):
+        shutil.copyfile(record.columnar_path, f"{base}.parquet")
+        record.columnar_path = f"{base}.parquet"
+    else:
+        record.columnar_path = None
+    record.filepath = f"{base}.csv"
+
+
+def start_upload(user_sub, filename, size):
+    """
+    Open a chunked upload of size bytes and drop uploads abandoned for longer
+    than UPLOAD_EXPIRY_SECONDS.
+    """
+    expired = datetime.utcnow() - timedelta(seconds=current_app.config['UPLOAD_EXPIRY_SECONDS'])
+    for stale in Upload.query.filter(Upload.status == 'receiving', Upload.updated_at < expired):
+        if os.path.exists(stale.path):
+            os.remove(stale.path)
+        db.session.delete(stale)
+
+    upload_id = uuid.uuid4().hex
+    upload = Upload(id=upload_id, user_sub=user_sub, filename=filename, size=size,
+                    path=incoming_path(f"{upload_id}.part"), updated_at=datetime.utcnow())
+    open(upload.path, 'wb').close()
+    db.session.add(upload)
+    db.session.commit()
+    return upload
+
+
+def _file_hasher(upload, offset):
+    with _hashers_lock:
+        entry = _hashers.pop(upload.id, None)
+    if entry is not None and entry[0] == offset:
+        return entry[1]
+    #earlier chunks went to another process, catch up from the stored prefix
+    digest = hashlib.sha256()
+    with open(upload.path, 'rb') as f:
+        remaining = offset
+        while remaining:
+            piece = f.read(min(HASH_CHUNK_SIZE, remaining))
+            if not piece:
+                break
+            digest.update(piece)
+            remaining -= len(piece)
+    return digest
+
+
+def _keep_hasher(upload_id, offset, digest):
+    with _hashers_lock:
+        _hashers[upload_id] = (offset, digest)
+        while len(_hashers) > MAX_HASHERS:
+            _hashers.popitem(last=False)
+
+
+def receive_chunk(upload, stream, offset, checksum, length):
+    """
+    Write one chunk of an upload at offset, checking it against its sha256 hex
+    checksum, and hash it into the running digest of the whole file. A chunk is
+    only accepted at the offset the upload has reached, so a client that lost a
+    response resends from there. The last chunk completes the upload.
+    """
+    config = current_app.config
+    if upload.status != 'receiving':
+        raise ChunkError("The upload is already complete.", 409)
+    if offset != upload.received:
+        raise ChunkError(f"Expected the chunk at offset {upload.received}.", 409)
+    if not checksum:
+        raise ChunkError("The X-Chunk-SHA256 header is missing.")
+    if not length or length > config['UPLOAD_CHUNK_BYTES'] or offset + length > upload.size:
+        raise ChunkError(f"Chunks must hold 1 to {config['UPLOAD_CHUNK_BYTES']} bytes within the file.", 413)
+
+    with open(upload.path, 'r+b') as f:
+        #one writer per upload across processes
+        fcntl.flock(f, fcntl.LOCK_EX)
+        db.session.refresh(upload)
+        if offset != upload.received:
+            raise ChunkError(f"Expected the chunk at offset {upload.received}.", 409)
+        chunk_digest = hashlib.sha256()
+        prefix_digest = _file_hasher(upload, offset)
+        file_digest = prefix_digest.copy()
+        f.seek(offset)
+        written = 0
+        for piece in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+            chunk_digest.update(piece)
+            file_digest.update(piece)
+            f.write(piece)
+            written += len(piece)
+        if written != length or chunk_digest.hexdigest() != checksum.lower():
+            f.truncate(offset)
+            _keep_hasher(upload.id, offset, prefix_digest)
+            raise ChunkError("The chunk does not match its checksum, send it again.")
+        f.flush()
+        upload.received = offset + written
+        upload.updated_at = datetime.utcnow()
+        db.session.commit()
+    _keep_hasher(upload.id, upload.received, file_digest)
+
+    complete = upload.received == upload.size
+    if upload.csv_schema is None and (complete or upload.received >= config['UPLOAD_SNIFF_BYTES']):
+        upload.csv_schema = try_infer_csv_schema(upload.path, max_bytes=upload.received)
+        #large files are profiled from the chunks received so far while the rest arrives
+        if upload.csv_schema and not complete and upload.size >= config['STREAMING_THRESHOLD_BYTES']:
+            upload.job_id = job_queue.enqueue('ingest', upload.user_sub, params={'upload_id': upload.id}).id
+        db.session.commit()
+    if complete:
+        complete_upload(upload)
+
+
+def complete_upload(upload):
+    """
+    Move a fully received upload to its content address and create its dataset.
+    Unless a job already profiles it, or an identical file was analysed before,
+    an analysis job is queued.
+    """
+    content_hash = _file_hasher(upload, upload.size).hexdigest()
+    record = add_dataset(upload.user_sub, upload.filename, upload.path, content_hash, upload.csv_schema)
+    upload.path, upload.csv_id, upload.status = record.filepath, record.id, 'complete'
+    if upload.job_id:
+        db.session.execute(db.update(Job).where(Job.id == upload.job_id).values(csv_id=record.id))
+    db.session.commit()
+    if upload.job_id is None and get_profile_cache().get(record.content_hash) is None:
+        upload.job_id = job_queue.enqueue('analysis', upload.user_sub, csv_id=record.id).id
+        db.session.commit()
+    return record